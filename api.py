@@ -1,21 +1,63 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
-from fastapi.encoders import jsonable_encoder
-from fastapi import Path
+from fastapi import Path, Body
 from fastapi.responses import PlainTextResponse
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+from typing import Optional, List
 import psycopg2
-import os
 import logging
 from dotenv import load_dotenv
-from datetime import timedelta
+from datetime import timedelta, datetime
 import json
+import asyncio
+
+import db
+import queries
+import fastjson
+import conditional
+import compression
+import metrics
+import profiler
+from fastjson import FastJSONResponse
+import downsample
+import forecast_report
+import etl_events
+from cache import aggregate_cache
+from search_index import product_index
+from autocomplete import suggestions_index
+from forecast_pool import forecast_pool, ForecastOverloaded, ForecastTimeout
+from forecast_memo import forecast_memo, UNSTAMPED
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+if not all([db.DB_CONFIG['password'], db.DB_CONFIG['host'], db.DB_CONFIG['port']]):
+    logger.error("Missing required environment variables")
+    raise RuntimeError("PG_PASSWORD, PG_HOST and PG_PORT must all be set")
+
+@asynccontextmanager
+async def lifespan(app):
+    db.init_pool(cursor_factory=metrics.TimedCursor)
+    try:
+        with db.connection() as conn:
+            product_index.load(conn)
+            suggestions_index.load(conn)
+    except Exception as e:
+        # /api/search and /api/search-suggest fall back to SQL until the first successful refresh
+        logger.error(f"Search index load failed: {e}")
+    etl_events.start_listener()
+    try:
+        yield
+    finally:
+        etl_events.stop_listener()
+        forecast_pool.shutdown()
+        db.close_pool()
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -23,72 +65,180 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=compression.MIN_COMPRESS_SIZE)
+app.add_middleware(metrics.MetricsMiddleware)
+profiler.install(app)
 
-DB_NAME     = "staging"
-DB_USER     = "postgres"
-DB_PASSWORD = os.getenv("PG_PASSWORD")
-DB_HOST     = os.getenv("PG_HOST")
-DB_PORT     = os.getenv("PG_PORT")
+# Aggregates span the whole catalog, so any ETL commit invalidates all of them
+etl_events.subscribe(lambda asins: aggregate_cache.invalidate())
 
-if not all([DB_PASSWORD, DB_HOST, DB_PORT]):
-    logger.error("Missing required environment variables")
-    raise RuntimeError("PG_PASSWORD, PG_HOST and PG_PORT must all be set")
+def refresh_search_index(asins):
+    with db.connection() as conn:
+        product_index.refresh(conn, asins)
+        suggestions_index.refresh(conn, asins)
+
+etl_events.subscribe(refresh_search_index)
+
+# Forecast memo entries are keyed by data stamp; drop the ones new prices made unreachable
+etl_events.subscribe(forecast_memo.evict)
+
+def pool_timeout_response(e):
+    logger.error(f"Connection pool exhausted: {e}")
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Database busy, please retry", "details": str(e)},
+        headers={"Retry-After": "1"},
+    )
 
-def get_conn():
-    return psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT
+def forecast_overloaded_response(e):
+    logger.warning(f"Forecast request shed: {e}")
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Forecast service busy, please retry", "details": str(e)},
+        headers={"Retry-After": str(e.retry_after)},
     )
 
+def forecast_timeout_response(e):
+    logger.warning(str(e))
+    return JSONResponse(
+        status_code=504,
+        content={"error": "Forecast timed out", "details": str(e)},
+    )
+
+def catalog_version():
+    """Latest change anywhere in the catalog; cached until the next ETL event."""
+    def compute():
+        with db.connection() as conn, conn.cursor() as cur:
+            cur.execute(queries.CATALOG_VERSION_SQL)
+            return cur.fetchone()[0]
+
+    return aggregate_cache.get_or_compute("catalog-version", compute)
+
+def cached_list_response(request, key, sql, label, params=None):
+    """
+    Serve a list query from the aggregate cache; on a miss, one request
+    runs `sql` and concurrent requests for the same key wait for it.
+    The body's ETag is computed once, when it is cached, and each
+    compressed variant once, when a client first asks for it.
+    """
+    def compute():
+        logger.info(f"Connecting to DB for {label}...")
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                cols = [c.name for c in cur.description]
+                rows = cur.fetchall()
+
+        logger.info(f"Fetched {len(rows)} {label}")
+        body = fastjson.rows_json(cols, rows)
+        return compression.EncodedBody(body, conditional.body_etag(body), catalog_version())
+
+    cached = aggregate_cache.get_or_compute(key, compute)
+    if conditional.is_not_modified(request, cached.etag, cached.last_modified):
+        return conditional.not_modified(cached.etag, cached.last_modified)
+    return cached.response(request, headers=conditional.validator_headers(cached.etag, cached.last_modified))
+
+@app.get("/api/cache-stats")
+def get_cache_stats():
+    """
+    Returns hit/miss counters for the homepage aggregate cache.
+    """
+    return aggregate_cache.stats()
+
+@app.get("/api/pool-stats")
+def get_pool_stats():
+    """
+    Returns connection pool usage counters.
+    """
+    return db.get_pool().stats()
+
+@app.get("/api/forecast-stats")
+def get_forecast_stats():
+    """
+    Returns forecast pool queue depth, shed and timed out requests, and
+    forecast memo counters.
+    """
+    return {**forecast_pool.stats(), 'memo': forecast_memo.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Prometheus metrics: per-route request latency, status counts and SQL
+    timings, plus connection pool, aggregate cache, forecast pool and memo gauges.
+    """
+    pool_stats = db.get_pool().stats()
+    cache_stats = aggregate_cache.stats()
+    gauges = {
+        "db_pool_open_connections": ("Open pooled connections.", pool_stats['open']),
+        "db_pool_in_use_connections": ("Pooled connections checked out.", pool_stats['in_use']),
+        "db_pool_waiting": ("Requests waiting for a pooled connection.", pool_stats['waiting']),
+        "db_pool_timeouts": ("Checkouts that timed out since startup.", pool_stats['timeouts']),
+        "aggregate_cache_entries": ("Entries in the aggregate cache.", cache_stats['entries']),
+        "aggregate_cache_hit_ratio": ("Aggregate cache hit ratio since startup.", cache_stats['hit_ratio']),
+        **forecast_pool.gauges(),
+        **forecast_memo.gauges(),
+    }
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
 @app.get("/products/")
-def get_products():
+@profiler.profiled
+def get_products(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=queries.PRODUCTS_PAGE_MAX, description="Page size; enables cursor pagination"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. asin,title,raw_price"),
+):
     """
     Return all products along with their latest raw_price & raw_discount.
     Datetimes are JSON-encoded automatically.
+
+    With `limit` or `cursor`, returns one keyset page as
+    {"items": [...], "next_cursor": ..., "total_estimate": ...} instead of
+    the full array. `fields` projects the columns in either mode.
     """
-    sql = """
-SELECT
-  p.asin,
-  p.title,
-  p.high_res_image_url,
-  p.image_url,
-  p.category,
-  p.availability,
-  ph.raw_price,
-  ph.raw_discount,
-  ph.ts AS last_scraped
-FROM products p
-LEFT JOIN LATERAL (
-  SELECT raw_price, raw_discount, ts
-  FROM price_history
-  WHERE asin = p.asin
-  ORDER BY ts DESC
-  LIMIT 1
-) ph ON TRUE
-ORDER BY 
-  NOT availability, 
-  p.title;
-    """
+    paged = limit is not None or cursor is not None
+    try:
+        if paged or fields:
+            names = queries.parse_fields(fields)
+            if paged and limit is None:
+                limit = queries.PRODUCTS_PAGE_DEFAULT
+            sql, params = queries.build_products_page_query(names, cursor, limit if paged else None)
+        else:
+            sql, params = queries.PRODUCTS_SQL, None
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
 
     try:
+        if not paged and not fields:
+            # The full catalog is what the homepage loads; cache it with its compressed variants
+            return cached_list_response(request, "products", sql, "products")
+
+        last_modified = catalog_version()
+        etag = conditional.make_etag("products", last_modified, request.url.query)
+        if conditional.is_not_modified(request, etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+
         logger.info("Connecting to DB…")
-        conn = get_conn()
-        cur  = conn.cursor()
-        cur.execute(sql)
-        cols = [c.name for c in cur.description]
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                cols = [c.name for c in cur.description]
+                rows = cur.fetchall()
+                if paged:
+                    cur.execute(queries.PRODUCTS_ESTIMATE_SQL)
+                    total_estimate = cur.fetchone()[0]
 
-        data = [dict(zip(cols, row)) for row in rows]
-        logger.info(f"Fetched {len(data)} products")
+        if paged:
+            data = queries.products_page_payload(cols, rows, limit, total_estimate)
+            logger.info(f"Fetched page of {len(data['items'])} products")
+        else:
+            data = queries.strip_page_keys(cols, rows)
+            logger.info(f"Fetched {len(data)} products")
 
-        # use jsonable_encoder to turn datetime into ISO strings
-        return JSONResponse(content=jsonable_encoder(data))
+        return FastJSONResponse(content=data, headers=conditional.validator_headers(etag, last_modified))
 
+    except db.PoolTimeout as e:
+        return pool_timeout_response(e)
     except psycopg2.OperationalError as e:
         logger.error(f"DB connection failed: {e}")
         return JSONResponse(
@@ -102,54 +252,164 @@ ORDER BY
             content={"error": "An unexpected error occurred", "details": str(e)}
         )
 
+def stream_products(sql, params):
+    """
+    Yield the catalog as NDJSON from a server-side cursor, one batch of
+    STREAM_BATCH_SIZE rows at a time, so memory stays flat however large
+    the catalog is. The pooled connection is held until the stream ends.
+
+    The first next() checks out the connection, runs the query and fetches
+    the first batch, then yields None: the route does that before sending
+    headers, so those failures get the usual error responses.
+    """
+    started = False
+    try:
+        with db.connection() as conn:
+            with conn.cursor(name="products_stream") as cur:
+                cur.itersize = queries.STREAM_BATCH_SIZE
+                cur.execute(sql, params)
+                rows = cur.fetchmany(queries.STREAM_BATCH_SIZE)
+                started = True
+                yield None
+                sent = 0
+                while rows:
+                    cols = [c.name for c in cur.description]
+                    sent += len(rows)
+                    yield queries.ndjson_lines(cols, rows)
+                    rows = cur.fetchmany(queries.STREAM_BATCH_SIZE)
+        logger.info(f"Streamed {sent} products")
+    except Exception as e:
+        if not started:
+            raise
+        # Headers are already sent, so the client sees a truncated stream
+        logger.error(f"Error streaming products: {e}")
+
+@app.get("/products/stream")
+def get_products_stream(
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. asin,title,raw_price"),
+):
+    """
+    Stream every product with its latest price as NDJSON (one JSON object
+    per line), in the same order as /products/.
+    """
+    try:
+        names = queries.parse_fields(fields)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    sql, params = queries.build_products_page_query(names, None, None)
+    stream = stream_products(sql, params)
+    try:
+        next(stream)
+
+    except db.PoolTimeout as e:
+        return pool_timeout_response(e)
+    except psycopg2.OperationalError as e:
+        logger.error(f"DB connection failed: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Database connection failed", "details": str(e)}
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error streaming products: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "An unexpected error occurred", "details": str(e)}
+        )
+    return StreamingResponse(stream, media_type="application/x-ndjson")
+
+@app.post("/products/batch")
+@profiler.profiled
+def get_products_batch(
+    asins: List[str] = Body(..., embed=True, description=f"Up to {queries.PRODUCTS_BATCH_MAX} ASINs"),
+    points: Optional[int] = Query(None, ge=downsample.MIN_POINTS, le=downsample.MAX_POINTS,
+                                  description="Downsample each history to about this many points"),
+    start: Optional[datetime] = Query(None, alias="from", description="Only history at or after this time"),
+    end: Optional[datetime] = Query(None, alias="to", description="Only history at or before this time"),
+    history_format: str = Query("rows", alias="format", description="'rows' or the compact 'columnar'"),
+):
+    """
+    Details for many products in one round trip: a map of ASIN to the same
+    payload as /products/{asin}, or null for unknown ASINs.
+    """
+    if history_format not in queries.HISTORY_FORMATS:
+        return JSONResponse(status_code=400, content={"error": f"Unknown format: {history_format}"})
+    try:
+        asins = queries.parse_batch_asins(asins)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    if not asins:
+        return JSONResponse(content={})
+
+    try:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(queries.PRODUCTS_BATCH_SQL, (asins,))
+                product_rows = cur.fetchall()
+                cur.execute(*queries.price_history_batch_query(asins, start, end))
+                history_rows = cur.fetchall()
+
+        logger.info(f"Fetched {len(product_rows)} of {len(asins)} products with {len(history_rows)} price records.")
+        return FastJSONResponse(content=queries.products_batch_payload(
+            asins, product_rows, history_rows, points, history_format))
+
+    except db.PoolTimeout as e:
+        return pool_timeout_response(e)
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return JSONResponse(
+            content={"error": "An unexpected error occurred", "details": str(e)},
+            status_code=500
+        )
+
 @app.get("/products/{asin}")
-def get_product_details(asin: str = Path(..., description="ASIN of the product")):
+@profiler.profiled
+def get_product_details(
+    request: Request,
+    asin: str = Path(..., description="ASIN of the product"),
+    points: Optional[int] = Query(None, ge=downsample.MIN_POINTS, le=downsample.MAX_POINTS,
+                                  description="Downsample the history to about this many points"),
+    start: Optional[datetime] = Query(None, alias="from", description="Only history at or after this time"),
+    end: Optional[datetime] = Query(None, alias="to", description="Only history at or before this time"),
+    history_format: str = Query("rows", alias="format", description="'rows' or the compact 'columnar'"),
+):
+    if history_format not in queries.HISTORY_FORMATS:
+        return JSONResponse(status_code=400, content={"error": f"Unknown format: {history_format}"})
     try:
         logger.info("Connecting to DB...")
-        conn = get_conn()  # Use the existing connection function
-        cur = conn.cursor()
-
-        # Fetch product info from `products` table
-        cur.execute("""
-            SELECT asin, title, high_res_image_url, category, availability
-            FROM products
-            WHERE asin = %s
-        """, (asin,))
-        product_row = cur.fetchone()
-
-        if not product_row:
-            return JSONResponse(content={"error": "Product not found"}, status_code=404)
-
-        # Get all price history records
-        cur.execute("""
-            SELECT raw_price, raw_discount, ts
-            FROM price_history
-            WHERE asin = %s
-            ORDER BY ts ASC -- Ensure chronological order for the chart
-        """, (asin,))
-        
-        all_rows = cur.fetchall()
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                # Answer revalidations from the product's data version alone
+                cur.execute(queries.PRODUCT_VERSION_SQL, (asin,))
+                version = cur.fetchone()
+
+                if not version:
+                    return JSONResponse(content={"error": "Product not found"}, status_code=404)
+
+                last_modified, observations = version
+                etag = conditional.make_etag("product", asin, last_modified, observations, request.url.query)
+                if conditional.is_not_modified(request, etag, last_modified):
+                    return conditional.not_modified(etag, last_modified)
+
+                # Fetch product info from `products` table
+                cur.execute(queries.PRODUCT_SQL, (asin,))
+                product_row = cur.fetchone()
+
+                if not product_row:
+                    return JSONResponse(content={"error": "Product not found"}, status_code=404)
+
+                # Price history, limited to the requested range if any
+                cur.execute(*queries.price_history_query(asin, start, end))
+
+                all_rows = cur.fetchall()
         
-        product_data = {
-            "asin": product_row[0],
-            "title": product_row[1],
-            "image_url": product_row[2],
-            "category": product_row[3],
-            "availability": product_row[4],
-            "price_history": [
-                {
-                    "raw_price": row[0],
-                    "raw_discount": row[1],
-                    "timestamp": row[2].isoformat()  # Use consistent key name with frontend
-                } for row in all_rows # <-- Use all_rows directly
-            ]
-        }
-
-        cur.close()
-        conn.close()
-        logger.info(f"Fetched product {asin} with {len(all_rows)} price records (full history).") # Updated log message
-        return JSONResponse(content=product_data)
+        product_data = queries.product_details(product_row, all_rows, points, history_format)
+
+        logger.info(f"Fetched product {asin} with {len(all_rows)} price records.")
+        return FastJSONResponse(content=product_data,
+                                headers=conditional.validator_headers(etag, last_modified))
 
+    except db.PoolTimeout as e:
+        return pool_timeout_response(e)
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         return JSONResponse(
@@ -158,248 +418,74 @@ def get_product_details(asin: str = Path(..., description="ASIN of the product")
         )
 
 @app.get("/api/search-suggest")
+@profiler.profiled
 def suggest(q: str = Query(...)):
     """
     Provides search suggestions based on user input.
-    Returns top 5 matching product titles.
+    Returns top 5 matching product titles, brands or categories,
+    from the in-memory prefix index once it is loaded, else from SQL.
     """
     if not q or len(q.strip()) < 2:
         return []
+
+    if suggestions_index.ready:
+        return suggestions_index.suggest(q, limit=5)
     
-    conn = get_conn()
     try:
-        with conn.cursor() as cur:
+        with db.connection() as conn, conn.cursor() as cur:
             # Get top 5 unique suggestions (titles or categories) based on query relevance.
-            # Prioritize prefix matches in title, then general title matches, then category matches.
-            cur.execute("""
-                SELECT value
-                FROM (
-                    SELECT title AS value, 1 AS priority FROM products WHERE title ILIKE %s
-                    UNION ALL
-                    SELECT title AS value, 2 AS priority FROM products WHERE title ILIKE %s AND title NOT ILIKE %s -- Avoid duplicating prefix matches
-                    UNION ALL
-                    SELECT category AS value, 3 AS priority FROM products WHERE category ILIKE %s
-                ) AS suggestions
-                WHERE value IS NOT NULL AND value != ''
-                GROUP BY value
-                ORDER BY MIN(priority), value -- Order by best priority, then alphabetically
-                LIMIT 5
-            """, (f"{q}%", f"%{q}%", f"{q}%", f"%{q}%")) # Pass q% twice for the NOT ILIKE condition
+            cur.execute(queries.SUGGEST_SQL, queries.suggest_params(q))
             
             return [row[0] for row in cur.fetchall()]
     
     except Exception as e:
         logger.error(f"Error generating suggestions: {e}")
         return []
-    finally:
-        conn.close()
 
 @app.get("/api/search")
+@profiler.profiled
 def search(q: str = Query(...)):
     """
     Performs an enhanced product search based on user query,
     with improved handling for typos, missing spaces, and partial matches.
+    Served from the in-memory index once it is loaded, else from SQL.
     """
-    conn = get_conn()
     results = []
     
+    if product_index.ready:
+        results = product_index.search(q)
+        return FastJSONResponse(content={"results": results, "query": q})
+
     try:
-        with conn.cursor() as cur:
-            # Parse the query to extract any special filters
-            price_under = None
-            
-            # Check for "under $X" pattern
-            import re
-            price_match = re.search(r'under\s*\$?(\d+)', q.lower())
-            if price_match:
-                price_under = int(price_match.group(1))
-            
-            # Extract base search term (removing filters)
-            base_term = re.sub(r'under\s*\$?\d+', '', q.lower()).strip()
-            
-            # Preprocessing search term
-            # 1. Remove special characters
-            clean_term = re.sub(r'[^\w\s]', '', base_term)
-            # 2. Transform hyphenated terms to both hyphenated and non-hyphenated versions
-            search_variants = [clean_term]
-            
-            # Handle hyphenation: "tp-link" should find "tplink" and vice versa
-            if '-' in clean_term:
-                search_variants.append(clean_term.replace('-', ''))
-            else:
-                # Find possible hyphenation points in compound words
-                # Look for common brand patterns like "tplink" -> "tp-link"
-                common_prefixes = ['tp', 'wi', 'dl', 'net', 'web', 'air', 'my', 'home', 'smart', 'blue', 'fire']
-                for prefix in common_prefixes:
-                    if clean_term.startswith(prefix) and len(clean_term) > len(prefix):
-                        hyphenated_variant = f"{prefix}-{clean_term[len(prefix):]}"
-                        search_variants.append(hyphenated_variant)
-            
-            # 3. Split into words to search for each word individually
-            words = clean_term.split()
-            
-            # Build the query with all necessary product details and improved search logic
-            query = """
-                SELECT 
-                    p.asin,
-                    p.title,
-                    p.high_res_image_url,
-                    p.image_url,
-                    p.category,
-                    p.availability,
-                    ph.raw_price,
-                    ph.raw_discount,
-                    ph.ts AS last_scraped,
-                    similarity(p.title, %s) as title_similarity
-                FROM products p
-                LEFT JOIN LATERAL (
-                    SELECT raw_price, raw_discount, ts
-                    FROM price_history
-                    WHERE asin = p.asin
-                    ORDER BY ts DESC
-                    LIMIT 1
-                ) ph ON TRUE
-                WHERE 1=1
-            """
-            
-            # Start with params containing the full query for similarity calculation
-            params = [base_term]
-            
-            # Build a complex WHERE clause that matches any of our variants
-            where_clauses = []
-            
-            # 1. Add full term matching (both original and variants)
-            for variant in search_variants:
-                where_clauses.append("p.title ILIKE %s")
-                params.append(f"%{variant}%")
-            
-            # 2. Add category matching
-            where_clauses.append("p.category ILIKE %s")
-            params.append(f"%{clean_term}%")
-            
-            # 3. Match individual words (if there are multiple)
-            if len(words) > 1:
-                word_conditions = []
-                for word in words:
-                    if len(word) >= 3:  # Only consider words of significant length
-                        where_clauses.append("p.title ILIKE %s")
-                        params.append(f"%{word}%")
-            
-            # 4. Use trigram similarity for fuzzy matching (helps with typos)
-            # Only apply this for terms that are long enough
-            if len(clean_term) >= 4:
-                where_clauses.append("similarity(p.title, %s) > 0.3")
-                params.append(clean_term)
-            
-            # Combine all WHERE conditions with OR
-            if where_clauses:
-                query += " AND (" + " OR ".join(where_clauses) + ")"
-            
-            # 5. Add price filter if specified
-            if price_under:
-                query += " AND CAST(REGEXP_REPLACE(COALESCE(ph.raw_price, '0'), '[^0-9.]', '', 'g') AS DECIMAL) < %s"
-                params.append(price_under)
-            
-            # Improved ordering to prioritize best matches
-            query += """
-                ORDER BY 
-                    CASE WHEN p.title ILIKE %s THEN 100 ELSE 0 END +  -- Exact match
-                    CASE WHEN p.title ILIKE %s THEN 50 ELSE 0 END +   -- Starts with match
-                    similarity(p.title, %s) * 30 +                     -- Overall similarity
-                    CASE 
-                        WHEN p.title ~* %s THEN 25                     -- Regex pattern match
-                        ELSE 0 
-                    END DESC,
-                    ph.ts DESC NULLS LAST
-                LIMIT 30
-            """
-            
-            # Add parameters for the ORDER BY clause
-            params.append(f"{clean_term}")        # Exact match
-            params.append(f"{clean_term}%")       # Starts with
-            params.append(clean_term)             # For similarity
-            
-            # Regex pattern to find words that might be split or joined incorrectly
-            # e.g., "tplink" should match "tp-link" and vice versa
-            pattern = '|'.join([re.escape(w) for w in words if len(w) >= 2])
-            if pattern:
-                params.append(pattern)
-            else:
-                params.append(clean_term)  # Fallback if no words to create pattern
-            
-            cur.execute(query, tuple(params))
+        with db.connection() as conn, conn.cursor() as cur:
+            query, params = queries.build_search_query(q)
+            cur.execute(query, params)
             cols = [desc[0] for desc in cur.description]
-            
-            for row in cur.fetchall():
-                result_dict = dict(zip(cols, row))
-                # Remove the similarity score before returning to client
-                if 'title_similarity' in result_dict:
-                    del result_dict['title_similarity']
-                results.append(result_dict)
+            results = queries.search_results(cols, cur.fetchall())
     
+    except db.PoolTimeout as e:
+        return pool_timeout_response(e)
     except Exception as e:
         logger.error(f"Error searching products: {e}")
         return JSONResponse(
             status_code=500,
             content={"error": "Failed to search products", "details": str(e)}
         )
-    finally:
-        conn.close()
     
-    return JSONResponse(content=jsonable_encoder({"results": results, "query": q}))
+    return FastJSONResponse(content={"results": results, "query": q})
 
 @app.get("/api/products/trending")
-def get_trending_products():
+@profiler.profiled
+def get_trending_products(request: Request):
     """
     Returns top 10 products with the most unique raw_price changes.
     """
-    sql = """
-    WITH TrendingASINs AS (
-        SELECT
-          ph.asin,
-          COUNT(DISTINCT ph.raw_price) AS unique_price_changes
-        FROM price_history ph
-        WHERE ph.raw_price IS NOT NULL AND ph.raw_price <> ''
-        GROUP BY ph.asin
-        ORDER BY unique_price_changes DESC
-        LIMIT 12
-    )
-    SELECT
-      p.asin,
-      p.title,
-      p.high_res_image_url,
-      p.image_url,
-      p.category,
-      p.availability,
-      ph_latest.raw_price,
-      ph_latest.raw_discount,
-      ph_latest.ts AS last_scraped,
-      ta.unique_price_changes
-    FROM products p
-    JOIN TrendingASINs ta ON p.asin = ta.asin
-    LEFT JOIN LATERAL (
-      SELECT raw_price, raw_discount, ts
-      FROM price_history
-      WHERE asin = p.asin
-      ORDER BY ts DESC
-      LIMIT 1
-    ) ph_latest ON TRUE
-    ORDER BY ta.unique_price_changes DESC;
-    """
+    sql = queries.TRENDING_SQL
     try:
-        logger.info("Connecting to DB for trending products...")
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute(sql)
-        cols = [c.name for c in cur.description]
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        data = [dict(zip(cols, row)) for row in rows]
-        logger.info(f"Fetched {len(data)} trending products")
-        return JSONResponse(content=jsonable_encoder(data))
+        return cached_list_response(request, "trending", sql, "trending products")
 
+    except db.PoolTimeout as e:
+        return pool_timeout_response(e)
     except psycopg2.OperationalError as e:
         logger.error(f"DB connection failed for trending products: {e}")
         return JSONResponse(
@@ -414,97 +500,21 @@ def get_trending_products():
         )
 
 @app.get("/api/products/deals")
-def get_todays_deals():
-    """
-    Returns top 10 products with the most significant recent price drops (last 2 days).
-    """
-    sql = """
-    WITH NumericPriceHistory AS (
-        SELECT
-            asin,
-            ts,
-            raw_price AS original_raw_price, -- Keep original for display
-            raw_discount,
-            -- Attempt to convert raw_price to numeric, handling potential errors by returning NULL
-            CASE
-                WHEN raw_price ~ E'^[^0-9]*[0-9]+([,.][0-9]+)?[^0-9]*$'
-                THEN CAST(REGEXP_REPLACE(raw_price, '[^0-9.]', '', 'g') AS DECIMAL(12,2))
-                ELSE NULL
-            END AS numeric_price
-        FROM price_history
-        WHERE raw_price IS NOT NULL AND raw_price <> ''
-    ),
-    RankedPriceHistory AS (
-        SELECT
-            nph.asin,
-            nph.numeric_price,
-            nph.original_raw_price,
-            nph.raw_discount,
-            nph.ts,
-            LAG(nph.numeric_price, 1, NULL) OVER (PARTITION BY nph.asin ORDER BY nph.ts ASC) AS previous_numeric_price,
-            ROW_NUMBER() OVER (PARTITION BY nph.asin ORDER BY nph.ts DESC) as rn
-        FROM NumericPriceHistory nph
-        WHERE nph.numeric_price IS NOT NULL -- Only consider entries where conversion was successful
-    ),
-    RecentPriceDrops AS (
-        SELECT
-            rph.asin,
-            p.title,
-            p.high_res_image_url,
-            p.image_url,
-            p.category,
-            p.availability,
-            rph.numeric_price AS current_numeric_price,
-            rph.previous_numeric_price,
-            ph_latest.raw_price AS current_raw_price_display, -- For displaying the current price string
-            ph_latest.raw_discount AS current_raw_discount_display, -- For displaying current discount
-            rph.ts AS price_update_ts
-        FROM RankedPriceHistory rph
-        JOIN products p ON rph.asin = p.asin
-        LEFT JOIN LATERAL ( -- To get the latest raw_price and raw_discount string for the product
-          SELECT raw_price, raw_discount, ts
-          FROM price_history
-          WHERE asin = p.asin
-          ORDER BY ts DESC
-          LIMIT 1
-        ) ph_latest ON TRUE
-        WHERE rph.rn = 1 -- Only the latest processed record for each product
-          AND rph.previous_numeric_price IS NOT NULL -- Ensure there's a previous price to compare
-          AND rph.numeric_price < rph.previous_numeric_price
-          AND rph.ts >= NOW() - INTERVAL '2 days' -- The price drop observation is recent
-    )
-    SELECT
-        rd.asin,
-        rd.title,
-        rd.high_res_image_url,
-        rd.image_url,
-        rd.category,
-        rd.availability,
-        rd.current_raw_price_display AS raw_price,    -- Consistent naming for frontend
-        rd.current_raw_discount_display AS raw_discount, -- Consistent naming for frontend
-        rd.price_update_ts AS last_scraped,       -- Timestamp of the price drop
-        rd.current_numeric_price,
-        rd.previous_numeric_price,
-        ( (rd.previous_numeric_price - rd.current_numeric_price) / rd.previous_numeric_price ) * 100 AS discount_percentage -- Calculate percentage
-    FROM RecentPriceDrops rd
-    WHERE rd.previous_numeric_price > 0 -- Avoid division by zero
-    ORDER BY discount_percentage DESC, rd.price_update_ts DESC
-    LIMIT 12;
+@profiler.profiled
+def get_todays_deals(
+    request: Request,
+    hours: int = Query(queries.DEALS_WINDOW_HOURS, ge=1, le=24 * 365, description="Look-back window for price drops")
+):
+    """
+    Returns top 10 products with the most significant recent price drops
+    (last `hours`, 2 days by default).
     """
+    sql = queries.DEALS_SQL
     try:
-        logger.info("Connecting to DB for today's deals...")
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute(sql)
-        cols = [c.name for c in cur.description]
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        data = [dict(zip(cols, row)) for row in rows]
-        logger.info(f"Fetched {len(data)} products for today's deals")
-        return JSONResponse(content=jsonable_encoder(data))
+        return cached_list_response(request, f"deals:{hours}", sql, "products for today's deals", (hours,))
 
+    except db.PoolTimeout as e:
+        return pool_timeout_response(e)
     except psycopg2.OperationalError as e:
         logger.error(f"DB connection failed for today's deals: {e}")
         return JSONResponse(
@@ -519,92 +529,18 @@ def get_todays_deals():
         )
 
 @app.get("/api/products/bestsellers")
-def get_bestseller_products():
+@profiler.profiled
+def get_bestseller_products(request: Request):
     """
     Returns top 10 products with the largest percentage discount 
     from their highest historical price to their current price.
     """
-    sql = """
-    WITH NumericPriceHistory AS (
-        -- Convert raw_price to numeric, handling potential errors
-        SELECT
-            asin,
-            ts,
-            raw_price AS original_raw_price,
-            raw_discount,
-            CASE
-                WHEN raw_price ~ E'^[^0-9]*[0-9]+([,.][0-9]+)?[^0-9]*$'
-                THEN CAST(REGEXP_REPLACE(raw_price, '[^0-9.]', '', 'g') AS DECIMAL(12,2))
-                ELSE NULL
-            END AS numeric_price
-        FROM price_history
-        WHERE raw_price IS NOT NULL AND raw_price <> ''
-    ),
-    ProductPriceStats AS (
-        -- Get current price and max historical price for each product
-        SELECT 
-            nph.asin,
-            (array_agg(nph.numeric_price ORDER BY nph.ts DESC))[1] AS current_numeric_price,
-            (array_agg(nph.original_raw_price ORDER BY nph.ts DESC))[1] AS current_raw_price_display,
-            (array_agg(nph.raw_discount ORDER BY nph.ts DESC))[1] AS current_raw_discount_display,
-            MAX(nph.numeric_price) AS max_historic_price_numeric,
-            (array_agg(nph.ts ORDER BY nph.ts DESC))[1] AS last_scraped_ts
-        FROM NumericPriceHistory nph
-        WHERE nph.numeric_price IS NOT NULL
-        GROUP BY nph.asin
-    ),
-    BestsellerCandidates AS (
-        -- Calculate effective discount percentage
-        SELECT
-            pps.*,
-            p.title,
-            p.high_res_image_url,
-            p.image_url,
-            p.category,
-            p.availability,
-            CASE
-                WHEN pps.max_historic_price_numeric > 0 AND pps.max_historic_price_numeric > pps.current_numeric_price
-                THEN ((pps.max_historic_price_numeric - pps.current_numeric_price) / pps.max_historic_price_numeric) * 100
-                ELSE 0
-            END AS effective_discount_percentage
-        FROM ProductPriceStats pps
-        JOIN products p ON pps.asin = p.asin
-        WHERE p.availability = TRUE -- Only consider available products
-          AND pps.current_numeric_price IS NOT NULL
-          AND pps.max_historic_price_numeric > 0
-    )
-    SELECT 
-        bc.asin,
-        bc.title,
-        bc.high_res_image_url,
-        bc.image_url, -- Keep this for consistency, even if high_res is preferred
-        bc.category,
-        bc.availability,
-        bc.current_raw_price_display AS raw_price, -- Frontend expects raw_price
-        bc.current_raw_discount_display AS raw_discount, -- Frontend expects raw_discount
-        bc.last_scraped_ts AS last_scraped,
-        bc.current_numeric_price,
-        bc.max_historic_price_numeric,
-        bc.effective_discount_percentage
-    FROM BestsellerCandidates bc
-    WHERE bc.effective_discount_percentage > 5 -- Arbitrary threshold for a meaningful discount
-    ORDER BY bc.effective_discount_percentage DESC
-    LIMIT 12;
-    """
+    sql = queries.BESTSELLERS_SQL
     try:
-        logger.info("Connecting to DB for bestseller products...")
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute(sql)
-        cols = [c.name for c in cur.description]
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        data = [dict(zip(cols, row)) for row in rows]
-        logger.info(f"Fetched {len(data)} bestseller products")
-        return JSONResponse(content=jsonable_encoder(data))
+        return cached_list_response(request, "bestsellers", sql, "bestseller products")
 
+    except db.PoolTimeout as e:
+        return pool_timeout_response(e)
     except psycopg2.OperationalError as e:
         logger.error(f"DB connection failed for bestseller products: {e}")
         return JSONResponse(
@@ -617,15 +553,118 @@ def get_bestseller_products():
             status_code=500,
             content={"error": "An unexpected error occurred", "details": str(e)}
         )
-from ML_predictor_ import predict_price_drop_holt
+def fetch_forecast_history(asin):
+    with db.connection() as conn, conn.cursor() as cur:
+        cur.execute(queries.FORECAST_HISTORY_SQL, (asin,))
+        return cur.fetchall()
+
+async def load_forecast_history(asin):
+    return await asyncio.to_thread(fetch_forecast_history, asin)
+
+def fetch_forecast_stamp(asin):
+    try:
+        with db.connection() as conn, conn.cursor() as cur:
+            cur.execute(queries.FORECAST_STAMP_SQL, (asin,))
+            return cur.fetchone()
+    except psycopg2.errors.UndefinedTable:
+        return UNSTAMPED  # price_stats.py has not run against this database yet
+
+def fetch_stored_forecast(asin, forecast_days):
+    try:
+        with db.connection() as conn, conn.cursor() as cur:
+            cur.execute(queries.STORED_FORECAST_SQL, (asin,))
+            row = cur.fetchone()
+    except psycopg2.errors.UndefinedTable:
+        return None  # forecast_prices.py has not run against this database yet
+    return forecast_report.from_stored(asin, forecast_days, row) if row else None
+
+async def compute_forecast(asin, forecast_days):
+    """Result from price_forecasts when current, otherwise fitted in the forecast process pool."""
+    result = await asyncio.to_thread(fetch_stored_forecast, asin, forecast_days)
+    if result is None:
+        result = await forecast_pool.forecast(asin, forecast_days, load_forecast_history)
+    return result
 
 @app.get("/product/{asin}/predictprice", response_class=PlainTextResponse)
-def predict_price(
+@profiler.profiled
+async def predict_price(
     asin: str = Path(..., description="ASIN of the product"),
-    forecast_days: int = Query(30, description="Number of days to forecast")
+    forecast_days: int = Query(30, ge=1, le=forecast_report.FORECAST_MAX_DAYS, description="Number of days to forecast")
 ):
     """
     Returns a prediction message for the given ASIN.
+    Served from the forecast memo while the ASIN's history is unchanged,
+    then from price_forecasts when the batch job has a current forecast;
+    otherwise fitted in the forecast process pool. This handler only waits
+    on these, so it is async and does not hold a threadpool thread.
     """
-    prediction_message = predict_price_drop_holt(asin, forecast_days)
-    return prediction_message
\ No newline at end of file
+    try:
+        stamp = await asyncio.to_thread(fetch_forecast_stamp, asin)
+        message = forecast_memo.message(asin, stamp, forecast_days)
+        if message is not None:
+            return message
+        return forecast_memo.store(asin, stamp, await compute_forecast(asin, forecast_days))
+
+    except ForecastOverloaded as e:
+        return forecast_overloaded_response(e)
+    except ForecastTimeout as e:
+        return forecast_timeout_response(e)
+    except db.PoolTimeout as e:
+        return pool_timeout_response(e)
+    except psycopg2.OperationalError as e:
+        logger.error(f"DB connection failed for price prediction: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Database connection failed", "details": str(e)}
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error predicting price for {asin}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "An unexpected error occurred", "details": str(e)}
+        )
+
+def forecast_intervals(result):
+    if 'state' not in result:
+        return None  # failures, and stored forecasts whose model state is gone
+    import holt_numpy  # NumPy only, imported by the first JSON forecast
+    return holt_numpy.prediction_intervals(result)
+
+@app.get("/product/{asin}/forecast")
+@profiler.profiled
+async def get_forecast(
+    asin: str = Path(..., description="ASIN of the product"),
+    forecast_days: int = Query(30, ge=1, le=forecast_report.FORECAST_MAX_DAYS, description="Number of days to forecast")
+):
+    """
+    Returns the forecast behind /predictprice as JSON: the daily forecast,
+    threshold crossing day, min/max, model parameters, simulated 80% and
+    95% prediction intervals and the same text message.
+    """
+    try:
+        stamp = await asyncio.to_thread(fetch_forecast_stamp, asin)
+        result = forecast_memo.result(asin, stamp, forecast_days)
+        if result is None:
+            result = await compute_forecast(asin, forecast_days)
+            forecast_memo.store(asin, stamp, result)
+        intervals = await asyncio.to_thread(forecast_intervals, result)
+        return forecast_report.payload(result, intervals)
+
+    except ForecastOverloaded as e:
+        return forecast_overloaded_response(e)
+    except ForecastTimeout as e:
+        return forecast_timeout_response(e)
+    except db.PoolTimeout as e:
+        return pool_timeout_response(e)
+    except psycopg2.OperationalError as e:
+        logger.error(f"DB connection failed for forecast: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Database connection failed", "details": str(e)}
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error forecasting price for {asin}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "An unexpected error occurred", "details": str(e)}
+        )
\ No newline at end of file
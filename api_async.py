@@ -0,0 +1,573 @@
+"""
+api_async.py
+
+Async variant of api.py: the same routes and response shapes, served by
+`async def` handlers on psycopg 3's asyncio driver with its own pool, so
+concurrency is not capped by FastAPI's threadpool.
+
+    uvicorn api_async:app --host 0.0.0.0 --port 8000
+"""
+from fastapi import FastAPI, Query, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+from fastapi.responses import Response
+from fastapi import Path, Body
+from fastapi.responses import PlainTextResponse
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+from typing import Optional, List
+from datetime import datetime
+import time
+import asyncio
+import logging
+
+import psycopg
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+import db
+import queries
+import fastjson
+import conditional
+import compression
+import metrics
+import profiler
+from fastjson import FastJSONResponse
+import downsample
+import forecast_report
+import etl_events
+from forecast_pool import forecast_pool, ForecastOverloaded, ForecastTimeout
+from forecast_memo import forecast_memo, UNSTAMPED
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+if not all([db.DB_CONFIG['password'], db.DB_CONFIG['host'], db.DB_CONFIG['port']]):
+    logger.error("Missing required environment variables")
+    raise RuntimeError("PG_PASSWORD, PG_HOST and PG_PORT must all be set")
+
+class TimedAsyncCursor(psycopg.AsyncCursor):
+    """psycopg 3 counterpart of metrics.TimedCursor."""
+
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await super().execute(query, params, **kwargs)
+            failed = False
+            return result
+        finally:
+            rows = self.rowcount if not failed else 0
+            metrics.record_query(query, params, time.perf_counter() - start, rows, failed)
+
+pool = AsyncConnectionPool(
+    make_conninfo(**{k: v for k, v in db.DB_CONFIG.items() if v is not None}),
+    min_size=db.POOL_MIN_SIZE,
+    max_size=db.POOL_MAX_SIZE,
+    timeout=db.POOL_TIMEOUT,
+    check=AsyncConnectionPool.check_connection,
+    kwargs={"cursor_factory": TimedAsyncCursor},
+    open=False,
+)
+
+@asynccontextmanager
+async def lifespan(app):
+    await pool.open()
+    # Own psycopg2 connection in a thread; here it only drives forecast memo eviction
+    etl_events.start_listener()
+    try:
+        yield
+    finally:
+        etl_events.stop_listener()
+        forecast_pool.shutdown()
+        await pool.close()
+
+etl_events.subscribe(forecast_memo.evict)
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.add_middleware(GZipMiddleware, minimum_size=compression.MIN_COMPRESS_SIZE)
+app.add_middleware(metrics.MetricsMiddleware)
+profiler.install(app)
+
+def pool_timeout_response(e):
+    logger.error(f"Connection pool exhausted: {e}")
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Database busy, please retry", "details": str(e)},
+        headers={"Retry-After": "1"},
+    )
+
+def forecast_overloaded_response(e):
+    logger.warning(f"Forecast request shed: {e}")
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Forecast service busy, please retry", "details": str(e)},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+def forecast_timeout_response(e):
+    logger.warning(str(e))
+    return JSONResponse(
+        status_code=504,
+        content={"error": "Forecast timed out", "details": str(e)},
+    )
+
+async def fetch_rows(sql, params=None):
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            cols = [c.name for c in cur.description]
+            rows = await cur.fetchall()
+    return cols, rows
+
+async def catalog_version():
+    _, rows = await fetch_rows(queries.CATALOG_VERSION_SQL)
+    return rows[0][0]
+
+async def list_response(request, sql, label, params=None):
+    """
+    Run a list query and answer it, or 304 when the body's ETag matches.
+    Without a result cache the query still runs; only the transfer is saved.
+    """
+    try:
+        cols, rows = await fetch_rows(sql, params)
+        logger.info(f"Fetched {len(rows)} {label}")
+        body = fastjson.rows_json(cols, rows)
+        etag = conditional.body_etag(body)
+        if conditional.is_not_modified(request, etag):
+            return conditional.not_modified(etag)
+        return Response(content=body, media_type="application/json",
+                        headers=conditional.validator_headers(etag))
+
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
+    except psycopg.OperationalError as e:
+        logger.error(f"DB connection failed for {label}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Database connection failed", "details": str(e)}
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error fetching {label}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "An unexpected error occurred", "details": str(e)}
+        )
+
+@app.get("/api/pool-stats")
+async def get_pool_stats():
+    """
+    Returns async connection pool usage counters.
+    """
+    return pool.get_stats()
+
+@app.get("/api/forecast-stats")
+async def get_forecast_stats():
+    """
+    Returns forecast pool queue depth, shed and timed out requests, and
+    forecast memo counters.
+    """
+    return {**forecast_pool.stats(), 'memo': forecast_memo.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus metrics: per-route request latency, status counts and SQL
+    timings, plus connection pool, forecast pool and memo gauges.
+    """
+    pool_stats = pool.get_stats()
+    gauges = {
+        "db_pool_open_connections": ("Open pooled connections.", pool_stats.get('pool_size', 0)),
+        "db_pool_idle_connections": ("Idle pooled connections.", pool_stats.get('pool_available', 0)),
+        "db_pool_waiting": ("Requests waiting for a pooled connection.", pool_stats.get('requests_waiting', 0)),
+        **forecast_pool.gauges(),
+        **forecast_memo.gauges(),
+    }
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/products/")
+@profiler.profiled
+async def get_products(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=queries.PRODUCTS_PAGE_MAX, description="Page size; enables cursor pagination"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. asin,title,raw_price"),
+):
+    """
+    Return all products along with their latest raw_price & raw_discount,
+    or one keyset page of them when `limit` or `cursor` is given.
+    """
+    paged = limit is not None or cursor is not None
+    try:
+        if paged or fields:
+            names = queries.parse_fields(fields)
+            if paged and limit is None:
+                limit = queries.PRODUCTS_PAGE_DEFAULT
+            sql, params = queries.build_products_page_query(names, cursor, limit if paged else None)
+        else:
+            sql, params = queries.PRODUCTS_SQL, None
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    try:
+        last_modified = await catalog_version()
+        etag = conditional.make_etag("products", last_modified, request.url.query)
+        headers = conditional.validator_headers(etag, last_modified)
+        if conditional.is_not_modified(request, etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+
+        cols, rows = await fetch_rows(sql, params)
+        if not paged and not fields:
+            logger.info(f"Fetched {len(rows)} products")
+            return Response(content=fastjson.rows_json(cols, rows), media_type="application/json", headers=headers)
+        if not paged:
+            return FastJSONResponse(content=queries.strip_page_keys(cols, rows), headers=headers)
+        _, estimate = await fetch_rows(queries.PRODUCTS_ESTIMATE_SQL)
+        data = queries.products_page_payload(cols, rows, limit, estimate[0][0])
+        return FastJSONResponse(content=data, headers=headers)
+
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
+    except Exception as e:
+        logger.error(f"Unexpected error fetching products page: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "An unexpected error occurred", "details": str(e)}
+        )
+
+async def stream_products(sql, params):
+    """
+    NDJSON batches from a server-side cursor. Like api.stream_products, the
+    first step checks out the connection, runs the query and fetches the
+    first batch, then yields None, so the route can map those failures to
+    error responses before any headers are sent.
+    """
+    started = False
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor(name="products_stream") as cur:
+                await cur.execute(sql, params)
+                rows = await cur.fetchmany(queries.STREAM_BATCH_SIZE)
+                started = True
+                yield None
+                sent = 0
+                while rows:
+                    cols = [c.name for c in cur.description]
+                    sent += len(rows)
+                    yield queries.ndjson_lines(cols, rows)
+                    rows = await cur.fetchmany(queries.STREAM_BATCH_SIZE)
+        logger.info(f"Streamed {sent} products")
+    except Exception as e:
+        if not started:
+            raise
+        logger.error(f"Error streaming products: {e}")
+
+@app.get("/products/stream")
+async def get_products_stream(
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, e.g. asin,title,raw_price"),
+):
+    """
+    Stream every product with its latest price as NDJSON, batch by batch
+    from a server-side cursor.
+    """
+    try:
+        names = queries.parse_fields(fields)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    sql, params = queries.build_products_page_query(names, None, None)
+    stream = stream_products(sql, params)
+    try:
+        await stream.__anext__()
+
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
+    except psycopg.OperationalError as e:
+        logger.error(f"DB connection failed: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Database connection failed", "details": str(e)}
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error streaming products: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "An unexpected error occurred", "details": str(e)}
+        )
+    return StreamingResponse(stream, media_type="application/x-ndjson")
+
+@app.post("/products/batch")
+@profiler.profiled
+async def get_products_batch(
+    asins: List[str] = Body(..., embed=True, description=f"Up to {queries.PRODUCTS_BATCH_MAX} ASINs"),
+    points: Optional[int] = Query(None, ge=downsample.MIN_POINTS, le=downsample.MAX_POINTS,
+                                  description="Downsample each history to about this many points"),
+    start: Optional[datetime] = Query(None, alias="from", description="Only history at or after this time"),
+    end: Optional[datetime] = Query(None, alias="to", description="Only history at or before this time"),
+    history_format: str = Query("rows", alias="format", description="'rows' or the compact 'columnar'"),
+):
+    """
+    Details for many products in one round trip: a map of ASIN to the same
+    payload as /products/{asin}, or null for unknown ASINs.
+    """
+    if history_format not in queries.HISTORY_FORMATS:
+        return JSONResponse(status_code=400, content={"error": f"Unknown format: {history_format}"})
+    try:
+        asins = queries.parse_batch_asins(asins)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    if not asins:
+        return JSONResponse(content={})
+
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(queries.PRODUCTS_BATCH_SQL, (asins,))
+                product_rows = await cur.fetchall()
+                await cur.execute(*queries.price_history_batch_query(asins, start, end))
+                history_rows = await cur.fetchall()
+
+        logger.info(f"Fetched {len(product_rows)} of {len(asins)} products with {len(history_rows)} price records.")
+        return FastJSONResponse(content=queries.products_batch_payload(
+            asins, product_rows, history_rows, points, history_format))
+
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return JSONResponse(
+            content={"error": "An unexpected error occurred", "details": str(e)},
+            status_code=500
+        )
+
+@app.get("/products/{asin}")
+@profiler.profiled
+async def get_product_details(
+    request: Request,
+    asin: str = Path(..., description="ASIN of the product"),
+    points: Optional[int] = Query(None, ge=downsample.MIN_POINTS, le=downsample.MAX_POINTS,
+                                  description="Downsample the history to about this many points"),
+    start: Optional[datetime] = Query(None, alias="from", description="Only history at or after this time"),
+    end: Optional[datetime] = Query(None, alias="to", description="Only history at or before this time"),
+    history_format: str = Query("rows", alias="format", description="'rows' or the compact 'columnar'"),
+):
+    if history_format not in queries.HISTORY_FORMATS:
+        return JSONResponse(status_code=400, content={"error": f"Unknown format: {history_format}"})
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(queries.PRODUCT_VERSION_SQL, (asin,))
+                version = await cur.fetchone()
+
+                if not version:
+                    return JSONResponse(content={"error": "Product not found"}, status_code=404)
+
+                last_modified, observations = version
+                etag = conditional.make_etag("product", asin, last_modified, observations, request.url.query)
+                if conditional.is_not_modified(request, etag, last_modified):
+                    return conditional.not_modified(etag, last_modified)
+
+                await cur.execute(queries.PRODUCT_SQL, (asin,))
+                product_row = await cur.fetchone()
+
+                if not product_row:
+                    return JSONResponse(content={"error": "Product not found"}, status_code=404)
+
+                await cur.execute(*queries.price_history_query(asin, start, end))
+                all_rows = await cur.fetchall()
+
+        logger.info(f"Fetched product {asin} with {len(all_rows)} price records.")
+        return FastJSONResponse(content=queries.product_details(product_row, all_rows, points, history_format),
+                                headers=conditional.validator_headers(etag, last_modified))
+
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return JSONResponse(
+            content={"error": "An unexpected error occurred", "details": str(e)},
+            status_code=500
+        )
+
+@app.get("/api/search-suggest")
+@profiler.profiled
+async def suggest(q: str = Query(...)):
+    """
+    Provides search suggestions based on user input.
+    Returns top 5 matching product titles.
+    """
+    if not q or len(q.strip()) < 2:
+        return []
+
+    try:
+        _, rows = await fetch_rows(queries.SUGGEST_SQL, queries.suggest_params(q))
+        return [row[0] for row in rows]
+    except Exception as e:
+        logger.error(f"Error generating suggestions: {e}")
+        return []
+
+@app.get("/api/search")
+@profiler.profiled
+async def search(q: str = Query(...)):
+    """
+    Performs an enhanced product search based on user query.
+    """
+    try:
+        query, params = queries.build_search_query(q)
+        cols, rows = await fetch_rows(query, params)
+        results = queries.search_results(cols, rows)
+
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
+    except Exception as e:
+        logger.error(f"Error searching products: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Failed to search products", "details": str(e)}
+        )
+
+    return FastJSONResponse(content={"results": results, "query": q})
+
+@app.get("/api/products/trending")
+@profiler.profiled
+async def get_trending_products(request: Request):
+    """
+    Returns top 10 products with the most unique raw_price changes.
+    """
+    return await list_response(request, queries.TRENDING_SQL, "trending products")
+
+@app.get("/api/products/deals")
+@profiler.profiled
+async def get_todays_deals(
+    request: Request,
+    hours: int = Query(queries.DEALS_WINDOW_HOURS, ge=1, le=24 * 365, description="Look-back window for price drops")
+):
+    """
+    Returns top 10 products with the most significant recent price drops
+    (last `hours`, 2 days by default).
+    """
+    return await list_response(request, queries.DEALS_SQL, "products for today's deals", (hours,))
+
+@app.get("/api/products/bestsellers")
+@profiler.profiled
+async def get_bestseller_products(request: Request):
+    """
+    Returns top 10 products with the largest percentage discount
+    from their highest historical price to their current price.
+    """
+    return await list_response(request, queries.BESTSELLERS_SQL, "bestseller products")
+
+@app.get("/product/{asin}/predictprice", response_class=PlainTextResponse)
+@profiler.profiled
+async def predict_price(
+    asin: str = Path(..., description="ASIN of the product"),
+    forecast_days: int = Query(30, ge=1, le=forecast_report.FORECAST_MAX_DAYS, description="Number of days to forecast")
+):
+    """
+    Returns a prediction message for the given ASIN.
+    Served from the forecast memo while the ASIN's history is unchanged,
+    then from price_forecasts when the batch job has a current forecast;
+    otherwise the CPU-bound fit runs in the forecast process pool.
+    """
+    try:
+        stamp = await load_forecast_stamp(asin)
+        message = forecast_memo.message(asin, stamp, forecast_days)
+        if message is not None:
+            return message
+        return forecast_memo.store(asin, stamp, await compute_forecast(asin, forecast_days))
+
+    except ForecastOverloaded as e:
+        return forecast_overloaded_response(e)
+    except ForecastTimeout as e:
+        return forecast_timeout_response(e)
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
+    except psycopg.OperationalError as e:
+        logger.error(f"DB connection failed for price prediction: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Database connection failed", "details": str(e)}
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error predicting price for {asin}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "An unexpected error occurred", "details": str(e)}
+        )
+
+def forecast_intervals(result):
+    if 'state' not in result:
+        return None  # failures, and stored forecasts whose model state is gone
+    import holt_numpy  # NumPy only, imported by the first JSON forecast
+    return holt_numpy.prediction_intervals(result)
+
+@app.get("/product/{asin}/forecast")
+@profiler.profiled
+async def get_forecast(
+    asin: str = Path(..., description="ASIN of the product"),
+    forecast_days: int = Query(30, ge=1, le=forecast_report.FORECAST_MAX_DAYS, description="Number of days to forecast")
+):
+    """
+    Returns the forecast behind /predictprice as JSON: the daily forecast,
+    threshold crossing day, min/max, model parameters, simulated 80% and
+    95% prediction intervals and the same text message.
+    """
+    try:
+        stamp = await load_forecast_stamp(asin)
+        result = forecast_memo.result(asin, stamp, forecast_days)
+        if result is None:
+            result = await compute_forecast(asin, forecast_days)
+            forecast_memo.store(asin, stamp, result)
+        intervals = await asyncio.to_thread(forecast_intervals, result)
+        return forecast_report.payload(result, intervals)
+
+    except ForecastOverloaded as e:
+        return forecast_overloaded_response(e)
+    except ForecastTimeout as e:
+        return forecast_timeout_response(e)
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
+    except psycopg.OperationalError as e:
+        logger.error(f"DB connection failed for forecast: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Database connection failed", "details": str(e)}
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error forecasting price for {asin}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "An unexpected error occurred", "details": str(e)}
+        )
+
+async def load_forecast_history(asin):
+    _, rows = await fetch_rows(queries.FORECAST_HISTORY_SQL, (asin,))
+    return rows
+
+async def load_forecast_stamp(asin):
+    try:
+        _, rows = await fetch_rows(queries.FORECAST_STAMP_SQL, (asin,))
+    except psycopg.errors.UndefinedTable:
+        return UNSTAMPED  # price_stats.py has not run against this database yet
+    return rows[0] if rows else None
+
+async def compute_forecast(asin, forecast_days):
+    """Result from price_forecasts when current, otherwise fitted in the forecast process pool."""
+    result = await load_stored_forecast(asin, forecast_days)
+    if result is None:
+        result = await forecast_pool.forecast(asin, forecast_days, load_forecast_history)
+    return result
+
+async def load_stored_forecast(asin, forecast_days):
+    try:
+        _, rows = await fetch_rows(queries.STORED_FORECAST_SQL, (asin,))
+    except psycopg.errors.UndefinedTable:
+        return None  # forecast_prices.py has not run against this database yet
+    return forecast_report.from_stored(asin, forecast_days, rows[0]) if rows else None
@@ -0,0 +1,239 @@
+"""
+autocomplete.py
+
+In-memory prefix index behind /api/search-suggest. Product titles,
+categories and brand names (a title's leading word, when it is shared by
+several products) are indexed under every word start, in a sorted key
+array searched with bisect. Top-k completions for short prefixes, where
+ranges are widest, are precomputed; longer prefixes select from their
+(small) bisect range. Completions rank by popularity: availability and
+number of price observations for titles, product counts for brands and
+categories. Products are re-indexed individually when the ETL announces
+new data (see etl_events.py).
+"""
+import re
+import math
+import time
+import heapq
+import bisect
+import logging
+import threading
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+TOP_K = 10
+PRECOMPUTED_PREFIX_LEN = 4   # prefixes up to this length answer from the precomputed table
+MAX_KEY_LEN = 40
+MAX_WORDS_PER_ENTRY = 10
+MIN_BRAND_PRODUCTS = 2
+
+# Ranking weights
+CATEGORY_BASE = 5.0
+BRAND_BASE = 4.0
+AVAILABLE_BONUS = 2.0
+START_BONUS = 1.0            # match at the start of the entry, not a later word
+
+NON_ALNUM_RE = re.compile(r'[^a-z0-9]+')
+BRAND_STOPWORDS = {'the', 'new', 'refurbished', 'renewed', 'original', 'pack', 'combo'}
+
+ENTRIES_SQL = """
+SELECT p.asin, p.title, p.category, p.availability, COALESCE(s.observation_count, 0)
+FROM products p
+LEFT JOIN product_price_stats s ON s.asin = p.asin
+"""
+
+
+def normalize(text):
+    return NON_ALNUM_RE.sub(' ', (text or '').lower()).strip()
+
+
+def brand_of(title):
+    """Leading word of a title as written, or None if it doesn't look like a brand."""
+    for word in (title or '').split():
+        word = word.strip('()[]{}.,:;-_|')
+        if not word:
+            continue
+        if len(word) < 2 or not any(c.isalpha() for c in word) or word.lower() in BRAND_STOPWORDS:
+            return None
+        return word
+    return None
+
+
+class Autocomplete:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._products = {}                       # asin -> (title, brand, category, popularity)
+        self._title_pops = defaultdict(dict)      # title -> {asin: popularity}
+        self._brand_counts = Counter()            # brand (lower) -> products
+        self._brand_display = defaultdict(Counter)
+        self._category_counts = Counter()
+        self._scores = {}                         # entry id -> score
+        self._display = {}                        # entry id -> display string
+        self._entry_keys = {}                     # entry id -> [(key, at_start)]
+        self._keys = []                           # sorted (key, entry id, at_start)
+        self._top = {}                            # short prefix -> [display, ...]
+        self.ready = False
+        self.loaded_at = None
+
+    # === ENTRIES ===
+    @staticmethod
+    def _keys_for(text):
+        norm = normalize(text)
+        keys = []
+        starts = [0] + [m.end() for m in re.finditer(' ', norm)]
+        for i, start in enumerate(starts[:MAX_WORDS_PER_ENTRY]):
+            keys.append((norm[start:start + MAX_KEY_LEN], i == 0))
+        return keys
+
+    def _entry_state(self, entry):
+        """Current (score, display) for an entry id, or None if it should not exist."""
+        kind, value = entry
+        if kind == 'title':
+            pops = self._title_pops.get(value)
+            return (max(pops.values()), value) if pops else None
+        if kind == 'brand':
+            n = self._brand_counts.get(value, 0)
+            if n < MIN_BRAND_PRODUCTS:
+                return None
+            return BRAND_BASE + math.log1p(n), self._brand_display[value].most_common(1)[0][0]
+        n = self._category_counts.get(value, 0)
+        return (CATEGORY_BASE + math.log1p(n), value) if n else None
+
+    def _sync_entry(self, entry, dirty_prefixes):
+        state = self._entry_state(entry)
+        old_keys = self._entry_keys.get(entry)
+        if state is not None and old_keys is not None and self._scores[entry] == state[0]:
+            return
+        if old_keys is not None:
+            for key, at_start in old_keys:
+                i = bisect.bisect_left(self._keys, (key, entry, at_start))
+                if i < len(self._keys) and self._keys[i] == (key, entry, at_start):
+                    del self._keys[i]
+                dirty_prefixes.update(key[:n] for n in range(1, PRECOMPUTED_PREFIX_LEN + 1))
+            del self._entry_keys[entry], self._scores[entry], self._display[entry]
+        if state is None:
+            return
+        self._scores[entry], self._display[entry] = state
+        keys = self._keys_for(state[1] if entry[0] == 'title' else entry[1])
+        self._entry_keys[entry] = keys
+        for key, at_start in keys:
+            bisect.insort(self._keys, (key, entry, at_start))
+            dirty_prefixes.update(key[:n] for n in range(1, PRECOMPUTED_PREFIX_LEN + 1))
+
+    def _set_product(self, asin, row, touched):
+        old = self._products.pop(asin, None)
+        if old:
+            title, brand, category, _ = old
+            if title:
+                self._title_pops[title].pop(asin, None)
+                if not self._title_pops[title]:
+                    del self._title_pops[title]
+                touched.add(('title', title))
+            if brand:
+                self._brand_counts[brand.lower()] -= 1
+                self._brand_display[brand.lower()][brand] -= 1
+                touched.add(('brand', brand.lower()))
+            if category:
+                self._category_counts[category] -= 1
+                touched.add(('category', category))
+        if row is None:
+            return
+        title, category, available, observations = row
+        brand = brand_of(title)
+        popularity = (AVAILABLE_BONUS if available else 0.0) + math.log1p(observations)
+        self._products[asin] = (title, brand, category, popularity)
+        if title:
+            self._title_pops[title][asin] = popularity
+            touched.add(('title', title))
+        if brand:
+            self._brand_counts[brand.lower()] += 1
+            self._brand_display[brand.lower()][brand] += 1
+            touched.add(('brand', brand.lower()))
+        if category:
+            self._category_counts[category] += 1
+            touched.add(('category', category))
+
+    # === TOP-K ===
+    def _range(self, prefix):
+        lo = bisect.bisect_left(self._keys, (prefix,))
+        hi = bisect.bisect_left(self._keys, (prefix + '￿',))
+        return self._keys[lo:hi]
+
+    def _rank(self, matches, k):
+        best = {}
+        for _, entry, at_start in matches:
+            score = self._scores[entry] + (START_BONUS if at_start else 0.0)
+            if score > best.get(entry, float('-inf')):
+                best[entry] = score
+        top = heapq.nlargest(k, best.items(), key=lambda item: (item[1], item[0][1]))
+        return [self._display[entry] for entry, _ in top]
+
+    def _recompute(self, prefixes):
+        for prefix in prefixes:
+            top = self._rank(self._range(prefix), TOP_K)
+            if top:
+                self._top[prefix] = top
+            else:
+                self._top.pop(prefix, None)
+
+    # === LOAD / REFRESH ===
+    def _fetch(self, conn, asins=None):
+        with conn.cursor() as cur:
+            if asins is None:
+                cur.execute(ENTRIES_SQL)
+            else:
+                cur.execute(ENTRIES_SQL + " WHERE p.asin = ANY(%s)", (list(asins),))
+            return {row[0]: row[1:] for row in cur.fetchall()}
+
+    def load(self, conn):
+        rows = self._fetch(conn)
+        fresh = Autocomplete()
+        touched = set()
+        for asin, row in rows.items():
+            fresh._set_product(asin, row, touched)
+        for entry in touched:
+            state = fresh._entry_state(entry)
+            if state is None:
+                continue
+            fresh._scores[entry], fresh._display[entry] = state
+            keys = fresh._keys_for(state[1] if entry[0] == 'title' else entry[1])
+            fresh._entry_keys[entry] = keys
+            fresh._keys.extend((key, entry, at_start) for key, at_start in keys)
+        fresh._keys.sort()
+        fresh._recompute({key[:n] for key, _, _ in fresh._keys for n in range(1, PRECOMPUTED_PREFIX_LEN + 1)})
+        with self._lock:
+            for name in ('_products', '_title_pops', '_brand_counts', '_brand_display', '_category_counts',
+                         '_scores', '_display', '_entry_keys', '_keys', '_top'):
+                setattr(self, name, getattr(fresh, name))
+            self.ready = True
+            self.loaded_at = time.time()
+        logger.info(f"Autocomplete index loaded with {len(self._scores)} entries")
+
+    def refresh(self, conn, asins):
+        """Re-index only the given ASINs; asins=None reloads everything."""
+        if asins is None or not self.ready:
+            return self.load(conn)
+        rows = self._fetch(conn, asins)
+        with self._lock:
+            touched, dirty = set(), set()
+            for asin in asins:
+                self._set_product(asin, rows.get(asin), touched)
+            for entry in touched:
+                self._sync_entry(entry, dirty)
+            self._recompute(dirty)
+            self.loaded_at = time.time()
+        logger.info(f"Autocomplete refreshed {len(rows)} products ({len(dirty)} prefixes)")
+
+    # === QUERY ===
+    def suggest(self, q, limit=5):
+        prefix = normalize(q)[:MAX_KEY_LEN]
+        if not prefix:
+            return []
+        with self._lock:
+            if len(prefix) <= PRECOMPUTED_PREFIX_LEN:
+                return self._top.get(prefix, [])[:limit]
+            return self._rank(self._range(prefix), limit)
+
+
+suggestions_index = Autocomplete()
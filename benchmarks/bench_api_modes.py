@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+bench_api_modes.py
+
+Compares requests/sec and tail latency of the sync (api:app) and async
+(api_async:app) request paths. Each app is started under uvicorn against
+the Postgres configured in .env, then hammered with a fixed number of
+concurrent clients for a fixed duration per endpoint.
+
+    python benchmarks/bench_api_modes.py --concurrency 64 --duration 10
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = [
+    "/products/",
+    "/api/search-suggest?q=lap",
+    "/api/search?q=laptop under 50000",
+    "/api/products/trending",
+    "/api/products/deals",
+    "/api/products/bestsellers",
+]
+
+APPS = [("sync", "api:app", 8101), ("async", "api_async:app", 8102)]
+
+
+def start_server(target, port, workers):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api/pool-stats", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"{target} did not start on port {port}")
+
+
+async def hammer(base_url, path, concurrency, duration):
+    latencies = []
+    errors = 0
+    stop_at = time.perf_counter() + duration
+
+    async def client_loop(client):
+        nonlocal errors
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                resp = await client.get(path)
+                if resp.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+    return latencies, errors
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per endpoint")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers per app")
+    args = parser.parse_args()
+
+    print(f"{'mode':6} {'endpoint':36} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for mode, target, port in APPS:
+        proc = start_server(target, port, args.workers)
+        try:
+            for path in ENDPOINTS:
+                latencies, errors = asyncio.run(
+                    hammer(f"http://127.0.0.1:{port}", path, args.concurrency, args.duration)
+                )
+                rps = len(latencies) / args.duration
+                print(f"{mode:6} {path:36} {rps:8.1f} {statistics.median(latencies):8.1f} "
+                      f"{percentile(latencies, 95):8.1f} {percentile(latencies, 99):8.1f} {errors:6}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+bench_history_format.py
+
+Payload size and encode time of /products/{asin} in the default row
+format against ?format=columnar, for the ASINs with the most price
+history in the configured database. Sizes are reported raw and gzipped;
+encode time covers building the payload and rendering it the way
+JSONResponse does.
+
+    python benchmarks/bench_history_format.py --products 20 --repeat 50
+"""
+import os
+import sys
+import gzip
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse
+
+import db
+import queries
+
+TOP_ASINS_SQL = """
+SELECT asin FROM product_price_stats
+ORDER BY observation_count DESC
+LIMIT %s
+"""
+
+BUILDERS = {
+    'rows': queries.product_details_payload,
+    'columnar': queries.product_details_columnar,
+}
+
+
+def load_products(conn, count):
+    with conn.cursor() as cur:
+        cur.execute(TOP_ASINS_SQL, (count,))
+        asins = [row[0] for row in cur.fetchall()]
+        products = []
+        for asin in asins:
+            cur.execute(queries.PRODUCT_SQL, (asin,))
+            product_row = cur.fetchone()
+            cur.execute(*queries.price_history_query(asin))
+            products.append((product_row, cur.fetchall()))
+    return products
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=20, help="ASINs with the longest history to encode")
+    parser.add_argument("--repeat", type=int, default=50, help="encodes per product and format")
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        products = load_products(conn, args.products)
+    db.close_pool()
+    rows_total = sum(len(history) for _, history in products)
+    print(f"{len(products)} products, {rows_total} history rows")
+
+    baseline = None
+    for name, build in BUILDERS.items():
+        raw, zipped, timings = 0, 0, []
+        for product_row, history in products:
+            body = JSONResponse(content=build(product_row, history)).body
+            raw += len(body)
+            zipped += len(gzip.compress(body))
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                JSONResponse(content=build(product_row, history))
+            timings.append((time.perf_counter() - start) * 1000 / args.repeat)
+        baseline = baseline or raw
+        print(f"  {name:9} {raw:9d} B ({raw / baseline:5.1%})   gzip {zipped:8d} B   "
+              f"encode mean {statistics.mean(timings):7.3f} ms/product")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+bench_holt.py
+
+Holt fitting throughput in series/sec: holt_numpy on every series at once
+against statsmodels one series at a time (on a sample, it is slow). Uses
+the price history in the configured database, or --synthetic N random
+walks with drift for catalogs larger than the staging data. Single
+process; forecast_prices.py multiplies either by its worker count.
+
+    python benchmarks/bench_holt.py --repeat 3
+    python benchmarks/bench_holt.py --synthetic 20000 --length 60:120
+"""
+import os
+import sys
+import time
+import argparse
+import warnings
+from itertools import groupby
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import holt_numpy
+
+HISTORY_SQL = """
+SELECT asin, ts, price
+FROM price_history
+ORDER BY asin, ts
+"""
+
+
+def load_series():
+    import db
+    with db.connection() as conn, conn.cursor() as cur:
+        cur.execute(HISTORY_SQL)
+        rows = cur.fetchall()
+    db.close_pool()
+    series = []
+    for _, group in groupby(rows, key=lambda r: r[0]):
+        values, failure = holt_numpy.series_from_rows([(ts, price) for _, ts, price in group])
+        if failure is None:
+            series.append(values)
+    return series
+
+
+def synthetic_series(count, min_len, max_len, seed):
+    rng = np.random.default_rng(seed)
+    series = []
+    for _ in range(count):
+        n = int(rng.integers(min_len, max_len + 1))
+        start = rng.uniform(200, 50000)
+        steps = rng.normal(rng.normal(0, 0.002), 0.02, n) * start
+        series.append(start + np.cumsum(steps))
+    return series
+
+
+def bench_statsmodels(series):
+    from statsmodels.tsa.api import Holt
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        start = time.perf_counter()
+        for values in series:
+            Holt(values, damped_trend=True, initialization_method="estimated").fit().forecast(30)
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark N generated series instead of the database")
+    parser.add_argument("--length", default="20:120", help="min:max length of synthetic series")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=3, help="holt_numpy runs, best is reported")
+    parser.add_argument("--sm-sample", type=int, default=200, help="series fitted with statsmodels")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        min_len, max_len = (int(x) for x in args.length.split(":"))
+        series = synthetic_series(args.synthetic, min_len, max_len, args.seed)
+    else:
+        series = load_series()
+    lengths = [len(s) for s in series]
+    print(f"{len(series)} series, length median {int(np.median(lengths))}, max {max(lengths)}, "
+          f"{sum(lengths)} values")
+
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        model = holt_numpy.fit(series)
+        holt_numpy.forecast(model['level'], model['trend'], model['damping_trend'], 30)
+        timings.append(time.perf_counter() - start)
+    np_rate = len(series) / min(timings)
+    print(f"  holt_numpy   {min(timings):7.2f}s  {np_rate:9.0f} series/s")
+
+    sample = series[:args.sm_sample]
+    seconds = bench_statsmodels(sample)
+    sm_rate = len(sample) / seconds
+    print(f"  statsmodels  {seconds:7.2f}s  {sm_rate:9.0f} series/s  ({len(sample)} series)")
+    print(f"  speedup      {np_rate / sm_rate:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
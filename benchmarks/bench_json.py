@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+bench_json.py
+
+Serialization cost of the list endpoints' rows, per encoding path, on
+rows fetched once from the configured database:
+
+  encoder   dict(zip) -> jsonable_encoder -> JSONResponse (stdlib json)
+  fastjson  dict(zip) -> fastjson.dumps (orjson when installed)
+  dicts     dict(zip) alone, to show what building the row objects costs
+
+    python benchmarks/bench_json.py --repeat 50
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import db
+import queries
+import fastjson
+
+ENDPOINTS = {
+    '/products/': (queries.PRODUCTS_SQL, None),
+    'trending': (queries.TRENDING_SQL, None),
+    'deals': (queries.DEALS_SQL, (queries.DEALS_WINDOW_HOURS,)),
+    'bestsellers': (queries.BESTSELLERS_SQL, None),
+    'search': queries.build_search_query('laptop'),
+}
+
+PATHS = {
+    'encoder': lambda cols, rows: JSONResponse(content=jsonable_encoder([dict(zip(cols, r)) for r in rows])).body,
+    'fastjson': fastjson.rows_json,
+    'dicts': lambda cols, rows: [dict(zip(cols, r)) for r in rows],
+}
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    fetched = {}
+    with db.connection() as conn, conn.cursor() as cur:
+        for name, (sql, params) in ENDPOINTS.items():
+            cur.execute(sql, params)
+            fetched[name] = ([c.name for c in cur.description], cur.fetchall())
+    db.close_pool()
+
+    print(f"orjson: {'yes' if fastjson.orjson is not None else 'no (stdlib fallback)'}")
+    for name, (cols, rows) in fetched.items():
+        assert fastjson.rows_json(cols, rows) == PATHS['encoder'](cols, rows), name
+        timings = {path: timed(lambda: fn(cols, rows), args.repeat) for path, fn in PATHS.items()}
+        speedup = timings['encoder'] / timings['fastjson'] if timings['fastjson'] else float('inf')
+        print(f"  {name:12} {len(rows):6d} rows   " +
+              "   ".join(f"{path} {ms:8.3f} ms" for path, ms in timings.items()) +
+              f"   x{speedup:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+bench_search.py
+
+Recall and latency of the in-memory search index against the SQL search
+path, on queries generated from real product titles in the configured
+database. Each query is built from one product's title, in three flavours:
+
+  exact   two significant title words as written
+  typo    the same words with one character dropped from the longer one
+  hyphen  a hyphenated title word written without its hyphen ("tplink")
+
+Recall@30 is the share of queries whose source product is in the top 30.
+
+    python benchmarks/bench_search.py --queries 200
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import queries
+from search_index import SearchIndex, WORD_RE
+
+
+def make_queries(conn, count, seed):
+    with conn.cursor() as cur:
+        cur.execute("SELECT asin, title FROM products WHERE title IS NOT NULL")
+        products = cur.fetchall()
+    rng = random.Random(seed)
+    generated = []
+    for asin, title in rng.sample(products, min(count, len(products))):
+        words = [w for w in WORD_RE.findall(title.lower()) if len(w) >= 4 and not w.isdigit()]
+        if len(words) >= 2:
+            pair = words[:2]
+            generated.append(('exact', asin, ' '.join(pair)))
+            longer = max(range(2), key=lambda i: len(pair[i]))
+            cut = rng.randrange(1, len(pair[longer]) - 1)
+            typo = list(pair)
+            typo[longer] = typo[longer][:cut] + typo[longer][cut + 1:]
+            generated.append(('typo', asin, ' '.join(typo)))
+        hyphenated = [w for w in title.lower().split() if '-' in w.strip('-') and len(w) >= 5]
+        if hyphenated:
+            generated.append(('hyphen', asin, hyphenated[0].replace('-', '')))
+    return generated
+
+
+def run_sql(conn, q):
+    query, params = queries.build_search_query(q)
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        return [row[0] for row in cur.fetchall()]
+
+
+def summarize(name, latencies_ms, hits, total):
+    latencies_ms = sorted(latencies_ms)
+    p95 = latencies_ms[min(len(latencies_ms) - 1, int(len(latencies_ms) * 0.95))]
+    print(f"  {name:6} recall@30 {hits / total:6.1%}   mean {statistics.mean(latencies_ms):8.3f} ms   "
+          f"p95 {p95:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=200, help="products to derive queries from")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    index = SearchIndex()
+    with db.connection() as conn:
+        start = time.perf_counter()
+        index.load(conn)
+        print(f"Index load: {(time.perf_counter() - start) * 1000:.0f} ms, {index.stats()}")
+
+        generated = make_queries(conn, args.queries, args.seed)
+        for kind in ('exact', 'typo', 'hyphen'):
+            subset = [(asin, q) for k, asin, q in generated if k == kind]
+            if not subset:
+                continue
+            print(f"{kind} ({len(subset)} queries)")
+            results = {}
+            for path in ('sql', 'index'):
+                latencies, hits = [], 0
+                for asin, q in subset:
+                    start = time.perf_counter()
+                    if path == 'sql':
+                        asins = run_sql(conn, q)
+                    else:
+                        asins = [row['asin'] for row in index.search(q)]
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    hits += asin in asins
+                    results.setdefault(q, {})[path] = set(asins)
+                summarize(path, latencies, hits, len(subset))
+            overlap = [
+                len(r['sql'] & r['index']) / len(r['sql'])
+                for r in results.values() if r.get('sql')
+            ]
+            if overlap:
+                print(f"  overlap with SQL results: {statistics.mean(overlap):.1%}")
+    db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+bench_startup.py
+
+Cold-start cost of an API worker. Each run starts a fresh interpreter that
+imports the app, runs its startup (pool, search and suggestion indexes,
+ETL listener) and serves the catalog endpoints, then reports the time to
+the first response, RSS and whether the forecasting stack (numpy,
+pandas, statsmodels, scipy) was imported. A /predictprice request
+follows to show what the first forecast pays for the lazy import.
+
+  lazy   the app as shipped
+  eager  ML_predictor_ imported before the app, as api.py used to do
+
+    python benchmarks/bench_startup.py --runs 5 --asin B0CQ7XYNPG
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ML_MODULES = ("numpy", "pandas", "statsmodels", "scipy")
+CATALOG_ENDPOINTS = ["/products/?limit=50", "/api/products/trending", "/api/search?q=laptop"]
+
+CHILD = r"""
+import sys, time, json, importlib
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+if {eager!r}:
+    import ML_predictor_
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+
+def ml_loaded():
+    return [m for m in {ml_modules!r} if m in sys.modules]
+
+from fastapi.testclient import TestClient
+app = importlib.import_module({module!r}).app
+imported = time.perf_counter()
+out = {{}}
+with TestClient(app) as client:
+    for path in {endpoints!r}:
+        assert client.get(path).status_code == 200, path
+    out["import_s"] = imported - start
+    out["ready_s"] = time.perf_counter() - start
+    out["rss_mb"] = rss_mb()
+    out["ml_loaded"] = ml_loaded()
+    t = time.perf_counter()
+    status = client.get("/product/{asin}/predictprice").status_code
+    out["predict_s"] = time.perf_counter() - t
+    out["predict_status"] = status
+    out["rss_after_predict_mb"] = rss_mb()
+print(json.dumps(out))
+"""
+
+
+def run_child(module, eager, asin):
+    code = CHILD.format(root=ROOT, eager=eager, ml_modules=ML_MODULES, module=module,
+                        endpoints=CATALOG_ENDPOINTS, asin=asin)
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--asin", required=True, help="ASIN with price history for the /predictprice request")
+    parser.add_argument("--apps", nargs="+", default=["api", "api_async"])
+    args = parser.parse_args()
+
+    for module in args.apps:
+        for mode in ("eager", "lazy"):
+            results = [run_child(module, mode == "eager", args.asin) for _ in range(args.runs)]
+            med = {key: statistics.median(r[key] for r in results)
+                   for key in ("import_s", "ready_s", "rss_mb", "predict_s", "rss_after_predict_mb")}
+            print(f"{module:10} {mode:5}  import {med['import_s'] * 1000:7.0f} ms   "
+                  f"first catalog responses {med['ready_s'] * 1000:7.0f} ms   "
+                  f"RSS {med['rss_mb']:6.1f} MB   ML loaded: {','.join(results[0]['ml_loaded']) or 'no'}   "
+                  f"| first predictprice {med['predict_s'] * 1000:7.0f} ms "
+                  f"(status {results[0]['predict_status']}), RSS after {med['rss_after_predict_mb']:6.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+holt_parity.py
+
+Checks holt_numpy against statsmodels' Holt (damped, estimated initial
+state) on the price history in the configured database. Exits non-zero
+when a check fails.
+
+  recursion  statsmodels' fitted parameters run through holt_numpy's
+             recursion must reproduce its forecast (relative --tolerance)
+  fit        holt_numpy's in-sample SSE relative to statsmodels' for series
+             with at least --min-nobs values: the --quantile of the ratio
+             must stay below --max-ratio (below 1 means a better fit)
+  status     drop/increase/stable agreement of the two forecasts,
+             reported only: on flat SSE surfaces near-equal fits can
+             extrapolate differently
+
+    python benchmarks/holt_parity.py --limit 300
+"""
+import os
+import sys
+import time
+import argparse
+import warnings
+from itertools import groupby
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import holt_numpy
+import forecast_report
+
+HISTORY_SQL = """
+SELECT asin, ts, price
+FROM price_history
+ORDER BY asin, ts
+"""
+
+
+def load_series(conn, limit):
+    with conn.cursor() as cur:
+        cur.execute(HISTORY_SQL)
+        series = []
+        for asin, group in groupby(cur.fetchall(), key=lambda r: r[0]):
+            values, failure = holt_numpy.series_from_rows([(ts, price) for _, ts, price in group])
+            if failure is None:
+                series.append((asin, values))
+    return series[:limit] if limit else series
+
+
+def fit_statsmodels(series, steps):
+    from statsmodels.tsa.api import Holt
+    fits = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for _, values in series:
+            fit = Holt(values, damped_trend=True, initialization_method="estimated").fit()
+            params = {name: float(fit.params[name]) for name in holt_numpy.PARAM_NAMES}
+            fits.append((params, float(fit.sse), np.asarray(fit.forecast(steps))))
+    return fits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=0, help="series to compare (default: all)")
+    parser.add_argument("--steps", type=int, default=30, help="forecast horizon")
+    parser.add_argument("--tolerance", type=float, default=1e-6, help="recursion check, relative")
+    parser.add_argument("--min-nobs", type=int, default=10, help="shortest series in the fit check")
+    parser.add_argument("--quantile", type=float, default=0.99)
+    parser.add_argument("--max-ratio", type=float, default=1.005)
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        series = load_series(conn, args.limit)
+    db.close_pool()
+    print(f"{len(series)} fittable series")
+
+    start = time.perf_counter()
+    sm = fit_statsmodels(series, args.steps)
+    sm_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    model = holt_numpy.fit([values for _, values in series])
+    np_seconds = time.perf_counter() - start
+    print(f"fit time: statsmodels {sm_seconds:.2f}s, holt_numpy {np_seconds:.2f}s")
+    failed = []
+
+    # Recursion: same parameters, same forecast
+    sm_params = {name: np.array([params[name] for params, _, _ in sm]) for name in holt_numpy.PARAM_NAMES}
+    level, trend = holt_numpy.final_states([values for _, values in series], sm_params)
+    replayed = holt_numpy.forecast(level, trend, sm_params['damping_trend'], args.steps)
+    expected = np.array([fc for _, _, fc in sm])
+    scale = np.maximum(np.abs(expected), 1.0)
+    worst = float(np.max(np.abs(replayed - expected) / scale))
+    ok = worst <= args.tolerance
+    print(f"recursion: max relative forecast difference {worst:.2e} ({'ok' if ok else 'FAIL'})")
+    if not ok:
+        failed.append("recursion")
+
+    # Fit quality: in-sample SSE at the fitted parameters
+    sm_sse = np.array([sse for _, sse, _ in sm])
+    keep = (model['nobs'] >= args.min_nobs) & (sm_sse > 0)
+    ratio = model['sse'][keep] / sm_sse[keep]
+    p50, p95, q = np.quantile(ratio, [0.5, 0.95, args.quantile])
+    ok = q <= args.max_ratio
+    print(f"fit: SSE ratio over {keep.sum()} series (n >= {args.min_nobs}): p50 {p50:.5f}  p95 {p95:.5f}  "
+          f"p{args.quantile * 100:g} {q:.5f}  max {ratio.max():.5f}  "
+          f"worse by >0.5%: {(ratio > 1.005).sum()} ({'ok' if ok else 'FAIL'})")
+    if not ok:
+        failed.append("fit")
+
+    # Status agreement of the two forecasts
+    forecasts = holt_numpy.forecast(model['level'], model['trend'], model['damping_trend'], args.steps)
+    agree = sum(
+        forecast_report.classify(asin, args.steps, values[-1], forecasts[i])['status']
+        == forecast_report.classify(asin, args.steps, values[-1], sm[i][2])['status']
+        for i, (asin, values) in enumerate(series)
+    )
+    print(f"status: {agree}/{len(series)} forecasts classified alike ({agree / max(len(series), 1):.1%})")
+
+    if failed:
+        print(f"FAILED: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+cache.py
+
+In-process result cache for the homepage aggregate endpoints. Entries
+expire after a TTL and can be dropped early when the ETL announces new
+data. Concurrent misses on the same key are coalesced: one caller runs
+the query while the others wait for its result (single flight).
+"""
+import os
+import time
+import threading
+
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "300"))
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}   # key -> (expires_at, value)
+        self._inflight = {}  # key -> _Flight
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'invalidations': 0, 'errors': 0}
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for `key`, or run `compute()` once and cache
+        its result. Exceptions from `compute` are re-raised to every waiter
+        and nothing is cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._stats['hits'] += 1
+                return entry[1]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                generation = self._generation
+                self._stats['misses'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                # A result computed across an invalidation may be stale; serve it, don't keep it
+                if flight.error is None and generation == self._generation:
+                    self._entries[key] = (time.monotonic() + self.ttl, flight.value)
+                self._inflight.pop(key, None)
+            flight.done.set()
+        return flight.value
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self._generation += 1
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses'] + self._stats['coalesced']
+            return {
+                **self._stats,
+                'entries': len(self._entries),
+                'ttl_seconds': self.ttl,
+                'hit_ratio': round(self._stats['hits'] / lookups, 4) if lookups else 0.0,
+            }
+
+
+aggregate_cache = ResultCache(CACHE_TTL_SECONDS)
@@ -0,0 +1,67 @@
+"""
+conditional.py
+
+HTTP validators for conditional GETs. Handlers derive a weak ETag from a
+cheap data version (the catalog's or one ASIN's latest change) or from an
+already serialized body, check If-None-Match / If-Modified-Since before
+doing the expensive work, and answer 304 when the client's copy is
+current. Responses carry `Cache-Control: no-cache` so clients keep them
+but revalidate on every use.
+"""
+import hashlib
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi.responses import Response
+
+
+def make_etag(*parts):
+    """Weak ETag over the string form of `parts` (data version, query string...)."""
+    digest = hashlib.blake2b('|'.join(map(str, parts)).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def body_etag(body):
+    return f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+def http_date(dt):
+    if dt is None:
+        return None
+    return format_datetime(dt.astimezone(timezone.utc), usegmt=True)
+
+
+def _opaque(tag):
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """
+    True when the request's validators match. If-None-Match takes
+    precedence over If-Modified-Since, as RFC 9110 requires.
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(',')]
+        return '*' in tags or _opaque(etag) in {_opaque(t) for t in tags}
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def validator_headers(etag, last_modified=None):
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def not_modified(etag, last_modified=None):
+    return Response(status_code=304, headers=validator_headers(etag, last_modified))
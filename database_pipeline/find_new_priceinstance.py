@@ -17,6 +17,10 @@ DB_PASSWORD = os.getenv("PG_PASSWORD")
 DB_HOST = os.getenv("PG_HOST", "localhost")
 DB_PORT = os.getenv("PG_PORT")
 
+# Same channel as upsert_production_pricehistory: API processes refresh their
+# ETag versions and caches when a product changes
+NOTIFY_CHANNEL = 'price_insights_etl'
+
 # Items to filter out from results
 dont_include = {
     "Sponsored", "Currently unavailable", 
@@ -68,16 +72,23 @@ def get_db_connection():
 
 
 def update_product_availability(asin, available):
-    """Mark a product's availability in the products table."""
+    """
+    Mark a product's availability in the products table. A change bumps
+    updated_at, which the API's ETags are built from, and notifies the
+    listening API processes when the transaction commits.
+    """
     conn = get_db_connection()
     if not conn:
         return
     try:
         with conn.cursor() as cur:
             cur.execute(
-                "UPDATE products SET availability = %s WHERE asin = %s",
-                (available, asin)
+                "UPDATE products SET availability = %s, updated_at = NOW() "
+                "WHERE asin = %s AND availability IS DISTINCT FROM %s",
+                (available, asin, available)
             )
+            if cur.rowcount:
+                cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, json.dumps({'asins': [asin]})))
         conn.commit()
     except Exception as e:
         print(f"Error updating availability for ASIN {asin}: {e}")
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+forecast_prices.py
+
+Precomputes the Holt price forecast of every ASIN into price_forecasts,
+so /product/{asin}/predictprice is a primary-key lookup instead of a
+model fit inside the request.
+
+The history of every ASIN whose forecast is missing or older than its
+latest price is streamed in one query (server-side cursor, ordered by
+asin, ts), cut into blocks of BLOCK_SIZE ASINs and fitted across a process
+pool using all cores. The default engine, holt_numpy, fits a whole block
+in one vectorized pass; --engine statsmodels fits series one by one with
+ML_predictor_ as the API's on-demand path does. Results are upserted in
+batches. Each row keeps FORECAST_HORIZON_DAYS of forecast
+values; the API answers any shorter horizon by slicing them. Failed fits
+are stored too (status/detail), so they are not retried until new data
+arrives.
+
+A full fit also saves the model's state in price_model_state (parameters,
+final level and trend, last ts). Until the model is FORECAST_REFIT_DAYS
+old, new prices only advance that state through the Holt recursion, one
+step per new row, read with a `ts > last_ts` range scan. The one-step
+errors of those updates are tracked; when their RMSE exceeds
+FORECAST_DRIFT_RATIO times the fit's in-sample RMSE the ASIN is refitted
+in the same run.
+
+upsert_production_pricehistory runs it after each ETL commit. Run
+directly to refresh, or with --all to refit every ASIN:
+    python forecast_prices.py [--all] [--workers N] [--engine numpy|statsmodels]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from itertools import groupby
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import psycopg2
+import numpy as np
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import holt_numpy
+import forecast_report
+
+load_dotenv()
+
+# === CONFIGURATION ===
+DB_CONFIG = {
+    'host':     os.getenv("PG_HOST", "localhost"),
+    'port':     os.getenv("PG_PORT"),
+    'dbname':   os.getenv("PG_DB", "staging"),
+    'user':     os.getenv("PG_USER", "postgres"),
+    'password': os.getenv("PG_PASSWORD"),
+}
+
+FORECAST_HORIZON_DAYS = int(os.getenv("FORECAST_HORIZON_DAYS", "90"))
+FETCH_SIZE = 20000          # history rows per round trip of the server-side cursor
+WRITE_BATCH = 500           # forecasts per upsert
+BLOCK_SIZE = 250            # ASINs per worker task
+PENDING_PER_WORKER = 2      # blocks in flight per worker, bounds memory while streaming
+ENGINES = ('numpy', 'statsmodels')
+FORECAST_REFIT_DAYS = float(os.getenv("FORECAST_REFIT_DAYS", "7"))
+FORECAST_DRIFT_RATIO = float(os.getenv("FORECAST_DRIFT_RATIO", "2"))
+MIN_DRIFT_OBSERVATIONS = 5  # one-step errors needed before drift is judged
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS price_forecasts (
+    asin               TEXT PRIMARY KEY,
+    horizon_days       INTEGER NOT NULL,
+    status             TEXT NOT NULL,
+    forecast           DOUBLE PRECISION[],
+    last_price         DOUBLE PRECISION,
+    min_price          DOUBLE PRECISION,
+    max_price          DOUBLE PRECISION,
+    first_crossing_day INTEGER,
+    model_params       JSONB,
+    detail             TEXT,
+    observations       INTEGER NOT NULL,
+    source_last_ts     TIMESTAMPTZ,
+    fitted_at          TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+CREATE_STATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS price_model_state (
+    asin            TEXT PRIMARY KEY,
+    smoothing_level DOUBLE PRECISION NOT NULL,
+    smoothing_trend DOUBLE PRECISION NOT NULL,
+    damping_trend   DOUBLE PRECISION NOT NULL,
+    initial_level   DOUBLE PRECISION NOT NULL,
+    initial_trend   DOUBLE PRECISION NOT NULL,
+    level           DOUBLE PRECISION NOT NULL,
+    trend           DOUBLE PRECISION NOT NULL,
+    fit_mse         DOUBLE PRECISION NOT NULL,           -- in-sample one-step MSE of the last full fit
+    error_sse       DOUBLE PRECISION NOT NULL DEFAULT 0, -- one-step errors of the updates since
+    error_count     INTEGER NOT NULL DEFAULT 0,
+    last_ts         TIMESTAMPTZ NOT NULL,
+    last_price      DOUBLE PRECISION NOT NULL,
+    observations    INTEGER NOT NULL,
+    fitted_at       TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# Forecast missing, older than the latest price, or shorter than the horizon
+STALE_FORECAST = "(f.asin IS NULL OR f.source_last_ts < lp.ts OR f.horizon_days < %(horizon)s)"
+
+# Stale ASINs whose model state is recent enough to be advanced instead of refitted
+UPDATABLE_STATE_SQL = f"""
+SELECT s.asin, s.smoothing_level, s.smoothing_trend, s.damping_trend, s.initial_level, s.initial_trend,
+       s.level, s.trend, s.fit_mse, s.error_sse, s.error_count, s.last_ts, s.last_price, s.observations
+FROM price_model_state s
+JOIN product_latest_price lp ON lp.asin = s.asin
+LEFT JOIN price_forecasts f ON f.asin = s.asin
+WHERE {STALE_FORECAST}
+  AND s.fitted_at >= now() - %(refit_days)s * interval '1 day'
+"""
+
+NEW_HISTORY_SQL = """
+SELECT ph.asin, ph.ts, ph.price
+FROM price_history ph
+JOIN price_model_state s ON s.asin = ph.asin AND ph.ts > s.last_ts
+WHERE ph.asin = ANY(%s)
+ORDER BY ph.asin, ph.ts
+"""
+
+# Stale ASINs without a usable model state, plus those whose updates drifted
+STALE_HISTORY_SQL = f"""
+SELECT ph.asin, ph.ts, ph.price
+FROM price_history ph
+WHERE ph.asin IN (
+    SELECT lp.asin
+    FROM product_latest_price lp
+    LEFT JOIN price_forecasts f ON f.asin = lp.asin
+    LEFT JOIN price_model_state s ON s.asin = lp.asin
+    WHERE {STALE_FORECAST}
+      AND (s.asin IS NULL OR s.fitted_at < now() - %(refit_days)s * interval '1 day')
+) OR ph.asin = ANY(%(drifted)s)
+ORDER BY ph.asin, ph.ts
+"""
+
+ALL_HISTORY_SQL = """
+SELECT asin, ts, price
+FROM price_history
+ORDER BY asin, ts
+"""
+
+UPSERT_SQL = """
+INSERT INTO price_forecasts (asin, horizon_days, status, forecast, last_price, min_price, max_price,
+                             first_crossing_day, model_params, detail, observations, source_last_ts)
+VALUES %s
+ON CONFLICT (asin) DO UPDATE
+  SET horizon_days       = EXCLUDED.horizon_days,
+      status             = EXCLUDED.status,
+      forecast           = EXCLUDED.forecast,
+      last_price         = EXCLUDED.last_price,
+      min_price          = EXCLUDED.min_price,
+      max_price          = EXCLUDED.max_price,
+      first_crossing_day = EXCLUDED.first_crossing_day,
+      model_params       = EXCLUDED.model_params,
+      detail             = EXCLUDED.detail,
+      observations       = EXCLUDED.observations,
+      source_last_ts     = EXCLUDED.source_last_ts,
+      fitted_at          = now()
+"""
+
+STATE_UPSERT_SQL = """
+INSERT INTO price_model_state (asin, smoothing_level, smoothing_trend, damping_trend, initial_level, initial_trend,
+                               level, trend, fit_mse, last_ts, last_price, observations)
+VALUES %s
+ON CONFLICT (asin) DO UPDATE
+  SET smoothing_level = EXCLUDED.smoothing_level,
+      smoothing_trend = EXCLUDED.smoothing_trend,
+      damping_trend   = EXCLUDED.damping_trend,
+      initial_level   = EXCLUDED.initial_level,
+      initial_trend   = EXCLUDED.initial_trend,
+      level           = EXCLUDED.level,
+      trend           = EXCLUDED.trend,
+      fit_mse         = EXCLUDED.fit_mse,
+      error_sse       = 0,
+      error_count     = 0,
+      last_ts         = EXCLUDED.last_ts,
+      last_price      = EXCLUDED.last_price,
+      observations    = EXCLUDED.observations,
+      fitted_at       = now(),
+      updated_at      = now()
+"""
+
+STATE_ADVANCE_SQL = """
+UPDATE price_model_state s
+SET level = v.level, trend = v.trend, error_sse = v.error_sse, error_count = v.error_count,
+    last_ts = v.last_ts, last_price = v.last_price, observations = v.observations, updated_at = now()
+FROM (VALUES %s) AS v (asin, level, trend, error_sse, error_count, last_ts, last_price, observations)
+WHERE s.asin = v.asin
+"""
+
+# A failed refit leaves no model to advance
+STATE_DELETE_SQL = "DELETE FROM price_model_state WHERE asin = ANY(%s)"
+
+
+def ensure_table(cur):
+    cur.execute(CREATE_TABLE_SQL)
+    cur.execute(CREATE_STATE_TABLE_SQL)
+
+
+def _init_worker(engine):
+    import logging
+    import warnings
+    if engine == 'statsmodels':
+        import ML_predictor_  # noqa: F401  (statsmodels re-enables its warnings on import)
+    logging.disable(logging.ERROR)              # per-fit logs would flood the output; failures land in `detail`
+    warnings.simplefilter("ignore")             # statsmodels frequency warnings, one per series
+
+
+def _fit_block(block, horizon, engine):
+    """[(result, observations, source_last_ts)] for a block of (asin, rows) items."""
+    if engine == 'numpy':
+        results = holt_numpy.forecast_results(block, horizon)
+    else:
+        from ML_predictor_ import forecast_holt
+        results = [forecast_holt(asin, rows, horizon) for asin, rows in block]
+    return [(result, len(rows), rows[-1][0]) for result, (_, rows) in zip(results, block)]
+
+
+def _row(result, observations, last_ts, horizon):
+    detail = result.get('detail')
+    return (
+        result['asin'], horizon, result['status'], result.get('forecast'), result.get('last_price'),
+        result.get('min_price'), result.get('max_price'), result.get('first_crossing_day'),
+        json.dumps(result['params']) if 'params' in result else None,
+        None if detail is None else str(detail), observations, last_ts,
+    )
+
+
+def _state_row(result, observations, last_ts):
+    params, state = result['params'], result['state']
+    return (
+        result['asin'], *(params[name] for name in holt_numpy.PARAM_NAMES),
+        state['level'], state['trend'], state['mse'], last_ts, result['last_price'], observations,
+    )
+
+
+def advance_states(conn, horizon=FORECAST_HORIZON_DAYS, refit_days=FORECAST_REFIT_DAYS):
+    """
+    Bring stale forecasts up to date from their saved model state. Returns
+    a status count and the ASINs whose one-step errors drifted, which need
+    a full refit.
+    """
+    with conn.cursor() as cur:
+        cur.execute(UPDATABLE_STATE_SQL, {'horizon': horizon, 'refit_days': refit_days})
+        states = {row[0]: row for row in cur.fetchall()}
+        if not states:
+            return {}, []
+        cur.execute(NEW_HISTORY_SQL, (list(states),))
+        new_rows = {asin: [(ts, price) for _, ts, price in group]
+                    for asin, group in groupby(cur.fetchall(), key=lambda r: r[0])}
+
+    asins, series, drifted = [], [], []
+    for asin in states:
+        rows = new_rows.get(asin, [])
+        if any(price is None for _, price in rows):
+            drifted.append(asin)   # a refit reports the invalid data
+            continue
+        asins.append(asin)
+        series.append(np.array([float(price) for _, price in rows]))
+    if not asins:
+        return {}, drifted
+
+    columns = list(zip(*(states[asin] for asin in asins)))
+    alpha, beta, phi, l0, b0, level, trend, fit_mse, error_sse, error_count = (np.array(c, dtype=np.float64) for c in columns[1:11])
+    level, trend, sse = holt_numpy.run(series, alpha, beta, phi, level, trend)
+    error_sse += sse
+    error_count += [len(s) for s in series]
+    forecasts = holt_numpy.forecast(level, trend, phi, horizon)
+
+    counts, forecast_rows, state_rows = {}, [], []
+    for i, asin in enumerate(asins):
+        _, *_, last_ts, last_price, observations = states[asin]
+        if error_count[i] >= MIN_DRIFT_OBSERVATIONS and \
+                error_sse[i] / error_count[i] > FORECAST_DRIFT_RATIO ** 2 * fit_mse[i]:
+            drifted.append(asin)
+            continue
+        if len(series[i]):
+            last_ts, last_price = new_rows[asin][-1][0], float(series[i][-1])
+        observations += len(series[i])
+        params = dict(zip(holt_numpy.PARAM_NAMES, (alpha[i], beta[i], phi[i], l0[i], b0[i])))
+        state = {'level': level[i], 'trend': trend[i], 'mse': fit_mse[i]}
+        result = forecast_report.classify(asin, horizon, last_price, forecasts[i],
+                                          {k: float(v) for k, v in params.items()}, state)
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+        forecast_rows.append(_row(result, observations, last_ts, horizon))
+        state_rows.append((asin, float(level[i]), float(trend[i]), float(error_sse[i]), int(error_count[i]),
+                           last_ts, last_price, observations))
+
+    with conn.cursor() as cur:
+        for start in range(0, len(forecast_rows), WRITE_BATCH):
+            execute_values(cur, UPSERT_SQL, forecast_rows[start:start + WRITE_BATCH])
+            execute_values(cur, STATE_ADVANCE_SQL, state_rows[start:start + WRITE_BATCH])
+    conn.commit()
+    return counts, drifted
+
+
+def refresh_forecasts(conn, refit_all=False, workers=None, horizon=FORECAST_HORIZON_DAYS, engine='numpy',
+                      refit_days=FORECAST_REFIT_DAYS):
+    """
+    Bring stale forecasts (or all of them) up to date: advance saved model
+    states where possible, refit the rest. Returns a status count.
+    """
+    with conn.cursor() as cur:
+        ensure_table(cur)
+    conn.commit()
+
+    counts, drifted = ({}, []) if refit_all else advance_states(conn, horizon, refit_days)
+    workers = workers or os.cpu_count() or 1
+    pending, block, batch, state_batch, failed = set(), [], [], [], []
+
+    def collect(done):
+        for future in done:
+            for result, observations, last_ts in future.result():
+                counts[result['status']] = counts.get(result['status'], 0) + 1
+                batch.append(_row(result, observations, last_ts, horizon))
+                if 'state' in result:
+                    state_batch.append(_state_row(result, observations, last_ts))
+                else:
+                    failed.append(result['asin'])
+        if len(batch) >= WRITE_BATCH:
+            flush()
+
+    def submit():
+        nonlocal pending
+        if len(pending) >= workers * PENDING_PER_WORKER:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+        pending.add(pool.submit(_fit_block, list(block), horizon, engine))
+        block.clear()
+
+    def flush():
+        if batch:
+            with write_conn.cursor() as wcur:
+                execute_values(wcur, UPSERT_SQL, batch)
+                if state_batch:
+                    execute_values(wcur, STATE_UPSERT_SQL, state_batch)
+                if failed:
+                    wcur.execute(STATE_DELETE_SQL, (failed,))
+            write_conn.commit()
+            batch.clear()
+            state_batch.clear()
+            failed.clear()
+
+    # The named cursor keeps a transaction open on `conn`, so writes go through a second
+    # connection to the same database; conn.dsn masks the password, so pass it again
+    write_conn = psycopg2.connect(conn.dsn, password=DB_CONFIG['password'])
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(engine,)) as pool, \
+                conn.cursor(name="forecast_history") as cur:
+            cur.itersize = FETCH_SIZE
+            cur.execute(ALL_HISTORY_SQL if refit_all else STALE_HISTORY_SQL,
+                        None if refit_all else {'horizon': horizon, 'refit_days': refit_days, 'drifted': drifted})
+            for asin, group in groupby(cur, key=lambda r: r[0]):
+                block.append((asin, [(ts, price) for _, ts, price in group]))
+                if len(block) >= BLOCK_SIZE:
+                    submit()
+            if block:
+                submit()
+            collect(wait(pending).done)
+            flush()
+        conn.commit()
+    finally:
+        write_conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute Holt price forecasts into price_forecasts.")
+    parser.add_argument("--all", action="store_true", help="refit every ASIN, not only stale ones")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--engine", choices=ENGINES, default='numpy', help="fitting engine (default: numpy)")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        start = time.perf_counter()
+        counts = refresh_forecasts(conn, refit_all=args.all, workers=args.workers, engine=args.engine)
+        total = sum(counts.values())
+        summary = ", ".join(f"{status}={n}" for status, n in sorted(counts.items())) or "nothing stale"
+        print(f"Fitted {total} forecasts in {time.perf_counter() - start:.1f}s ({summary}).")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
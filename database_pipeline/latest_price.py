@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+latest_price.py
+
+Maintains product_latest_price: one row per ASIN holding its most recent
+price_history entry (raw_price, raw_discount, numeric price, ts). The API
+joins this table instead of running a LATERAL "latest row" lookup per
+product. upsert_production_pricehistory keeps it current in the same
+transaction as each price_history insert.
+
+Run directly to rebuild it from existing history:
+    python latest_price.py
+"""
+import os
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# === CONFIGURATION ===
+DB_CONFIG = {
+    'host':     os.getenv("PG_HOST", "localhost"),
+    'port':     os.getenv("PG_PORT"),
+    'dbname':   os.getenv("PG_DB", "staging"),
+    'user':     os.getenv("PG_USER", "postgres"),
+    'password': os.getenv("PG_PASSWORD"),
+}
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS product_latest_price (
+    asin         TEXT PRIMARY KEY,
+    raw_price    TEXT,
+    raw_discount TEXT,
+    price        NUMERIC(12,2),
+    ts           TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS product_latest_price_ts_idx
+    ON product_latest_price (ts);
+"""
+
+# One index probe per touched ASIN; never moves a row backwards in time.
+REFRESH_SQL = """
+INSERT INTO product_latest_price (asin, raw_price, raw_discount, price, ts)
+SELECT a.asin, ph.raw_price, ph.raw_discount, ph.price, ph.ts
+FROM unnest(%s::text[]) AS a(asin)
+CROSS JOIN LATERAL (
+    SELECT raw_price, raw_discount, price, ts
+    FROM price_history
+    WHERE asin = a.asin
+    ORDER BY ts DESC
+    LIMIT 1
+) ph
+ON CONFLICT (asin) DO UPDATE
+  SET raw_price    = EXCLUDED.raw_price,
+      raw_discount = EXCLUDED.raw_discount,
+      price        = EXCLUDED.price,
+      ts           = EXCLUDED.ts
+WHERE product_latest_price.ts <= EXCLUDED.ts
+"""
+
+REBUILD_SQL = """
+INSERT INTO product_latest_price (asin, raw_price, raw_discount, price, ts)
+SELECT DISTINCT ON (asin) asin, raw_price, raw_discount, price, ts
+FROM price_history
+ORDER BY asin, ts DESC
+"""
+
+
+def ensure_table(cur):
+    cur.execute(CREATE_TABLE_SQL)
+
+
+def refresh_latest_prices(cur, asins):
+    """
+    Re-point product_latest_price at the newest price_history row for each
+    ASIN in `asins`. Runs on the caller's cursor, so it commits (or rolls
+    back) together with the price_history insert.
+    """
+    if asins:
+        cur.execute(REFRESH_SQL, (list(asins),))
+
+
+def rebuild(conn):
+    with conn.cursor() as cur:
+        ensure_table(cur)
+        cur.execute("TRUNCATE product_latest_price")
+        cur.execute(REBUILD_SQL)
+        count = cur.rowcount
+    conn.commit()
+    return count
+
+
+def main():
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        count = rebuild(conn)
+        print(f"Rebuilt product_latest_price with {count} products.")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
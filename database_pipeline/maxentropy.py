@@ -16,15 +16,15 @@ DB_CONFIG = {
 }
 
 # === SQL QUERIES ===
+# Both read the product_price_stats rollup (see price_stats.py)
 
 # 1) Top 10 ASINs by number of unique price values
 TOP_10_UNIQUE_PRICES_QUERY = """
 SELECT
   asin,
-  COUNT(DISTINCT price) AS unique_price_count
-FROM price_history
-GROUP BY asin
-ORDER BY unique_price_count DESC
+  distinct_price_count AS unique_price_count
+FROM product_price_stats
+ORDER BY distinct_price_count DESC
 LIMIT 10;
 """
 
@@ -33,10 +33,9 @@ LONGEST_STALE_PRODUCTS_QUERY = """
 SELECT
   p.asin,
   p.title,
-  MAX(ph.ts) AS last_update
+  s.latest_ts AS last_update
 FROM products p
-LEFT JOIN price_history ph ON p.asin = ph.asin
-GROUP BY p.asin, p.title
+LEFT JOIN product_price_stats s ON p.asin = s.asin
 ORDER BY last_update ASC NULLS FIRST
 LIMIT 10;
 """
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+price_events.py
+
+Maintains price_change_events: one row per observed price transition
+(asin, ts, old_price, new_price, pct_change), indexed by ts. The ETL
+detects transitions while it inserts each batch, so the deals endpoint is
+a time-bounded range scan instead of a LAG() over all of price_history.
+
+Run directly to rebuild it from existing history:
+    python price_events.py
+"""
+import os
+from collections import defaultdict
+
+import psycopg2
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# === CONFIGURATION ===
+DB_CONFIG = {
+    'host':     os.getenv("PG_HOST", "localhost"),
+    'port':     os.getenv("PG_PORT"),
+    'dbname':   os.getenv("PG_DB", "staging"),
+    'user':     os.getenv("PG_USER", "postgres"),
+    'password': os.getenv("PG_PASSWORD"),
+}
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS price_change_events (
+    asin       TEXT NOT NULL,
+    ts         TIMESTAMPTZ NOT NULL,
+    old_price  NUMERIC(12,2) NOT NULL,
+    new_price  NUMERIC(12,2) NOT NULL,
+    pct_change NUMERIC NOT NULL,
+    PRIMARY KEY (asin, ts)
+);
+CREATE INDEX IF NOT EXISTS price_change_events_ts_idx
+    ON price_change_events (ts DESC);
+"""
+
+# Tables created with a bounded pct_change roll back the whole ETL batch
+# when a near-zero previous price makes the percentage overflow it
+PCT_CHANGE_BOUNDED_SQL = """
+SELECT 1
+FROM information_schema.columns
+WHERE table_name = 'price_change_events'
+  AND column_name = 'pct_change'
+  AND numeric_precision IS NOT NULL
+"""
+
+WIDEN_PCT_CHANGE_SQL = """
+ALTER TABLE price_change_events ALTER COLUMN pct_change TYPE NUMERIC
+"""
+
+# Price each ASIN had before this batch, from the stats rollup
+PREVIOUS_PRICE_SQL = """
+SELECT asin, latest_price, latest_ts
+FROM product_price_stats
+WHERE asin = ANY(%s)
+"""
+
+INSERT_EVENTS_SQL = """
+INSERT INTO price_change_events (asin, ts, old_price, new_price, pct_change)
+VALUES %s
+ON CONFLICT (asin, ts) DO NOTHING
+"""
+
+REBUILD_SQL = """
+INSERT INTO price_change_events (asin, ts, old_price, new_price, pct_change)
+SELECT asin, ts, prev_price, price, ROUND((price - prev_price) / prev_price * 100, 2)
+FROM (
+    SELECT asin, ts, price,
+           LAG(price) OVER (PARTITION BY asin ORDER BY ts) AS prev_price
+    FROM price_history
+    WHERE price IS NOT NULL
+) h
+WHERE prev_price > 0
+  AND price <> prev_price
+"""
+
+
+def ensure_table(cur):
+    cur.execute(CREATE_TABLE_SQL)
+    cur.execute(PCT_CHANGE_BOUNDED_SQL)
+    if cur.fetchone():
+        # Dropping the typmod needs no table rewrite
+        cur.execute(WIDEN_PCT_CHANGE_SQL)
+
+
+def detect_price_changes(previous, inserted_rows):
+    """
+    Walk each ASIN's new rows in ts order and emit (asin, ts, old, new, pct)
+    for every price that differs from the one before it. `previous` maps
+    asin -> (price, ts) as of before the batch. Rows older than the
+    previous latest observation are ignored.
+    """
+    by_asin = defaultdict(list)
+    for asin, price, ts, _ in inserted_rows:
+        if price is not None:
+            by_asin[asin].append((ts, price))
+
+    events = []
+    for asin, batch in by_asin.items():
+        batch.sort(key=lambda r: r[0])
+        last_price, last_ts = previous.get(asin, (None, None))
+        for ts, price in batch:
+            if last_ts is not None and ts <= last_ts:
+                continue
+            if last_price is not None and last_price > 0 and price != last_price:
+                pct = round((price - last_price) / last_price * 100, 2)
+                events.append((asin, ts, last_price, price, pct))
+            last_price, last_ts = price, ts
+    return events
+
+
+def record_price_changes(cur, inserted_rows):
+    """
+    Write price transitions found in a batch of newly inserted
+    price_history rows. Must run before price_stats.update_price_stats,
+    which moves latest_price past this batch.
+    """
+    if not inserted_rows:
+        return 0
+    cur.execute(PREVIOUS_PRICE_SQL, (list({row[0] for row in inserted_rows}),))
+    previous = {asin: (price, ts) for asin, price, ts in cur.fetchall()}
+    events = detect_price_changes(previous, inserted_rows)
+    if events:
+        execute_values(cur, INSERT_EVENTS_SQL, events)
+    return len(events)
+
+
+def rebuild(conn):
+    with conn.cursor() as cur:
+        ensure_table(cur)
+        cur.execute("TRUNCATE price_change_events")
+        cur.execute(REBUILD_SQL)
+        count = cur.rowcount
+    conn.commit()
+    return count
+
+
+def main():
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        count = rebuild(conn)
+        print(f"Rebuilt price_change_events with {count} events.")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+price_stats.py
+
+Maintains product_price_stats: per-ASIN min/max/latest price, observation
+count, distinct raw_price count and the time the current price took
+effect. The trending and bestseller endpoints and the maxentropy report
+read it with indexed top-N lookups instead of aggregating price_history.
+
+upsert_production_pricehistory folds each batch of newly inserted
+price_history rows into it; nothing is recomputed from full history.
+
+Run directly to rebuild it from existing history:
+    python price_stats.py
+"""
+import os
+from collections import defaultdict
+
+import psycopg2
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# === CONFIGURATION ===
+DB_CONFIG = {
+    'host':     os.getenv("PG_HOST", "localhost"),
+    'port':     os.getenv("PG_PORT"),
+    'dbname':   os.getenv("PG_DB", "staging"),
+    'user':     os.getenv("PG_USER", "postgres"),
+    'password': os.getenv("PG_PASSWORD"),
+}
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS product_price_stats (
+    asin                 TEXT PRIMARY KEY,
+    min_price            NUMERIC(12,2),
+    max_price            NUMERIC(12,2),
+    latest_price         NUMERIC(12,2),
+    latest_ts            TIMESTAMPTZ,
+    observation_count    INTEGER NOT NULL DEFAULT 0,
+    distinct_price_count INTEGER NOT NULL DEFAULT 0,
+    last_change_ts       TIMESTAMPTZ,
+    drop_from_max_pct    NUMERIC GENERATED ALWAYS AS (
+        CASE WHEN max_price > 0 AND latest_price < max_price
+             THEN (max_price - latest_price) / max_price * 100
+             ELSE 0
+        END
+    ) STORED
+);
+CREATE INDEX IF NOT EXISTS product_price_stats_distinct_idx
+    ON product_price_stats (distinct_price_count DESC);
+CREATE INDEX IF NOT EXISTS product_price_stats_drop_idx
+    ON product_price_stats (drop_from_max_pct DESC);
+CREATE INDEX IF NOT EXISTS product_price_stats_latest_ts_idx
+    ON product_price_stats (latest_ts);
+"""
+
+SELECT_STATS_SQL = """
+SELECT asin, min_price, max_price, latest_price, latest_ts,
+       observation_count, distinct_price_count, last_change_ts
+FROM product_price_stats
+WHERE asin = ANY(%s)
+FOR UPDATE
+"""
+
+# (asin, raw_price) pairs from the batch that already appear in older history
+SEEN_BEFORE_SQL = """
+SELECT DISTINCT v.asin, v.raw_price
+FROM (VALUES %s) AS v(asin, raw_price, batch_ts)
+WHERE EXISTS (
+    SELECT 1 FROM price_history ph
+    WHERE ph.asin = v.asin
+      AND ph.raw_price = v.raw_price
+      AND NOT (ph.ts = ANY(v.batch_ts))
+)
+"""
+
+UPSERT_STATS_SQL = """
+INSERT INTO product_price_stats
+  (asin, min_price, max_price, latest_price, latest_ts,
+   observation_count, distinct_price_count, last_change_ts)
+VALUES %s
+ON CONFLICT (asin) DO UPDATE
+  SET min_price            = EXCLUDED.min_price,
+      max_price            = EXCLUDED.max_price,
+      latest_price         = EXCLUDED.latest_price,
+      latest_ts            = EXCLUDED.latest_ts,
+      observation_count    = EXCLUDED.observation_count,
+      distinct_price_count = EXCLUDED.distinct_price_count,
+      last_change_ts       = EXCLUDED.last_change_ts
+"""
+
+REBUILD_SQL = """
+INSERT INTO product_price_stats
+  (asin, min_price, max_price, latest_price, latest_ts,
+   observation_count, distinct_price_count, last_change_ts)
+SELECT
+  h.asin,
+  MIN(h.price),
+  MAX(h.price),
+  (array_agg(h.price ORDER BY h.ts DESC))[1],
+  MAX(h.ts),
+  COUNT(*),
+  COUNT(DISTINCT NULLIF(h.raw_price, '')),
+  MAX(h.ts) FILTER (WHERE h.prev_price IS DISTINCT FROM h.price)
+FROM (
+  SELECT asin, price, raw_price, ts,
+         LAG(price) OVER (PARTITION BY asin ORDER BY ts) AS prev_price
+  FROM price_history
+) h
+GROUP BY h.asin
+"""
+
+
+def ensure_table(cur):
+    cur.execute(CREATE_TABLE_SQL)
+
+
+def _least(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _greatest(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+def update_price_stats(cur, inserted_rows):
+    """
+    Fold newly inserted price_history rows into product_price_stats.
+
+    `inserted_rows` are (asin, price, ts, raw_price) tuples for rows that
+    were actually inserted (RETURNING from the price_history insert), so
+    ON CONFLICT duplicates are never counted twice. Runs on the caller's
+    cursor inside the ETL transaction.
+    """
+    if not inserted_rows:
+        return
+
+    by_asin = defaultdict(list)
+    for asin, price, ts, raw_price in inserted_rows:
+        by_asin[asin].append((ts, price, raw_price))
+    for batch in by_asin.values():
+        batch.sort(key=lambda r: r[0])
+
+    cur.execute(SELECT_STATS_SQL, (list(by_asin),))
+    current = {row[0]: list(row[1:]) for row in cur.fetchall()}
+
+    pairs = {
+        (asin, raw_price): [ts for ts, _, _ in batch]
+        for asin, batch in by_asin.items()
+        for _, _, raw_price in batch if raw_price
+    }
+    seen_before = set()
+    if pairs:
+        seen_before = set(execute_values(
+            cur, SEEN_BEFORE_SQL,
+            [(asin, raw_price, batch_ts) for (asin, raw_price), batch_ts in pairs.items()],
+            fetch=True,
+        ))
+
+    records = []
+    for asin, batch in by_asin.items():
+        (min_price, max_price, latest_price, latest_ts,
+         obs_count, distinct_count, last_change_ts) = current.get(asin, [None, None, None, None, 0, 0, None])
+
+        obs_count += len(batch)
+        distinct_count += len({
+            raw_price for _, _, raw_price in batch
+            if raw_price and (asin, raw_price) not in seen_before
+        })
+        for ts, price, _ in batch:
+            min_price = _least(min_price, price)
+            max_price = _greatest(max_price, price)
+            # Late-arriving rows older than the current latest don't move it
+            if latest_ts is None or ts > latest_ts:
+                if latest_ts is None or price != latest_price:
+                    last_change_ts = ts
+                latest_price, latest_ts = price, ts
+
+        records.append((asin, min_price, max_price, latest_price, latest_ts,
+                        obs_count, distinct_count, last_change_ts))
+
+    execute_values(cur, UPSERT_STATS_SQL, records)
+
+
+def rebuild(conn):
+    with conn.cursor() as cur:
+        ensure_table(cur)
+        cur.execute("TRUNCATE product_price_stats")
+        cur.execute(REBUILD_SQL)
+        count = cur.rowcount
+    conn.commit()
+    return count
+
+
+def main():
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        count = rebuild(conn)
+        print(f"Rebuilt product_price_stats with {count} products.")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
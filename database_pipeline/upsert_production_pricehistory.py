@@ -3,8 +3,9 @@
 etl_staging_to_core.py
 
 Reads raw staging records, upserts into products,
-inserts into price_history, marks staging rows as processed,
-and updates high_res_image_url in products.
+inserts into price_history (keeping product_latest_price,
+product_price_stats and price_change_events in step),
+marks staging rows as processed, and updates high_res_image_url in products.
 """
 import re
 import json
@@ -16,6 +17,11 @@ import os
 import logging
 from dotenv import load_dotenv
 
+import latest_price
+import price_stats
+import price_events
+import forecast_prices
+
 load_dotenv()
 
 # === CONFIGURATION ===
@@ -29,6 +35,10 @@ DB_CONFIG = {
 
 BATCH_SIZE = 500  # adjust as needed
 
+# API processes LISTEN here to drop caches after a run (see etl_events.py)
+NOTIFY_CHANNEL = 'price_insights_etl'
+NOTIFY_MAX_PAYLOAD = 7900  # Postgres caps NOTIFY payloads just under 8000 bytes
+
 # === DB CONNECTION ===
 def get_conn():
     return psycopg2.connect(**DB_CONFIG)
@@ -111,9 +121,15 @@ def insert_price_history(conn, history_rows):
       (asin, price, discount_pct, ts, currency, raw_price, raw_discount)
     VALUES %s
     ON CONFLICT (asin, ts) DO NOTHING
+    RETURNING asin, price, ts, raw_price
     """
     with conn.cursor() as cur:
-        execute_values(cur, sql, history_rows)
+        inserted = execute_values(cur, sql, history_rows, fetch=True)
+        # same transaction, so readers never see history without its derived tables
+        latest_price.refresh_latest_prices(cur, {row[0] for row in history_rows})
+        # events compare against the pre-batch latest price, so record them before the stats move on
+        price_events.record_price_changes(cur, inserted)
+        price_stats.update_price_stats(cur, inserted)
     conn.commit()
 
 # === MARK STAGING PROCESSED ===
@@ -139,10 +155,30 @@ def update_high_res_image_urls(conn):
         cur.execute(sql)
     conn.commit()
 
+# === NOTIFY API ===
+def notify_catalog_updated(conn, asins):
+    """
+    Tell listening API processes that this run committed new data.
+    The ASIN list is dropped if it would overflow the payload limit,
+    which listeners read as "everything changed".
+    """
+    payload = json.dumps({'asins': sorted(asins)})
+    if len(payload.encode()) > NOTIFY_MAX_PAYLOAD:
+        payload = '{}'
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, payload))
+    conn.commit()
+
 # === MAIN ETL LOOP ===
 def main():
     conn = get_conn()
     try:
+        with conn.cursor() as cur:
+            latest_price.ensure_table(cur)
+            price_stats.ensure_table(cur)
+            price_events.ensure_table(cur)
+        conn.commit()
+
         rows = fetch_unprocessed(conn)
         if not rows:
             print("☑️ No new rows to process.")
@@ -189,7 +225,14 @@ def main():
         # Finally, update high-res image URLs
         update_high_res_image_urls(conn)
 
+        notify_catalog_updated(conn, {p['asin'] for p in unique_products})
+
         print(f"Processed {len(processed_ids)} rows and updated high-res URLs.")
+
+        # Advance or refit forecasts for ASINs with new prices; the API fits on demand until this lands
+        if os.getenv("ETL_SKIP_FORECASTS") != "1":
+            counts = forecast_prices.refresh_forecasts(conn)
+            print(f"Refreshed {sum(counts.values())} price forecasts.")
     finally:
         conn.close()
 
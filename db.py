@@ -0,0 +1,230 @@
+"""
+db.py
+
+Shared Postgres connection pool used by the API and the forecasting module.
+Connections are opened once, health-checked on checkout and handed back
+to the pool instead of being closed after every request.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# === CONFIGURATION ===
+DB_CONFIG = {
+    'dbname':   os.getenv("DB_NAME", "staging"),
+    'user':     os.getenv("DB_USER", "postgres"),
+    'password': os.getenv("PG_PASSWORD"),
+    'host':     os.getenv("PG_HOST"),
+    'port':     os.getenv("PG_PORT"),
+}
+
+POOL_MIN_SIZE   = int(os.getenv("PG_POOL_MIN", "2"))
+POOL_MAX_SIZE   = int(os.getenv("PG_POOL_MAX", "10"))
+POOL_TIMEOUT    = float(os.getenv("PG_POOL_TIMEOUT", "5"))     # seconds to wait for a free connection
+POOL_CHECK_IDLE = float(os.getenv("PG_POOL_CHECK_IDLE", "10"))  # ping connections idle longer than this
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    At most `max_size` connections are open at once; callers beyond that
+    wait up to `timeout` seconds and then get PoolTimeout. Connections
+    that have been idle for more than `check_idle` seconds are pinged
+    with SELECT 1 before being handed out and replaced if dead.
+    """
+
+    def __init__(self, min_size, max_size, timeout, check_idle, **conn_kwargs):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._conn_kwargs = conn_kwargs
+        self._idle = deque()  # (conn, last_used) pairs, most recently used last
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._closed = False
+        self._stats = {
+            'opened': 0,
+            'checkouts': 0,
+            'timeouts': 0,
+            'reconnects': 0,
+            'waiting': 0,
+            'wait_ms_total': 0.0,
+        }
+        self._open = 0
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._conn_kwargs)
+        with self._lock:
+            self._open += 1
+            self._stats['opened'] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._open -= 1
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                item = self._idle.pop() if self._idle else None
+            if item is None:
+                return self._connect()
+            conn, last_used = item
+            if self._is_healthy(conn, last_used):
+                return conn
+            logger.warning("Discarding dead pooled connection")
+            self._discard(conn)
+            with self._lock:
+                self._stats['reconnects'] += 1
+
+    def getconn(self):
+        if self._closed:
+            raise PoolTimeout("Connection pool is closed")
+        start = time.monotonic()
+        with self._lock:
+            self._stats['waiting'] += 1
+        acquired = self._slots.acquire(timeout=self.timeout)
+        with self._lock:
+            self._stats['waiting'] -= 1
+            self._stats['wait_ms_total'] += (time.monotonic() - start) * 1000
+            if not acquired:
+                self._stats['timeouts'] += 1
+        if not acquired:
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._stats['checkouts'] += 1
+        return conn
+
+    def putconn(self, conn, discard=False):
+        try:
+            if not discard and not conn.closed:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            else:
+                discard = True
+        except psycopg2.Error:
+            discard = True
+
+        if discard or self._closed:
+            self._discard(conn)
+        else:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a `with` block."""
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self):
+        with self._lock:
+            checkouts = self._stats['checkouts']
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._open - len(self._idle),
+                'waiting': self._stats['waiting'],
+                'opened': self._stats['opened'],
+                'checkouts': checkouts,
+                'timeouts': self._stats['timeouts'],
+                'reconnects': self._stats['reconnects'],
+                'avg_wait_ms': round(self._stats['wait_ms_total'] / checkouts, 3) if checkouts else 0.0,
+            }
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+# === SHARED POOL ===
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def init_pool(**conn_kwargs):
+    """
+    Create the shared pool; called once at app startup. Extra keyword
+    arguments (e.g. cursor_factory) are passed to psycopg2.connect.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_TIMEOUT, POOL_CHECK_IDLE, **DB_CONFIG, **conn_kwargs
+            )
+            logger.info(f"Opened connection pool (min={POOL_MIN_SIZE}, max={POOL_MAX_SIZE})")
+    return _pool
+
+
+def close_pool():
+    """Close every pooled connection; called at app shutdown."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+            logger.info("Closed connection pool")
+
+
+def get_pool():
+    """Return the shared pool, creating it lazily for scripts run outside the API."""
+    return _pool or init_pool()
+
+
+def connection():
+    return get_pool().connection()
@@ -0,0 +1,93 @@
+"""
+downsample.py
+
+Shape-preserving reduction of a price-history series for charts. Points
+are picked with Largest-Triangle-Three-Buckets (LTTB) over (ts, price),
+and every row where the raw price changes (together with the row just
+before it, so the step stays visible) is always kept on top of that, so
+a series never loses a real price movement even when it returns more
+than the requested number of points.
+
+NumPy is imported by the first downsampling call, not with the module:
+api.py imports this at startup and most workers never downsample.
+"""
+MIN_POINTS = 3
+MAX_POINTS = 5000
+
+
+def lttb_indices(x, y, n_out):
+    """Indices of the n_out points LTTB keeps from (x, y), first and last included."""
+    import numpy as np
+    n = len(x)
+    if n_out >= n or n_out < MIN_POINTS:
+        return np.arange(n)
+
+    # Bucket boundaries for the n - 2 interior points, split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        # Average of the next bucket (or the last point) is the third vertex
+        if i + 2 < len(edges):
+            nxt_start, nxt_end = edges[i + 1], max(edges[i + 2], edges[i + 1] + 1)
+            cx, cy = x[nxt_start:nxt_end].mean(), y[nxt_start:nxt_end].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+        bx, by = x[start:end], y[start:end]
+        areas = np.abs((x[a] - cx) * (by - y[a]) - (x[a] - bx) * (cy - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def price_change_indices(raw_prices):
+    """Indices where the raw price differs from the previous row, plus the row before each."""
+    changes = set()
+    for i in range(1, len(raw_prices)):
+        if raw_prices[i] != raw_prices[i - 1]:
+            changes.add(i - 1)
+            changes.add(i)
+    return changes
+
+
+def downsample_indices(rows, points):
+    """
+    Sorted indices of the chronologically ordered (raw_price, raw_discount,
+    ts, price) rows kept when reducing them to about `points` rows, or None
+    when they are returned whole.
+    """
+    if not points or len(rows) <= points:
+        return None
+    import numpy as np
+
+    keep = price_change_indices([row[0] for row in rows])
+    keep.update((0, len(rows) - 1))
+    budget = points - len(keep)
+    if budget >= MIN_POINTS:
+        x = np.array([row[2].timestamp() for row in rows], dtype=np.float64)
+        y = np.array([np.nan if row[3] is None else float(row[3]) for row in rows], dtype=np.float64)
+        # Unparseable prices carry the last known price so they don't distort the shape
+        mask = np.isnan(y)
+        if mask.all():
+            y[:] = 0.0
+        elif mask.any():
+            idx = np.where(~mask, np.arange(len(y)), 0)
+            np.maximum.accumulate(idx, out=idx)
+            y = y[idx]
+            y[np.isnan(y)] = y[~np.isnan(y)][0]
+        keep.update(lttb_indices(x, y, budget).tolist())
+    return sorted(keep)
+
+
+def downsample_history(rows, points):
+    """
+    Reduce chronologically ordered (raw_price, raw_discount, ts, price)
+    rows to about `points` rows. Rows are returned unchanged and in order.
+    """
+    keep = downsample_indices(rows, points)
+    if keep is None:
+        return rows
+    return [rows[i] for i in keep]
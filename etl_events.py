@@ -0,0 +1,110 @@
+"""
+etl_events.py
+
+Listens for the notification upsert_production_pricehistory.py sends when
+an ETL run commits, and fans it out to in-process subscribers (caches,
+indexes) so they can refresh without polling.
+
+The payload is JSON: {"asins": [...]} for the ASINs touched by the run.
+When the list would not fit in a NOTIFY payload it is omitted, and
+subscribers should treat the event as "everything may have changed".
+"""
+import json
+import select
+import logging
+import threading
+
+import psycopg2
+from psycopg2 import extensions
+
+import db
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "price_insights_etl"
+
+_subscribers = []
+_listener = None
+
+
+def subscribe(callback):
+    """Register callback(asins) where asins is a set, or None for "all"."""
+    _subscribers.append(callback)
+
+
+def publish(asins):
+    """Deliver an event to local subscribers; also used by the listener."""
+    for callback in list(_subscribers):
+        try:
+            callback(asins)
+        except Exception:
+            logger.exception(f"ETL event subscriber {callback!r} failed")
+
+
+def parse_payload(payload):
+    try:
+        asins = json.loads(payload or "{}").get("asins")
+    except ValueError:
+        return None
+    return set(asins) if asins is not None else None
+
+
+class Listener(threading.Thread):
+    """
+    Holds one dedicated (non-pooled) connection in LISTEN mode and
+    reconnects with backoff if it drops.
+    """
+
+    def __init__(self, poll_interval=5.0):
+        super().__init__(name="etl-listener", daemon=True)
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _listen(self):
+        conn = psycopg2.connect(**db.DB_CONFIG)
+        conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {CHANNEL}")
+            logger.info(f"Listening for ETL events on '{CHANNEL}'")
+            while not self._stop_event.is_set():
+                if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    asins = parse_payload(notify.payload)
+                    logger.info(f"ETL event received ({'all' if asins is None else len(asins)} ASINs)")
+                    publish(asins)
+        finally:
+            conn.close()
+
+    def run(self):
+        backoff = 1.0
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+                backoff = 1.0
+            except psycopg2.Error as e:
+                logger.warning(f"ETL listener disconnected: {e}; retrying in {backoff:.0f}s")
+                # Events may have been missed while disconnected
+                publish(None)
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+
+
+def start_listener():
+    global _listener
+    if _listener is None:
+        _listener = Listener()
+        _listener.start()
+
+
+def stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
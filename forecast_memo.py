@@ -0,0 +1,132 @@
+"""
+forecast_memo.py
+
+In-process LRU memo for /product/{asin}/predictprice. A forecast only
+changes when new prices land, so results are keyed by the ASIN's data
+stamp: its latest price_history.ts and row count (product_price_stats
+keeps both, so the stamp is a primary-key lookup).
+
+Two bounded maps, FORECAST_MEMO_SIZE entries each:
+- fits:     (asin, latest_ts, observations) -> result carrying the fitted
+            state, so any horizon is answered with forecast_report.reforecast
+            instead of a refit
+- messages: (asin, latest_ts, observations, forecast_days) -> rendered text
+
+The stamp alone keeps answers correct: once new prices land, requests
+carry a new stamp and old entries are never hit again. evict() is
+subscribed to ETL events so those entries are freed at once instead of
+aging out of the LRU.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import forecast_report
+
+FORECAST_MEMO_SIZE = int(os.getenv("FORECAST_MEMO_SIZE", "2048"))
+
+# Stamp of an ASIN whose data version cannot be read (product_price_stats
+# does not exist yet); results for it are computed every time
+UNSTAMPED = object()
+
+
+def stamp_key(asin, stamp):
+    """Memo key for a (latest_ts, observations) stamp row; None (no history) is a stamp too."""
+    latest_ts, observations = stamp or (None, 0)
+    return (asin, latest_ts, observations)
+
+
+class ForecastMemo:
+    def __init__(self, size):
+        self.size = size
+        self._fits = OrderedDict()
+        self._messages = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'reforecasts': 0, 'misses': 0, 'evictions': 0}
+
+    def _put(self, entries, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def result(self, asin, stamp, forecast_days):
+        """The memoized fit for this stamp, reforecast to `forecast_days`, or None."""
+        if stamp is UNSTAMPED:
+            with self._lock:
+                self._stats['misses'] += 1
+            return None
+        key = stamp_key(asin, stamp)
+        with self._lock:
+            fitted = self._fits.get(key)
+            if fitted is not None:
+                self._fits.move_to_end(key)
+        result = forecast_report.reforecast(fitted, forecast_days) if fitted is not None else None
+        with self._lock:
+            self._stats['reforecasts' if result is not None else 'misses'] += 1
+        return result
+
+    def message(self, asin, stamp, forecast_days):
+        """The memoized message for this stamp and horizon, or None."""
+        if stamp is UNSTAMPED:
+            return self.result(asin, stamp, forecast_days)
+        key = stamp_key(asin, stamp) + (forecast_days,)
+        with self._lock:
+            message = self._messages.get(key)
+            if message is not None:
+                self._messages.move_to_end(key)
+                self._stats['hits'] += 1
+                return message
+        result = self.result(asin, stamp, forecast_days)
+        if result is None:
+            return None
+        message = forecast_report.render_message(result)
+        with self._lock:
+            self._put(self._messages, key, message)
+        return message
+
+    def store(self, asin, stamp, result):
+        """
+        Memoize a result for `stamp` and return its rendered message. Fit
+        errors are not kept: they can depend on the horizon or be transient.
+        """
+        message = forecast_report.render_message(result)
+        if stamp is UNSTAMPED or result['status'] == 'error':
+            return message
+        key = stamp_key(asin, stamp)
+        with self._lock:
+            if 'state' in result or result['status'] in forecast_report.DATA_FAILURE_STATUSES:
+                self._put(self._fits, key, result)
+            self._put(self._messages, key + (result['forecast_days'],), message)
+        return message
+
+    def evict(self, asins):
+        """ETL event subscriber: drop the entries of `asins`, or all when None."""
+        with self._lock:
+            for entries in (self._fits, self._messages):
+                stale = list(entries) if asins is None else [key for key in entries if key[0] in asins]
+                for key in stale:
+                    del entries[key]
+                self._stats['evictions'] += len(stale)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['reforecasts'] + self._stats['misses']
+            return {
+                **self._stats,
+                'fits': len(self._fits),
+                'messages': len(self._messages),
+                'size': self.size,
+                'hit_ratio': round((lookups - self._stats['misses']) / lookups, 4) if lookups else 0.0,
+            }
+
+    def gauges(self):
+        """Point-in-time values for metrics.render()."""
+        stats = self.stats()
+        return {
+            "forecast_memo_fits": ("Fitted forecast states held in the memo.", stats['fits']),
+            "forecast_memo_hit_ratio": ("Forecast requests answered from the memo since startup.", stats['hit_ratio']),
+        }
+
+
+forecast_memo = ForecastMemo(FORECAST_MEMO_SIZE)
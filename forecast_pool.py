@@ -0,0 +1,209 @@
+"""
+forecast_pool.py
+
+Runs the Holt fits behind /product/{asin}/predictprice in a dedicated
+process pool, so a burst of forecasts neither holds the API worker's GIL
+nor ties up the threadpool the catalog endpoints share.
+
+- At most FORECAST_WORKERS fits run at once and up to FORECAST_QUEUE_SIZE
+  more wait for a worker. Past that, forecast() raises ForecastOverloaded
+  and the API answers 503 with a Retry-After estimated from recent fits.
+- Requests for the same (asin, forecast_days) arriving while one is queued
+  or running wait for its result instead of fitting again.
+- Each request waits at most FORECAST_DEADLINE_SECONDS (ForecastTimeout).
+  A queued job whose waiters have all given up is dropped before it
+  reaches a worker.
+
+The history is read in the API process with its own pool and shipped to
+the worker, so worker processes never open database connections. Workers
+are spawned on the first forecast and import the forecasting stack once.
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", "2"))
+FORECAST_QUEUE_SIZE = int(os.getenv("FORECAST_QUEUE_SIZE", "16"))
+FORECAST_DEADLINE_SECONDS = float(os.getenv("FORECAST_DEADLINE_SECONDS", "15"))
+
+MAX_RETRY_AFTER = 60
+FIT_SECONDS_SMOOTHING = 0.2   # weight of the newest fit in the running average
+
+
+class ForecastOverloaded(Exception):
+    """Raised when the forecast queue is full; retry_after is in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Forecast queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class ForecastTimeout(Exception):
+    """Raised when a forecast does not finish within the request deadline."""
+
+
+def _warm_up():
+    import ML_predictor_  # noqa: F401  (pandas/statsmodels, once per worker)
+
+
+def _fit(asin, rows, forecast_days):
+    from ML_predictor_ import forecast_holt
+    return forecast_holt(asin, rows, forecast_days)
+
+
+class _Job:
+    def __init__(self, deadline):
+        self.deadline = deadline   # latest deadline among its waiters
+        self.waiters = 0
+        self.task = None
+
+
+class ForecastPool:
+    def __init__(self, workers, queue_size, deadline):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = None
+        self._jobs = {}           # (asin, forecast_days) -> _Job
+        self._running = 0
+        self._fit_seconds = None
+        self._stats = {'submitted': 0, 'coalesced': 0, 'rejected': 0, 'timeouts': 0, 'dropped': 0, 'errors': 0}
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn, not fork: the API process has pool, listener and loop threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm_up,
+                )
+                logger.info(f"Started forecast pool with {self.workers} worker processes")
+            return self._executor
+
+    def retry_after(self):
+        per_fit = self._fit_seconds or 1.0
+        backlog = len(self._jobs) / max(self.workers, 1)
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(per_fit * backlog)))
+
+    async def forecast(self, asin, forecast_days, load_history):
+        """
+        The forecast_report result for `asin`. `load_history(asin)` is an
+        async callable returning its (ts, price) rows, run once per fit.
+        """
+        loop = asyncio.get_running_loop()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        deadline = loop.time() + self.deadline
+        key = (asin, forecast_days)
+
+        job = self._jobs.get(key)
+        if job is not None:
+            self._stats['coalesced'] += 1
+            job.deadline = max(job.deadline, deadline)
+        else:
+            if len(self._jobs) >= self.workers + self.queue_size:
+                self._stats['rejected'] += 1
+                raise ForecastOverloaded(self.retry_after())
+            self._stats['submitted'] += 1
+            job = self._jobs[key] = _Job(deadline)
+            job.task = asyncio.ensure_future(self._run(job, asin, forecast_days, load_history))
+            job.task.add_done_callback(lambda task: self._job_done(key, task))
+
+        job.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(job.task), timeout=deadline - loop.time())
+        except asyncio.TimeoutError:
+            self._stats['timeouts'] += 1
+            raise ForecastTimeout(f"Forecast for {asin} did not finish within {self.deadline:g}s")
+        finally:
+            job.waiters -= 1
+
+    async def _run(self, job, asin, forecast_days, load_history):
+        loop = asyncio.get_running_loop()
+        try:
+            async with self._slots:
+                if job.waiters == 0 and loop.time() >= job.deadline:
+                    self._stats['dropped'] += 1
+                    raise ForecastTimeout(f"Forecast for {asin} expired in the queue")
+                self._running += 1
+                try:
+                    rows = await load_history(asin)
+                    start = time.perf_counter()
+                    executor = self._get_executor()
+                    try:
+                        result = await loop.run_in_executor(executor, _fit, asin, rows, forecast_days)
+                    except BrokenProcessPool:
+                        self._discard_executor(executor)
+                        raise
+                    self._observe_fit(time.perf_counter() - start)
+                    return result
+                finally:
+                    self._running -= 1
+        except ForecastTimeout:
+            raise
+        except Exception:
+            self._stats['errors'] += 1
+            raise
+
+    def _discard_executor(self, executor):
+        # A worker died (OOM kill, segfault); the next forecast starts a fresh pool
+        logger.error("Forecast worker process died; restarting the pool")
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _job_done(self, key, task):
+        self._jobs.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here so jobs nobody waits for don't log "never retrieved"
+
+    def _observe_fit(self, seconds):
+        if self._fit_seconds is None:
+            self._fit_seconds = seconds
+        else:
+            self._fit_seconds += FIT_SECONDS_SMOOTHING * (seconds - self._fit_seconds)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'running': self._running,
+            'queued': len(self._jobs) - self._running,
+            'avg_fit_ms': round(self._fit_seconds * 1000, 1) if self._fit_seconds is not None else None,
+            **self._stats,
+        }
+
+    def gauges(self):
+        """Point-in-time values for metrics.render()."""
+        stats = self.stats()
+        return {
+            "forecast_running": ("Forecast fits running in the process pool.", stats['running']),
+            "forecast_queued": ("Forecasts waiting for a pool worker.", stats['queued']),
+            "forecast_rejected": ("Forecast requests shed with 503 since startup.", stats['rejected']),
+            "forecast_timeouts": ("Forecast requests past their deadline since startup.", stats['timeouts']),
+        }
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                logger.info("Stopped forecast pool")
+        # The semaphore belongs to the event loop that is going away
+        self._slots = None
+        self._jobs.clear()
+
+
+forecast_pool = ForecastPool(FORECAST_WORKERS, FORECAST_QUEUE_SIZE, FORECAST_DEADLINE_SECONDS)
@@ -0,0 +1,192 @@
+"""
+forecast_report.py
+
+Structured forecast results and the text message /predictprice returns.
+A result is a plain dict, so it can cross process boundaries and be stored
+in price_forecasts as is:
+
+    {'asin', 'forecast_days', 'status', 'last_price', 'forecast',
+     'min_price', 'max_price', 'first_crossing_day', 'threshold_pct',
+     'params', 'detail', ...}
+
+`status` is one of drop, drop_unclear, increase, increase_unclear or
+stable for a fitted forecast, and insufficient_data, invalid_data,
+insufficient_unique or error when no forecast could be made (`detail`
+then carries the row count or error text).
+
+Classification only needs the forecast values, so a stored forecast for a
+longer horizon answers any shorter one by slicing: the first k steps of a
+Holt forecast do not depend on how many steps follow. A fresh fit also
+carries its final `state` (level, trend and the in-sample one-step mean
+squared error `mse`), from which reforecast() answers any horizon
+without refitting. This module
+imports nothing heavy, so the API can render stored forecasts without
+loading pandas/statsmodels.
+"""
+SIGNIFICANCE_THRESHOLD = 0.01   # 1% change from the current price
+FORECAST_MAX_DAYS = 365         # longest horizon the forecast endpoints accept
+
+FAILURE_STATUSES = ('insufficient_data', 'invalid_data', 'insufficient_unique', 'error')
+DATA_FAILURE_STATUSES = FAILURE_STATUSES[:3]   # follow from the history alone, whatever the horizon
+
+
+def failure(asin, forecast_days, status, detail):
+    return {'asin': asin, 'forecast_days': forecast_days, 'status': status, 'detail': detail}
+
+
+def classify(asin, forecast_days, last_price, forecast, params=None, state=None):
+    """Result dict for `forecast` (one value per day) against `last_price`."""
+    forecast = [float(v) for v in forecast[:forecast_days]]
+    last_price = float(last_price)
+    drop_value = last_price * (1 - SIGNIFICANCE_THRESHOLD)
+    increase_value = last_price * (1 + SIGNIFICANCE_THRESHOLD)
+    min_price, max_price = min(forecast), max(forecast)
+
+    crossing = None
+    if min_price < drop_value and last_price > 0:  # last_price > 0 for a meaningful drop
+        crossing = next((i + 1 for i, v in enumerate(forecast) if v < drop_value), None)
+        status = 'drop' if crossing else 'drop_unclear'
+    elif max_price > increase_value:
+        crossing = next((i + 1 for i, v in enumerate(forecast) if v > increase_value), None)
+        status = 'increase' if crossing else 'increase_unclear'
+    else:
+        status = 'stable'
+
+    return {
+        'asin': asin,
+        'forecast_days': forecast_days,
+        'status': status,
+        'last_price': last_price,
+        'forecast': forecast,
+        'min_price': min_price,
+        'max_price': max_price,
+        'first_crossing_day': crossing,
+        'drop_threshold': drop_value,
+        'increase_threshold': increase_value,
+        'threshold_pct': SIGNIFICANCE_THRESHOLD * 100,
+        'params': params or {},
+        **({'state': state} if state is not None else {}),
+    }
+
+
+def reforecast(result, forecast_days):
+    """
+    The result of the same fit for another horizon, from its fitted state:
+    level + (phi + ... + phi^h) * trend. None if the result has no state.
+    """
+    asin, status = result['asin'], result['status']
+    if status in FAILURE_STATUSES:
+        return failure(asin, forecast_days, status, result['detail'])
+    if 'state' not in result:
+        return None
+    level, trend = result['state']['level'], result['state']['trend']
+    phi = result['params']['damping_trend']
+    forecast, damping = [], 0.0
+    for h in range(1, forecast_days + 1):
+        damping += phi ** h
+        forecast.append(level + damping * trend)
+    return classify(asin, forecast_days, result['last_price'], forecast, result['params'], result['state'])
+
+
+def from_stored(asin, forecast_days, row):
+    """
+    Result for a price_forecasts row (queries.STORED_FORECAST_SQL), or None
+    when it cannot answer: new prices arrived after the fit, or the stored
+    horizon is shorter than the one asked for and no model state is saved.
+    """
+    horizon, status, forecast, last_price, params, detail, source_last_ts, latest_ts, level, trend, mse = row
+    if latest_ts is not None and (source_last_ts is None or source_last_ts < latest_ts):
+        return None
+    if status in FAILURE_STATUSES:
+        return failure(asin, forecast_days, status, detail)
+    state = {'level': level, 'trend': trend, 'mse': mse} if level is not None else None
+    if 1 <= forecast_days <= horizon:
+        return classify(asin, forecast_days, last_price, forecast, params, state)
+    if state is not None and forecast_days >= 1:
+        return reforecast(classify(asin, horizon, last_price, forecast, params, state), forecast_days)
+    return None
+
+
+def payload(result, intervals=None):
+    """
+    JSON body of /product/{asin}/forecast: the result without its fitted
+    state, prediction intervals when given, and the text message.
+    """
+    body = {key: value for key, value in result.items() if key != 'state'}
+    if intervals is not None:
+        body['intervals'] = intervals
+    body['message'] = render_message(result)
+    return body
+
+
+def render_message(result):
+    """The /predictprice text for a result dict."""
+    asin, days, status = result['asin'], result['forecast_days'], result['status']
+
+    if status == 'insufficient_data':
+        return (f"Not enough price history data for ASIN {asin} to make a prediction with Holt's method. "
+                f"Found {result['detail']} data points, but requires at least 2.")
+    if status == 'invalid_data':
+        return f"Invalid price data (NaN or Inf values) encountered for ASIN {asin}, cannot proceed with Holt's prediction."
+    if status == 'insufficient_unique':
+        return (f"Not enough unique time-stamped data points for ASIN {asin} (found {result['detail']} after deduplication, requires at least 2) "
+                "for Holt's method prediction.")
+    if status == 'error':
+        return f"Unable to generate price prediction for ASIN {asin} due to an internal error (Holt's method): {result['detail']}"
+
+    last_price = result['last_price']
+    min_price, max_price = result['min_price'], result['max_price']
+    drop_value, increase_value = result['drop_threshold'], result['increase_threshold']
+    pct = result['threshold_pct']
+    header = f"Holt's Linear Trend Price Prediction for ASIN {asin} (next {days} days):\n"
+
+    if status == 'drop':
+        return (
+            f"{header}"
+            f"STATUS: Significant PRICE DROP Anticipated.\n"
+            f"DETAILS:\n"
+            f"  Current Price: ₹{last_price:.2f}\n"
+            f"  The price is forecast to fall below a significant threshold of approximately ₹{drop_value:.2f} (a {pct:.1f}% decrease from current).\n"
+            f"  This initial significant drop is predicted to occur within {result['first_crossing_day']} days.\n"
+            f"  The lowest price forecasted during the {days}-day period is ₹{min_price:.2f}.\n"
+            f"  This represents a potential maximum decrease of ₹{round(last_price - min_price, 2):.2f} from the current price."
+        )
+    if status == 'drop_unclear':
+        return (
+            f"{header}"
+            f"STATUS: Potential Price Drop Indicated - Timing Unclear.\n"
+            f"DETAILS:\n"
+            f"  Current Price: ₹{last_price:.2f}\n"
+            f"  The forecast suggests the price might reach a low of ₹{min_price:.2f}, which is below the significance threshold of ~₹{drop_value:.2f}.\n"
+            f"  However, the exact timing for the price to first cross this threshold within the {days}-day forecast period could not be pinpointed.\n"
+            f"  This situation is uncommon if a drop below the threshold was indeed forecasted. Further analysis might be needed."
+        )
+    if status == 'increase':
+        return (
+            f"{header}"
+            f"STATUS: Significant PRICE INCREASE Anticipated.\n"
+            f"DETAILS:\n"
+            f"  Current Price: ₹{last_price:.2f}\n"
+            f"  The price is forecast to rise above a significant threshold of approximately ₹{increase_value:.2f} (a {pct:.1f}% increase from current).\n"
+            f"  This initial significant increase is predicted to occur within {result['first_crossing_day']} days.\n"
+            f"  The highest price forecasted during the {days}-day period is ₹{max_price:.2f}.\n"
+            f"  This represents a potential maximum increase of ₹{round(max_price - last_price, 2):.2f} from the current price."
+        )
+    if status == 'increase_unclear':
+        return (
+            f"{header}"
+            f"STATUS: Potential Price Increase Indicated - Timing Unclear.\n"
+            f"DETAILS:\n"
+            f"  Current Price: ₹{last_price:.2f}\n"
+            f"  The forecast suggests the price might reach a high of ₹{max_price:.2f}, which is above the significance threshold of ~₹{increase_value:.2f}.\n"
+            f"  However, the exact timing for the price to first cross this threshold within the {days}-day forecast period could not be pinpointed.\n"
+            f"  This situation is uncommon if an increase above the threshold was indeed forecasted. Further analysis might be needed."
+        )
+    return (
+        f"{header}"
+        f"STATUS: Price Expected to Remain RELATIVELY STABLE.\n"
+        f"DETAILS:\n"
+        f"  Current Price: ₹{last_price:.2f}\n"
+        f"  No significant price changes (drops below ~₹{drop_value:.2f} or increases above ~₹{increase_value:.2f}) are predicted based on a {pct:.1f}% threshold.\n"
+        f"  The price is forecast to fluctuate, with an expected range between ₹{min_price:.2f} and ₹{max_price:.2f} over the next {days} days."
+    )
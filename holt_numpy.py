@@ -0,0 +1,321 @@
+"""
+holt_numpy.py
+
+Damped additive Holt for many series at once, in NumPy. It is the model
+ML_predictor_ fits with statsmodels (Holt(y, damped_trend=True,
+initialization_method="estimated")):
+
+    y_hat[t] = l[t-1] + phi * b[t-1]
+    l[t]     = alpha * y[t] + (1 - alpha) * y_hat[t]
+    b[t]     = beta * (l[t] - l[t-1]) + (1 - beta) * phi * b[t-1]
+
+with the same constraints (0 < alpha < 1, 0 <= beta <= alpha,
+0.8 <= phi <= 0.995) and least-squares objective, one step per
+observation. Series are padded into a 2-D array (one row per ASIN) and
+each recursion step updates every row and every candidate parameter set
+at once, so a whole catalog costs a few hundred array operations instead
+of one scipy optimization per series.
+
+The smoothing parameters are searched, not optimized: a coarse grid over
+(alpha, beta / alpha, phi), then rounds of a shrinking 3x3x3 pattern
+search around each series' best point. The initial level and trend need
+no search at all: the one-step errors are linear in them, so their
+least-squares values for every candidate come from a 2x2 system
+accumulated alongside the recursion.
+"""
+import os
+import math
+
+import numpy as np
+
+import forecast_report
+
+ALPHA_BOUNDS = (1e-4, 1 - 1e-4)
+PHI_BOUNDS = (0.8, 0.995)
+GRID = (12, 6, 6)          # alpha x beta/alpha x phi points of the coarse search
+REFINE_ROUNDS = 8          # pattern-search rounds; the step halves every round
+CHUNK_CELLS = 1_000_000    # series x candidates evaluated per pass, bounds memory
+RIDGE = 1e-9               # keeps the 2x2 initial-state system solvable for tiny series
+
+PARAM_NAMES = ('smoothing_level', 'smoothing_trend', 'damping_trend', 'initial_level', 'initial_trend')
+
+SIMULATION_PATHS = int(os.getenv("FORECAST_SIMULATION_PATHS", "2000"))
+INTERVAL_COVERAGE = (0.8, 0.95)
+
+
+# === SERIES PREPARATION ===
+def series_from_rows(rows):
+    """
+    Price values of (ts, price) rows in time order, keeping the last row of
+    any repeated timestamp, as ML_predictor_ does. Returns (values, None),
+    or (None, (status, detail)) with a forecast_report failure status.
+    """
+    if not rows or len(rows) < 2:
+        return None, ('insufficient_data', len(rows))
+    by_ts = {}
+    for ts, price in rows:
+        value = math.nan if price is None else float(price)
+        if not math.isfinite(value):
+            return None, ('invalid_data', None)
+        by_ts.pop(ts, None)   # re-insert so a repeated timestamp keeps its last position
+        by_ts[ts] = value
+    if len(by_ts) < 2:
+        return None, ('insufficient_unique', len(by_ts))
+    return np.fromiter(by_ts.values(), dtype=np.float64, count=len(by_ts)), None
+
+
+def pad_series(series):
+    """(S, T) array of the series left-aligned and zero-padded, and their lengths."""
+    lengths = np.array([len(s) for s in series], dtype=np.int64)
+    Y = np.zeros((len(series), int(lengths.max(initial=0))))
+    for i, s in enumerate(series):
+        Y[i, :len(s)] = s
+    return Y, lengths
+
+
+# === RECURSION ===
+# Every function below takes series sorted by length (ascending), so the
+# rows still inside their series at step t are a suffix Y[lo:] and padding
+# never needs masking.
+def _rows(x, lo, hi=None):
+    """Rows lo:hi of a per-series array; shared (1, K) arrays broadcast as is."""
+    return x if x.shape[0] == 1 else x[lo:hi]
+
+
+def _evaluate(Y, lengths, alpha, beta, phi):
+    """
+    SSE and least-squares initial level/trend of every candidate.
+    Y is (S, T); alpha, beta and phi are (1, K) for candidates shared by all
+    series or (S, K) for per-series ones. Three state channels run
+    together: the data with a zero initial state, and the responses to a
+    unit initial level and a unit initial trend. The latter two do not
+    depend on the data, so they keep the parameters' shape and their sums
+    are copied out as each series ends.
+    """
+    S, T = Y.shape
+    shape = (S, alpha.shape[1])
+    alpha_c, beta_phi_c = 1 - alpha, (1 - beta) * phi
+    ld, bd = np.zeros(shape), np.zeros(shape)
+    l1, b1 = np.ones(alpha.shape), np.zeros(alpha.shape)
+    l2, b2 = np.zeros(alpha.shape), np.ones(alpha.shape)
+    c11, c12, c22 = (np.zeros(alpha.shape) for _ in range(3))
+    s11, s12, s22, r1, r2, ee = (np.zeros(shape) for _ in range(6))
+    active_from = np.searchsorted(lengths, np.arange(T), side='right')
+    ends = np.searchsorted(lengths, np.arange(T + 2), side='left')
+
+    for t in range(T):
+        lo = active_from[t]
+        y = Y[lo:, t, None]
+        ld_s, bd_s = ld[lo:], bd[lo:]
+        a, p = _rows(alpha, lo), _rows(phi, lo)
+        yd = ld_s + p * bd_s
+        e = y - yd
+        y1, y2 = l1 + phi * b1, l2 + phi * b2
+        r1[lo:] += e * _rows(y1, lo)
+        r2[lo:] += e * _rows(y2, lo)
+        ee[lo:] += e * e
+        c11 += y1 * y1
+        c12 += y1 * y2
+        c22 += y2 * y2
+        end_lo, end_hi = ends[t + 1], ends[t + 2]   # series whose last value is y[t]
+        if end_hi > end_lo:
+            s11[end_lo:end_hi] = _rows(c11, end_lo, end_hi)
+            s12[end_lo:end_hi] = _rows(c12, end_lo, end_hi)
+            s22[end_lo:end_hi] = _rows(c22, end_lo, end_hi)
+
+        new_ld = a * y + _rows(alpha_c, lo) * yd
+        bd[lo:] = _rows(beta, lo) * (new_ld - ld_s) + _rows(beta_phi_c, lo) * bd_s
+        ld[lo:] = new_ld
+        new_l1, new_l2 = alpha_c * y1, alpha_c * y2
+        b1 = beta * (new_l1 - l1) + beta_phi_c * b1
+        b2 = beta * (new_l2 - l2) + beta_phi_c * b2
+        l1, l2 = new_l1, new_l2
+
+    ridge = RIDGE * (s11 + s22)
+    s11, s22 = s11 + ridge, s22 + ridge
+    det = s11 * s22 - s12 * s12
+    l0 = (s22 * r1 - s12 * r2) / det
+    b0 = (s11 * r2 - s12 * r1) / det
+    return ee - l0 * r1 - b0 * r2, l0, b0
+
+
+def _final_state(Y, lengths, alpha, beta, phi, l0, b0):
+    """Level, trend and one-step SSE after each series' last observation, all (S,)."""
+    level, trend, sse = l0.copy(), b0.copy(), np.zeros(len(l0))
+    active_from = np.searchsorted(lengths, np.arange(Y.shape[1]), side='right')
+    for t in range(Y.shape[1]):
+        lo = active_from[t]
+        y_hat = level[lo:] + phi[lo:] * trend[lo:]
+        sse[lo:] += (Y[lo:, t] - y_hat) ** 2
+        new_level = alpha[lo:] * Y[lo:, t] + (1 - alpha[lo:]) * y_hat
+        trend[lo:] = beta[lo:] * (new_level - level[lo:]) + (1 - beta[lo:]) * phi[lo:] * trend[lo:]
+        level[lo:] = new_level
+    return level, trend, sse
+
+
+def _to_params(a, f, p):
+    """Search coordinates (alpha, beta/alpha, phi) to model parameters."""
+    return a, f * a, p
+
+
+def _search(Y, lengths, grid, rounds):
+    S = Y.shape[0]
+    (a_lo, a_hi), (p_lo, p_hi) = ALPHA_BOUNDS, PHI_BOUNDS
+    a_axis = np.linspace(a_lo, a_hi, grid[0])
+    f_axis = np.linspace(0.0, 1.0, grid[1])
+    p_axis = np.linspace(p_lo, p_hi, grid[2])
+    A, F, P = (x.ravel()[None, :] for x in np.meshgrid(a_axis, f_axis, p_axis, indexing='ij'))
+
+    sse, _, _ = _evaluate(Y, lengths, *_to_params(A, F, P))
+    best = np.argmin(sse, axis=1)
+    a, f, p = A[0, best], F[0, best], P[0, best]
+
+    steps = np.array([(a_hi - a_lo) / max(grid[0] - 1, 1),
+                      1.0 / max(grid[1] - 1, 1),
+                      (p_hi - p_lo) / max(grid[2] - 1, 1)])
+    offsets = np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing='ij')).reshape(3, -1)
+    rows = np.arange(S)
+    for _ in range(rounds):
+        steps = steps / 2
+        ca = np.clip(a[:, None] + offsets[0] * steps[0], a_lo, a_hi)
+        cf = np.clip(f[:, None] + offsets[1] * steps[1], 0.0, 1.0)
+        cp = np.clip(p[:, None] + offsets[2] * steps[2], p_lo, p_hi)
+        sse, _, _ = _evaluate(Y, lengths, *_to_params(ca, cf, cp))
+        best = np.argmin(sse, axis=1)
+        a, f, p = ca[rows, best], cf[rows, best], cp[rows, best]
+
+    alpha, beta, phi = _to_params(a, f, p)
+    sse, l0, b0 = _evaluate(Y, lengths, alpha[:, None], beta[:, None], phi[:, None])
+    return alpha, beta, phi, l0[:, 0], b0[:, 0], sse[:, 0]
+
+
+# === PUBLIC API ===
+def fit(series, grid=GRID, rounds=REFINE_ROUNDS):
+    """
+    Fit every series (a sequence of 1-D float arrays with at least two
+    values each). Returns a dict of (S,) arrays: the PARAM_NAMES, the
+    final `level` and `trend`, `sse` and `nobs`.
+    """
+    S = len(series)
+    out = {name: np.empty(S) for name in PARAM_NAMES + ('level', 'trend', 'sse')}
+    out['nobs'] = np.array([len(s) for s in series], dtype=np.int64)
+    if S == 0:
+        return out
+
+    # Similar lengths share a chunk, so padding stays short
+    order = np.argsort(out['nobs'], kind='stable')
+    candidates = max(grid[0] * grid[1] * grid[2], 27)
+    chunk = max(1, CHUNK_CELLS // candidates)
+    for start in range(0, S, chunk):
+        idx = order[start:start + chunk]
+        Y, lengths = pad_series([series[i] for i in idx])
+        # Holt is shift-equivariant: fit relative to the first value for better conditioning
+        offset = Y[:, 0].copy()
+        Y -= offset[:, None]
+
+        alpha, beta, phi, l0, b0, sse = _search(Y, lengths, grid, rounds)
+        level, trend, _ = _final_state(Y, lengths, alpha, beta, phi, l0, b0)
+        for name, values in zip(PARAM_NAMES, (alpha, beta, phi, l0 + offset, b0)):
+            out[name][idx] = values
+        out['level'][idx] = level + offset
+        out['trend'][idx] = trend
+        out['sse'][idx] = sse
+    return out
+
+
+def forecast(level, trend, phi, steps):
+    """(S, steps) forecasts from final states: level + (phi + ... + phi^h) * trend."""
+    level, trend, phi = (np.atleast_1d(np.asarray(x, dtype=np.float64)) for x in (level, trend, phi))
+    damping = np.cumsum(phi[:, None] ** np.arange(1, steps + 1), axis=1)
+    return level[:, None] + damping * trend[:, None]
+
+
+def model_params(model, i):
+    """The fitted parameters of series `i`, named as statsmodels names them."""
+    return {name: float(model[name][i]) for name in PARAM_NAMES}
+
+
+def run(series, alpha, beta, phi, level, trend):
+    """
+    Continue the recursion from given states over each series (new values
+    only, possibly one each). Returns the new level and trend and the sum of
+    squared one-step errors, all (S,): the cost is one step per new value.
+    """
+    order = np.argsort([len(s) for s in series], kind='stable')
+    Y, lengths = pad_series([series[i] for i in order])
+    arrays = [np.asarray(x, dtype=np.float64)[order] for x in (alpha, beta, phi, level, trend)]
+    out = [np.empty(len(series)) for _ in range(3)]
+    for target, values in zip(out, _final_state(Y, lengths, *arrays)):
+        target[order] = values
+    return tuple(out)
+
+
+def final_states(series, params):
+    """
+    Level and trend after the last value of each series under given
+    parameters (a dict of (S,) arrays keyed by PARAM_NAMES), no fitting.
+    """
+    level, trend, _ = run(series, *(params[name] for name in PARAM_NAMES))
+    return level, trend
+
+
+def forecast_results(items, forecast_days):
+    """
+    forecast_report results for (asin, rows) items, with (ts, price) rows
+    as ML_predictor_ takes them. All fittable series are fitted together.
+    """
+    results, fittable = {}, []
+    for asin, rows in items:
+        values, failure = series_from_rows(rows)
+        if failure is not None:
+            results[asin] = forecast_report.failure(asin, forecast_days, *failure)
+        else:
+            fittable.append((asin, values))
+
+    model = fit([values for _, values in fittable])
+    forecasts = forecast(model['level'], model['trend'], model['damping_trend'], forecast_days)
+    for i, (asin, values) in enumerate(fittable):
+        state = {'level': float(model['level'][i]), 'trend': float(model['trend'][i]),
+                 'mse': float(model['sse'][i] / model['nobs'][i])}
+        results[asin] = forecast_report.classify(asin, forecast_days, values[-1], forecasts[i],
+                                                 model_params(model, i), state)
+    return [results[asin] for asin, _ in items]
+
+
+def _simulate(state, params, steps, paths, seed):
+    """(steps, paths) simulated values; step-major so each step writes one contiguous row."""
+    alpha, beta, phi = (params[name] for name in PARAM_NAMES[:3])
+    errors = np.random.default_rng(seed).standard_normal((steps, paths))
+    errors *= math.sqrt(max(state['mse'], 0.0))
+    level = np.full(paths, float(state['level']))
+    trend = np.full(paths, float(state['trend']))
+    out = np.empty((steps, paths))
+    for h in range(steps):
+        y_hat = level + phi * trend
+        np.add(y_hat, errors[h], out=out[h])
+        level = y_hat + alpha * errors[h]
+        trend = phi * trend + alpha * beta * errors[h]
+    return out
+
+
+def simulate(state, params, steps, paths=SIMULATION_PATHS, seed=0):
+    """
+    (paths, steps) simulated futures of a fitted model: the recursion driven
+    by N(0, mse) one-step errors, all paths advanced together each step.
+    A fixed seed keeps the answer for a given fit reproducible.
+    """
+    return _simulate(state, params, steps, paths, seed).T
+
+
+def prediction_intervals(result, paths=SIMULATION_PATHS, coverage=INTERVAL_COVERAGE):
+    """
+    Simulated prediction intervals for a forecast_report result with fitted
+    state, keyed by coverage percent: {'80': {'lower': [...], 'upper': [...]}}.
+    """
+    values = _simulate(result['state'], result['params'], result['forecast_days'], paths, seed=0)
+    tails = [q for c in coverage for q in ((1 - c) / 2, (1 + c) / 2)]
+    bounds = np.quantile(values, tails, axis=1)
+    return {
+        f"{c * 100:g}": {'lower': bounds[2 * i].tolist(), 'upper': bounds[2 * i + 1].tolist()}
+        for i, c in enumerate(coverage)
+    }
@@ -0,0 +1,256 @@
+"""
+metrics.py
+
+Request and query metrics for the API, exported at /metrics in the
+Prometheus text format.
+
+- MetricsMiddleware records per-route latency histograms, status counts
+  and the number of requests in flight. Routes are labelled by their path
+  template ("/products/{asin}"), not the raw URL.
+- TimedCursor (psycopg2 cursor_factory) times every statement, counts the
+  rows it returned and attributes both to the route being served, which
+  the middleware publishes through a context variable. record_query() is
+  the driver-neutral hook the async app uses for psycopg 3.
+- Statements slower than SLOW_QUERY_MS are logged with their route, row
+  count and SQL.
+"""
+import os
+import re
+import time
+import bisect
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("metrics.slow_query")
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_SQL_CHARS = 500
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+NO_ROUTE = "none"          # statements run outside a request (startup, ETL listener)
+UNMATCHED_ROUTE = "unmatched"
+
+# ASGI scope of the request being served; the router adds scope["route"] once it matches
+_request_scope = ContextVar("metrics_request_scope", default=None)
+
+# Statement times of the current request, kept only while a profiler asks for them
+_query_seconds = ContextVar("metrics_query_seconds", default=None)
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter()        # (route, method, status) -> count
+        self.latency = {}                # (route, method) -> Histogram
+        self.in_flight = 0
+        self.queries = {}                # route -> Histogram
+        self.query_rows = Counter()      # route -> rows returned
+        self.query_errors = Counter()    # route -> failed statements
+        self.slow_queries = Counter()    # route -> statements over SLOW_QUERY_MS
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, route, method, status, seconds):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests[(route, method, str(status))] += 1
+            hist = self.latency.get((route, method))
+            if hist is None:
+                hist = self.latency[(route, method)] = Histogram(LATENCY_BUCKETS)
+            hist.observe(seconds)
+
+    def query_finished(self, route, seconds, rows, failed):
+        with self._lock:
+            hist = self.queries.get(route)
+            if hist is None:
+                hist = self.queries[route] = Histogram(QUERY_BUCKETS)
+            hist.observe(seconds)
+            if rows and rows > 0:
+                self.query_rows[route] += rows
+            if failed:
+                self.query_errors[route] += 1
+            if seconds * 1000 >= SLOW_QUERY_MS:
+                self.slow_queries[route] += 1
+
+
+metrics = Metrics()
+
+
+def current_route():
+    scope = _request_scope.get()
+    if scope is None:
+        return NO_ROUTE
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+# === QUERY TIMING ===
+def record_query(sql, params, seconds, rows, failed=False):
+    """Record one executed statement against the current route."""
+    if isinstance(sql, str) and not sql.strip():
+        return  # pool health checks run an empty statement
+    route = current_route()
+    metrics.query_finished(route, seconds, rows, failed)
+    timings = _query_seconds.get()
+    if timings is not None:
+        timings.append(seconds)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        text = WHITESPACE_RE.sub(' ', sql if isinstance(sql, str) else str(sql)).strip()
+        slow_query_logger.warning(
+            f"Slow query on {route}: {seconds * 1000:.1f} ms, {rows} rows: "
+            f"{text[:SLOW_QUERY_SQL_CHARS]} params={str(params)[:200]}"
+        )
+
+
+@contextmanager
+def collect_query_seconds():
+    """
+    Collect the durations of statements run in the current context while
+    the block runs, including asyncio.to_thread workers started from it
+    (they copy the context). Yields the list they are appended to.
+    """
+    timings = []
+    token = _query_seconds.set(timings)
+    try:
+        yield timings
+    finally:
+        _query_seconds.reset(token)
+
+
+class TimedCursor(extensions.cursor):
+    """psycopg2 cursor that reports each execute() to record_query."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            rows = self.rowcount if not failed else 0
+            record_query(query, vars, time.perf_counter() - start, rows, failed)
+
+    def fetchmany(self, *args, **kwargs):
+        # Server-side (named) cursors do their work in FETCH, not in execute()
+        if self.name is None:
+            return super().fetchmany(*args, **kwargs)
+        start = time.perf_counter()
+        rows = super().fetchmany(*args, **kwargs)
+        record_query(f"FETCH FROM {self.name}", None, time.perf_counter() - start, len(rows))
+        return rows
+
+
+# === MIDDLEWARE ===
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        token = _request_scope.set(scope)
+        metrics.request_started()
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or UNMATCHED_ROUTE
+            metrics.request_finished(route, scope["method"], status, time.perf_counter() - start)
+            _request_scope.reset(token)
+
+
+# === EXPORT ===
+def _labels(**labels):
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _histogram_lines(name, hist, labels):
+    lines, cumulative = [], 0
+    for bound, count in zip(hist.buckets, hist.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {hist.count}")
+    lines.append(f"{name}_sum{_labels(**labels)} {hist.sum:.6f}")
+    lines.append(f"{name}_count{_labels(**labels)} {hist.count}")
+    return lines
+
+
+def render(extra_gauges=None):
+    """
+    Prometheus text exposition of everything recorded so far.
+    `extra_gauges` maps metric name -> (help, value) for point-in-time
+    values owned elsewhere (pool and cache stats).
+    """
+    out = []
+    with metrics._lock:
+        out += ["# HELP http_requests_total Requests served, by route, method and status.",
+                "# TYPE http_requests_total counter"]
+        for (route, method, status), n in sorted(metrics.requests.items()):
+            out.append(f"http_requests_total{_labels(route=route, method=method, status=status)} {n}")
+
+        out += ["# HELP http_request_duration_seconds Request latency, by route and method.",
+                "# TYPE http_request_duration_seconds histogram"]
+        for (route, method), hist in sorted(metrics.latency.items()):
+            out += _histogram_lines("http_request_duration_seconds", hist, {'route': route, 'method': method})
+
+        out += ["# HELP http_requests_in_flight Requests currently being served.",
+                "# TYPE http_requests_in_flight gauge",
+                f"http_requests_in_flight {metrics.in_flight}"]
+
+        out += ["# HELP db_query_duration_seconds SQL statement latency, by the route that ran it.",
+                "# TYPE db_query_duration_seconds histogram"]
+        for route, hist in sorted(metrics.queries.items()):
+            out += _histogram_lines("db_query_duration_seconds", hist, {'route': route})
+
+        for name, help_text, counter in (
+            ("db_query_rows_total", "Rows returned by SQL statements, by route.", metrics.query_rows),
+            ("db_query_errors_total", "SQL statements that raised, by route.", metrics.query_errors),
+            ("db_slow_queries_total", f"SQL statements slower than {SLOW_QUERY_MS:g} ms, by route.",
+             metrics.slow_queries),
+        ):
+            out += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for route, n in sorted(counter.items()):
+                out.append(f"{name}{_labels(route=route)} {n}")
+
+    for name, (help_text, value) in (extra_gauges or {}).items():
+        out += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+    return '\n'.join(out) + '\n'
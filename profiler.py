@@ -0,0 +1,221 @@
+"""
+profiler.py
+
+Opt-in sampling profiler for single handler invocations. Set
+API_PROFILING=1 to enable it, then send `X-Profile: 1` (or `?profile=1`)
+with a request to a handler decorated with @profiled. While the handler
+runs, a sampler thread records its thread's Python stack every
+PROFILE_INTERVAL_MS. Each stack is rooted at "sql" when a cursor
+execute/fetch is on it and at "python" otherwise. The result is written
+to PROFILE_DIR in collapsed-stack format (flamegraph.pl, speedscope) and
+summarized in the X-Profile-File and X-Profile-Summary response headers.
+
+With API_PROFILING unset, @profiled returns the handler unchanged and no
+middleware is installed, so there is no per-request cost at all.
+
+For async handlers the sampled thread is the event loop's: their queries
+run on asyncio.to_thread workers or the async driver, and forecast fits in
+the process pool, so the stacks hold little besides the loop, and stacks
+from other requests served concurrently show up too (profile those on a
+quiet instance). Their sql_ms is therefore not taken from the samples but
+measured by the cursors (metrics.record_query), and python_ms is the rest
+of the wall time, waits on the forecast pool included.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import functools
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("API_PROFILING", "") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/priceinsights-profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY_FLAGS = {"profile=1", "profile=true"}
+
+SQL_FRAMES = ("Cursor.execute", "Cursor.fetchmany", "Cursor.fetchall", "Cursor.fetchone")
+
+# The sampler only runs when it gets the GIL, so the interpreter's switch
+# interval (5 ms by default) is lowered while any profile is running
+_switch_lock = threading.Lock()
+_active_samplers = 0
+_saved_switch_interval = None
+
+# Per-request holder for the profile summary; only set for flagged requests
+_profile_request = ContextVar("profile_request", default=None)
+
+
+def _is_sql_frame(code):
+    qualname = getattr(code, "co_qualname", code.co_name)
+    return qualname.endswith(SQL_FRAMES) or f"{os.sep}psycopg" in code.co_filename
+
+
+def _frame_label(code):
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+
+class Sampler:
+    """Samples one thread's stack on a background thread until stopped."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = {'sql': 0, 'python': 0}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels, in_sql = [], False
+            while frame is not None:
+                code = frame.f_code
+                in_sql = in_sql or _is_sql_frame(code)
+                labels.append(_frame_label(code))
+                frame = frame.f_back
+            root = 'sql' if in_sql else 'python'
+            self.samples[root] += 1
+            self.stacks[';'.join([root] + labels[::-1])] += 1
+
+    def __enter__(self):
+        global _active_samplers, _saved_switch_interval
+        with _switch_lock:
+            if _active_samplers == 0:
+                _saved_switch_interval = sys.getswitchinterval()
+                sys.setswitchinterval(min(_saved_switch_interval, self.interval))
+            _active_samplers += 1
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        global _active_samplers
+        self._stop.set()
+        self._thread.join()
+        self.wall_ms = (time.perf_counter() - self.started) * 1000
+        with _switch_lock:
+            _active_samplers -= 1
+            if _active_samplers == 0:
+                sys.setswitchinterval(_saved_switch_interval)
+
+    def summary(self, sql_seconds=None):
+        """Wall time split by sample share, or by `sql_seconds` when SQL time was measured."""
+        total = sum(self.samples.values())
+        if sql_seconds is None:
+            sql_ms = self.wall_ms * (self.samples['sql'] / total if total else 0.0)
+        else:
+            sql_ms = min(sql_seconds * 1000, self.wall_ms)
+        return (f"wall_ms={self.wall_ms:.1f}; sql_ms={sql_ms:.1f}; "
+                f"python_ms={self.wall_ms - sql_ms:.1f}; samples={total}")
+
+
+def _save(name, sampler):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{name}.collapsed")
+    with open(path, "w") as f:
+        for stack, count in sampler.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+
+def _finish(holder, name, sampler, sql_seconds=None):
+    try:
+        holder['file'] = _save(name, sampler)
+    except OSError as e:
+        logger.error(f"Could not save profile for {name}: {e}")
+    holder['summary'] = sampler.summary(sql_seconds)
+    logger.info(f"Profiled {name}: {holder['summary']}")
+
+
+def profiled(func):
+    """
+    Profile `func` on requests that ask for it. Returns `func` itself when
+    profiling is disabled.
+    """
+    if not PROFILING_ENABLED:
+        return func
+
+    interval = PROFILE_INTERVAL_MS / 1000
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            holder = _profile_request.get()
+            if holder is None:
+                return await func(*args, **kwargs)
+            with metrics.collect_query_seconds() as timings, \
+                    Sampler(threading.get_ident(), interval) as sampler:
+                result = await func(*args, **kwargs)
+            _finish(holder, func.__name__, sampler, sum(timings))
+            return result
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        holder = _profile_request.get()
+        if holder is None:
+            return func(*args, **kwargs)
+        with Sampler(threading.get_ident(), interval) as sampler:
+            result = func(*args, **kwargs)
+        _finish(holder, func.__name__, sampler)
+        return result
+    return wrapper
+
+
+class ProfileRequestMiddleware:
+    """
+    Marks requests carrying the profile flag and adds the profile headers
+    to their responses. Installed only when profiling is enabled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._flagged(scope):
+            return await self.app(scope, receive, send)
+
+        holder = {}
+        token = _profile_request.set(holder)
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start" and holder:
+                headers = list(message.get("headers", []))
+                if 'file' in holder:
+                    headers.append((b"x-profile-file", holder['file'].encode()))
+                headers.append((b"x-profile-summary", holder['summary'].encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            _profile_request.reset(token)
+
+    @staticmethod
+    def _flagged(scope):
+        for name, value in scope.get("headers", ()):
+            if name == PROFILE_HEADER and value.strip() in (b"1", b"true"):
+                return True
+        query = scope.get("query_string", b"").decode("latin-1")
+        return any(part in PROFILE_QUERY_FLAGS for part in query.split("&"))
+
+
+def install(app):
+    """Add the request middleware when profiling is enabled; a no-op otherwise."""
+    if PROFILING_ENABLED:
+        app.add_middleware(ProfileRequestMiddleware)
+        logger.warning(f"Request profiling enabled; profiles are written to {PROFILE_DIR}")
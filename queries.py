@@ -0,0 +1,586 @@
+"""
+queries.py
+
+SQL shared by the sync (api.py) and async (api_async.py) request paths.
+Both drivers use %s placeholders, so the same statements and parameter
+tuples work unchanged with psycopg2 and psycopg 3.
+"""
+import re
+import json
+import base64
+from itertools import groupby
+
+import downsample
+import fastjson
+
+# All products with their latest raw_price & raw_discount
+PRODUCTS_SQL = """
+SELECT
+  p.asin,
+  p.title,
+  p.high_res_image_url,
+  p.image_url,
+  p.category,
+  p.availability,
+  ph.raw_price,
+  ph.raw_discount,
+  ph.ts AS last_scraped
+FROM products p
+LEFT JOIN product_latest_price ph ON ph.asin = p.asin
+ORDER BY
+  NOT COALESCE(p.availability, FALSE),
+  COALESCE(p.title, ''),
+  p.asin;
+    """
+
+# === CATALOG PAGINATION ===
+# Columns ?fields= may project; asin is always returned.
+PRODUCT_FIELDS = {
+    'asin':               'p.asin',
+    'title':              'p.title',
+    'high_res_image_url': 'p.high_res_image_url',
+    'image_url':          'p.image_url',
+    'category':           'p.category',
+    'availability':       'p.availability',
+    'raw_price':          'ph.raw_price',
+    'raw_discount':       'ph.raw_discount',
+    'last_scraped':       'ph.ts',
+}
+
+PRODUCTS_PAGE_DEFAULT = 48
+PRODUCTS_PAGE_MAX = 500
+
+# Keyset over (unavailable, title, asin); matching index:
+#   CREATE INDEX products_listing_idx ON products
+#     ((NOT COALESCE(availability, FALSE)), (COALESCE(title, '')), asin);
+PRODUCTS_PAGE_SQL = """
+SELECT {columns},
+  NOT COALESCE(p.availability, FALSE) AS _k_unavailable,
+  COALESCE(p.title, '') AS _k_title
+FROM products p
+LEFT JOIN product_latest_price ph ON ph.asin = p.asin
+{where}
+ORDER BY
+  NOT COALESCE(p.availability, FALSE),
+  COALESCE(p.title, ''),
+  p.asin
+LIMIT %s
+"""
+
+PRODUCTS_PAGE_AFTER = """
+WHERE (NOT COALESCE(p.availability, FALSE), COALESCE(p.title, ''), p.asin) > (%s, %s, %s)
+"""
+
+# Rows fetched per round trip by the /products/stream server-side cursor
+STREAM_BATCH_SIZE = 1000
+
+# Planner row estimate instead of COUNT(*)
+PRODUCTS_ESTIMATE_SQL = """
+SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE oid = 'products'::regclass
+"""
+
+PRODUCT_SQL = """
+    SELECT asin, title, high_res_image_url, category, availability
+    FROM products
+    WHERE asin = %s
+"""
+
+PRICE_HISTORY_SQL = """
+    SELECT raw_price, raw_discount, ts, price
+    FROM price_history
+    WHERE asin = %s {range}
+    ORDER BY ts ASC -- Ensure chronological order for the chart
+"""
+
+# Series the Holt forecast is fitted on
+FORECAST_HISTORY_SQL = """
+    SELECT ts, price
+    FROM price_history
+    WHERE asin = %s
+    ORDER BY ts ASC
+"""
+
+# Data stamp of an ASIN's history, the forecast memo key (forecast_memo.py)
+FORECAST_STAMP_SQL = """
+    SELECT latest_ts, observation_count
+    FROM product_price_stats
+    WHERE asin = %s
+"""
+
+# Precomputed forecast (database_pipeline/forecast_prices.py) and the
+# ASIN's latest price time, to tell whether the forecast is still current,
+# with the model state it was computed from when that is still saved
+STORED_FORECAST_SQL = """
+    SELECT f.horizon_days, f.status, f.forecast, f.last_price, f.model_params,
+           f.detail, f.source_last_ts, lp.ts, s.level, s.trend, s.fit_mse
+    FROM price_forecasts f
+    LEFT JOIN product_latest_price lp ON lp.asin = f.asin
+    LEFT JOIN price_model_state s ON s.asin = f.asin AND s.last_ts = f.source_last_ts
+    WHERE f.asin = %s
+"""
+
+# Data versions for ETag / Last-Modified: the ETL bumps products.updated_at
+# and product_latest_price.ts, so their maxima change whenever data does.
+CATALOG_VERSION_SQL = """
+    SELECT GREATEST(
+        (SELECT MAX(updated_at) FROM products),
+        (SELECT MAX(ts) FROM product_latest_price)
+    )
+"""
+
+PRODUCT_VERSION_SQL = """
+    SELECT GREATEST(p.updated_at, lp.ts), s.observation_count
+    FROM products p
+    LEFT JOIN product_latest_price lp ON lp.asin = p.asin
+    LEFT JOIN product_price_stats s ON s.asin = p.asin
+    WHERE p.asin = %s
+"""
+
+PRODUCTS_BATCH_MAX = 300
+
+PRODUCTS_BATCH_SQL = """
+    SELECT asin, title, high_res_image_url, category, availability
+    FROM products
+    WHERE asin = ANY(%s)
+"""
+
+PRICE_HISTORY_BATCH_SQL = """
+    SELECT asin, raw_price, raw_discount, ts, price
+    FROM price_history
+    WHERE asin = ANY(%s) {range}
+    ORDER BY asin, ts ASC
+"""
+
+# Prioritize prefix matches in title, then general title matches, then category matches.
+SUGGEST_SQL = """
+    SELECT value
+    FROM (
+        SELECT title AS value, 1 AS priority FROM products WHERE title ILIKE %s
+        UNION ALL
+        SELECT title AS value, 2 AS priority FROM products WHERE title ILIKE %s AND title NOT ILIKE %s -- Avoid duplicating prefix matches
+        UNION ALL
+        SELECT category AS value, 3 AS priority FROM products WHERE category ILIKE %s
+    ) AS suggestions
+    WHERE value IS NOT NULL AND value != ''
+    GROUP BY value
+    ORDER BY MIN(priority), value -- Order by best priority, then alphabetically
+    LIMIT 5
+"""
+
+# Top products with the most unique raw_price changes
+TRENDING_SQL = """
+    SELECT
+      p.asin,
+      p.title,
+      p.high_res_image_url,
+      p.image_url,
+      p.category,
+      p.availability,
+      ph_latest.raw_price,
+      ph_latest.raw_discount,
+      ph_latest.ts AS last_scraped,
+      s.distinct_price_count AS unique_price_changes
+    FROM product_price_stats s
+    JOIN products p ON p.asin = s.asin
+    LEFT JOIN product_latest_price ph_latest ON ph_latest.asin = p.asin
+    ORDER BY s.distinct_price_count DESC
+    LIMIT 12;
+    """
+
+# Top products whose latest price change inside the window was a drop that
+# still stands; a range scan over price_change_events by ts
+DEALS_WINDOW_HOURS = 48
+
+DEALS_SQL = """
+    SELECT
+        p.asin,
+        p.title,
+        p.high_res_image_url,
+        p.image_url,
+        p.category,
+        p.availability,
+        plp.raw_price,    -- Consistent naming for frontend
+        plp.raw_discount, -- Consistent naming for frontend
+        e.ts AS last_scraped,       -- Timestamp of the price drop
+        e.new_price AS current_numeric_price,
+        e.old_price AS previous_numeric_price,
+        -e.pct_change AS discount_percentage
+    FROM (
+        SELECT DISTINCT ON (asin) asin, ts, old_price, new_price, pct_change
+        FROM price_change_events
+        WHERE ts >= NOW() - make_interval(hours => %s)
+        ORDER BY asin, ts DESC
+    ) e
+    JOIN products p ON p.asin = e.asin
+    JOIN product_latest_price plp ON plp.asin = e.asin
+    WHERE e.new_price < e.old_price
+      AND plp.price = e.new_price -- The drop has not been reversed since
+    ORDER BY discount_percentage DESC, e.ts DESC
+    LIMIT 12;
+    """
+
+# Top products by discount from their highest historical price
+BESTSELLERS_SQL = """
+    SELECT
+        p.asin,
+        p.title,
+        p.high_res_image_url,
+        p.image_url, -- Keep this for consistency, even if high_res is preferred
+        p.category,
+        p.availability,
+        plp.raw_price, -- Frontend expects raw_price
+        plp.raw_discount, -- Frontend expects raw_discount
+        plp.ts AS last_scraped,
+        s.latest_price AS current_numeric_price,
+        s.max_price AS max_historic_price_numeric,
+        s.drop_from_max_pct AS effective_discount_percentage
+    FROM product_price_stats s
+    JOIN products p ON p.asin = s.asin
+    JOIN product_latest_price plp ON plp.asin = s.asin
+    WHERE p.availability = TRUE -- Only consider available products
+      AND s.latest_price IS NOT NULL
+      AND s.drop_from_max_pct > 5 -- Arbitrary threshold for a meaningful discount
+    ORDER BY s.drop_from_max_pct DESC
+    LIMIT 12;
+    """
+
+
+def suggest_params(q):
+    return (f"{q}%", f"%{q}%", f"{q}%", f"%{q}%")  # Pass q% twice for the NOT ILIKE condition
+
+
+def build_search_query(q):
+    """
+    Builds the product search statement for a user query,
+    with improved handling for typos, missing spaces, and partial matches.
+    Returns (query, params).
+    """
+    # Parse the query to extract any special filters
+    price_under = None
+    
+    # Check for "under $X" pattern
+    price_match = re.search(r'under\s*\$?(\d+)', q.lower())
+    if price_match:
+        price_under = int(price_match.group(1))
+    
+    # Extract base search term (removing filters)
+    base_term = re.sub(r'under\s*\$?\d+', '', q.lower()).strip()
+    
+    # Preprocessing search term
+    # 1. Remove special characters
+    clean_term = re.sub(r'[^\w\s]', '', base_term)
+    # 2. Transform hyphenated terms to both hyphenated and non-hyphenated versions
+    search_variants = [clean_term]
+    
+    # Handle hyphenation: "tp-link" should find "tplink" and vice versa
+    if '-' in clean_term:
+        search_variants.append(clean_term.replace('-', ''))
+    else:
+        # Find possible hyphenation points in compound words
+        # Look for common brand patterns like "tplink" -> "tp-link"
+        common_prefixes = ['tp', 'wi', 'dl', 'net', 'web', 'air', 'my', 'home', 'smart', 'blue', 'fire']
+        for prefix in common_prefixes:
+            if clean_term.startswith(prefix) and len(clean_term) > len(prefix):
+                hyphenated_variant = f"{prefix}-{clean_term[len(prefix):]}"
+                search_variants.append(hyphenated_variant)
+    
+    # 3. Split into words to search for each word individually
+    words = clean_term.split()
+    
+    # Build the query with all necessary product details and improved search logic
+    query = """
+        SELECT 
+            p.asin,
+            p.title,
+            p.high_res_image_url,
+            p.image_url,
+            p.category,
+            p.availability,
+            ph.raw_price,
+            ph.raw_discount,
+            ph.ts AS last_scraped,
+            similarity(p.title, %s) as title_similarity
+        FROM products p
+        LEFT JOIN product_latest_price ph ON ph.asin = p.asin
+        WHERE 1=1
+    """
+    
+    # Start with params containing the full query for similarity calculation
+    params = [base_term]
+    
+    # Build a complex WHERE clause that matches any of our variants
+    where_clauses = []
+    
+    # 1. Add full term matching (both original and variants)
+    for variant in search_variants:
+        where_clauses.append("p.title ILIKE %s")
+        params.append(f"%{variant}%")
+    
+    # 2. Add category matching
+    where_clauses.append("p.category ILIKE %s")
+    params.append(f"%{clean_term}%")
+    
+    # 3. Match individual words (if there are multiple)
+    if len(words) > 1:
+        for word in words:
+            if len(word) >= 3:  # Only consider words of significant length
+                where_clauses.append("p.title ILIKE %s")
+                params.append(f"%{word}%")
+    
+    # 4. Use trigram similarity for fuzzy matching (helps with typos)
+    # Only apply this for terms that are long enough
+    if len(clean_term) >= 4:
+        where_clauses.append("similarity(p.title, %s) > 0.3")
+        params.append(clean_term)
+    
+    # Combine all WHERE conditions with OR
+    if where_clauses:
+        query += " AND (" + " OR ".join(where_clauses) + ")"
+    
+    # 5. Add price filter if specified
+    if price_under:
+        query += " AND CAST(REGEXP_REPLACE(COALESCE(ph.raw_price, '0'), '[^0-9.]', '', 'g') AS DECIMAL) < %s"
+        params.append(price_under)
+    
+    # Improved ordering to prioritize best matches
+    query += """
+        ORDER BY 
+            CASE WHEN p.title ILIKE %s THEN 100 ELSE 0 END +  -- Exact match
+            CASE WHEN p.title ILIKE %s THEN 50 ELSE 0 END +   -- Starts with match
+            similarity(p.title, %s) * 30 +                     -- Overall similarity
+            CASE 
+                WHEN p.title ~* %s THEN 25                     -- Regex pattern match
+                ELSE 0 
+            END DESC,
+            ph.ts DESC NULLS LAST
+        LIMIT 30
+    """
+    
+    # Add parameters for the ORDER BY clause
+    params.append(f"{clean_term}")        # Exact match
+    params.append(f"{clean_term}%")       # Starts with
+    params.append(clean_term)             # For similarity
+    
+    # Regex pattern to find words that might be split or joined incorrectly
+    # e.g., "tplink" should match "tp-link" and vice versa
+    pattern = '|'.join([re.escape(w) for w in words if len(w) >= 2])
+    if pattern:
+        params.append(pattern)
+    else:
+        params.append(clean_term)  # Fallback if no words to create pattern
+
+    return query, tuple(params)
+
+
+def search_results(cols, rows):
+    results = []
+    for row in rows:
+        result_dict = dict(zip(cols, row))
+        # Remove the similarity score before returning to client
+        if 'title_similarity' in result_dict:
+            del result_dict['title_similarity']
+        results.append(result_dict)
+    return results
+
+
+def _history_range(params, start, end):
+    conditions = []
+    if start is not None:
+        conditions.append("AND ts >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("AND ts <= %s")
+        params.append(end)
+    return ' '.join(conditions)
+
+
+def price_history_query(asin, start=None, end=None):
+    """PRICE_HISTORY_SQL for one ASIN, optionally limited to [start, end]."""
+    params = [asin]
+    return PRICE_HISTORY_SQL.format(range=_history_range(params, start, end)), tuple(params)
+
+
+def price_history_batch_query(asins, start=None, end=None):
+    """PRICE_HISTORY_BATCH_SQL for a list of ASINs, optionally limited to [start, end]."""
+    params = [list(asins)]
+    return PRICE_HISTORY_BATCH_SQL.format(range=_history_range(params, start, end)), tuple(params)
+
+
+def parse_batch_asins(asins):
+    """De-duplicated ASIN list for POST /products/batch; raises ValueError past the limit."""
+    unique = list(dict.fromkeys(a.strip() for a in asins if a and a.strip()))
+    if len(unique) > PRODUCTS_BATCH_MAX:
+        raise ValueError(f"At most {PRODUCTS_BATCH_MAX} ASINs per request")
+    return unique
+
+
+def product_details_payload(product_row, history_rows):
+    return {
+        "asin": product_row[0],
+        "title": product_row[1],
+        "image_url": product_row[2],
+        "category": product_row[3],
+        "availability": product_row[4],
+        "price_history": [
+            {
+                "raw_price": row[0],
+                "raw_discount": row[1],
+                "timestamp": row[2].isoformat()  # Use consistent key name with frontend
+            } for row in history_rows
+        ]
+    }
+
+
+HISTORY_FORMATS = ('rows', 'columnar')
+DISCOUNT_RE = re.compile(r'(\d+(?:\.\d+)?)\s*%')
+
+
+def parse_discount(raw_discount):
+    """'16% off' -> 16; None when there is no percentage."""
+    match = DISCOUNT_RE.search(raw_discount or '')
+    if not match:
+        return None
+    value = float(match.group(1))
+    return int(value) if value.is_integer() else value
+
+
+def _json_number(value):
+    if value is None:
+        return None
+    return int(value) if value == value.to_integral_value() else float(value)
+
+
+def columnar_history(history_rows, weights=None):
+    """
+    Price history as parallel arrays, one entry per run of consecutive rows
+    with the same price and discount. `ts` holds the epoch second of each
+    run's first row, delta encoded (the first value is absolute); `count`
+    is the number of observations in the run and `last_ts` the epoch second
+    of the final observation. `weights` gives the observations each row
+    stands for when the rows are a downsampled history (default 1 each);
+    `returned` is the number of rows the runs were built from.
+    """
+    ts, price, discount, count = [], [], [], []
+    prev_key, prev_epoch, last_epoch = None, 0, None
+    for i, (raw_price, raw_discount, row_ts, numeric_price) in enumerate(history_rows):
+        epoch = int(row_ts.timestamp())
+        key = (raw_price, raw_discount)
+        weight = weights[i] if weights is not None else 1
+        last_epoch = epoch
+        if key == prev_key:
+            count[-1] += weight
+            continue
+        ts.append(epoch - prev_epoch)
+        price.append(_json_number(numeric_price))
+        discount.append(parse_discount(raw_discount))
+        count.append(weight)
+        prev_key, prev_epoch = key, epoch
+    return {
+        "format": "columnar",
+        "ts": ts,
+        "price": price,
+        "discount": discount,
+        "count": count,
+        "last_ts": last_epoch,
+        "returned": len(history_rows),
+    }
+
+
+def product_details_columnar(product_row, history_rows, weights=None):
+    payload = product_details_payload(product_row, ())
+    payload["price_history"] = columnar_history(history_rows, weights)
+    return payload
+
+
+def product_details(product_row, history_rows, points=None, history_format='rows'):
+    """Product detail payload with its history downsampled and encoded as requested."""
+    keep = downsample.downsample_indices(history_rows, points)
+    history = history_rows if keep is None else [history_rows[i] for i in keep]
+    if history_format == 'columnar':
+        # A kept row stands for the observations up to the next kept row,
+        # so run counts still add up to the full history
+        weights = None if keep is None else [end - start for start, end in zip(keep, keep[1:] + [len(history_rows)])]
+        return product_details_columnar(product_row, history, weights)
+    return product_details_payload(product_row, history)
+
+
+def products_batch_payload(asins, product_rows, history_rows, points=None, history_format='rows'):
+    """
+    Map of ASIN -> product detail payload for POST /products/batch, in
+    request order; unknown ASINs map to None. `history_rows` are
+    (asin, raw_price, raw_discount, ts, price) ordered by asin, ts.
+    """
+    histories = {
+        asin: [row[1:] for row in group]
+        for asin, group in groupby(history_rows, key=lambda row: row[0])
+    }
+    products = {row[0]: row for row in product_rows}
+    return {
+        asin: product_details(products[asin], histories.get(asin, []), points, history_format)
+        if asin in products else None
+        for asin in asins
+    }
+
+
+def parse_fields(fields):
+    """Turn a ?fields=a,b,c value into a column list; None means all columns."""
+    if not fields:
+        return list(PRODUCT_FIELDS)
+    names = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in names if f not in PRODUCT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    if 'asin' not in names:
+        names.insert(0, 'asin')
+    return names
+
+
+def encode_cursor(unavailable, title, asin):
+    raw = json.dumps([unavailable, title, asin], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        unavailable, title, asin = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return bool(unavailable), str(title), str(asin)
+
+
+def build_products_page_query(names, cursor, limit):
+    """
+    Keyset page of the catalog in the same order as PRODUCTS_SQL.
+    Fetches one extra row so the caller can tell whether a next page exists;
+    limit=None returns every remaining row (LIMIT NULL).
+    """
+    columns = ', '.join(f"{PRODUCT_FIELDS[n]} AS {n}" for n in names)
+    params = []
+    where = ''
+    if cursor:
+        where = PRODUCTS_PAGE_AFTER
+        params.extend(decode_cursor(cursor))
+    params.append(limit + 1 if limit is not None else None)
+    return PRODUCTS_PAGE_SQL.format(columns=columns, where=where), tuple(params)
+
+
+def strip_page_keys(cols, rows):
+    return [
+        {k: v for k, v in zip(cols, row) if not k.startswith('_k_')}
+        for row in rows
+    ]
+
+
+def products_page_payload(cols, rows, limit, total_estimate):
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = dict(zip(cols, page[-1]))
+        next_cursor = encode_cursor(last['_k_unavailable'], last['_k_title'], last['asin'])
+    return {"items": strip_page_keys(cols, page), "next_cursor": next_cursor, "total_estimate": total_estimate}
+
+
+def ndjson_lines(cols, rows):
+    """Encode one fetched batch as newline-delimited JSON, skipping keyset columns."""
+    return fastjson.ndjson(strip_page_keys(cols, rows))
@@ -0,0 +1,305 @@
+"""
+search_index.py
+
+In-memory product search for /api/search. Titles and categories are
+tokenized into an inverted index with BM25 weights; a character-trigram
+index over the vocabulary supplies typo-tolerant expansions and a sorted
+vocabulary supplies prefix expansions. Hyphens and punctuation are
+indexed both split and joined, and adjacent title words are also indexed
+joined (matched exactly, outside the prefix and typo expansions), with
+queries joined the same way, so "tplink", "tp-link" and "tp link" all
+meet. The index is loaded at API startup and refreshed per ASIN when the
+ETL announces new data (see etl_events.py).
+"""
+import re
+import math
+import time
+import bisect
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+CATEGORY_WEIGHT = 0.5    # a category hit counts half a title hit
+
+PREFIX_WEIGHT = 0.8      # "lapt" -> "laptop"
+MIN_PREFIX_LEN = 3
+FUZZY_MIN_SIMILARITY = 0.45
+MAX_EXPANSIONS = 8
+RESULT_LIMIT = 30
+
+PRICE_UNDER_RE = re.compile(r'under\s*\$?(\d+)')
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+DOCS_SQL = """
+SELECT
+  p.asin,
+  p.title,
+  p.high_res_image_url,
+  p.image_url,
+  p.category,
+  p.availability,
+  ph.raw_price,
+  ph.raw_discount,
+  ph.ts AS last_scraped,
+  ph.price AS numeric_price
+FROM products p
+LEFT JOIN product_latest_price ph ON ph.asin = p.asin
+"""
+
+
+def tokenize(text):
+    """
+    Lowercased alphanumeric tokens. A whitespace chunk with punctuation
+    inside it ("tp-link", "wi-fi") yields its parts and the joined form.
+    """
+    tokens = []
+    for chunk in (text or '').lower().split():
+        parts = WORD_RE.findall(chunk)
+        tokens.extend(parts)
+        if len(parts) > 1:
+            tokens.append(''.join(parts))
+    return tokens
+
+
+def word_pairs(text):
+    """Adjacent words joined, across spaces and punctuation: "tp link" -> "tplink"."""
+    words = WORD_RE.findall((text or '').lower())
+    return [a + b for a, b in zip(words, words[1:])]
+
+
+def trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def parse_query(q):
+    """
+    Split a query into (terms, pairs, price_under) the same way the SQL path
+    does; `pairs` are its adjacent words joined, minus those already terms.
+    """
+    q = q.lower()
+    price_under = None
+    price_match = PRICE_UNDER_RE.search(q)
+    if price_match:
+        price_under = int(price_match.group(1))
+    base_term = PRICE_UNDER_RE.sub('', q).strip()
+    terms = tokenize(base_term)
+    pairs = [pair for pair in word_pairs(base_term) if pair not in terms]
+    return terms, pairs, price_under
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs = {}                      # asin -> result row (dict)
+        self._prices = {}                    # asin -> numeric price or None
+        self._doc_terms = {}                 # asin -> {term: weighted tf}
+        self._doc_len = {}                   # asin -> weighted length
+        self._total_len = 0.0
+        self._postings = defaultdict(dict)   # term -> {asin: weighted tf}
+        self._pair_postings = defaultdict(dict)  # joined adjacent title words -> {asin: tf}
+        self._doc_pairs = {}                 # asin -> its joined title words
+        self._vocab = []                     # sorted terms, for prefix lookups
+        self._trigrams = defaultdict(set)    # trigram -> terms
+        self._gram_counts = {}               # term -> number of trigrams
+        self.ready = False
+        self.loaded_at = None
+
+    # === BUILD ===
+    def _add_term(self, term):
+        bisect.insort(self._vocab, term)
+        grams = trigrams(term)
+        for tg in grams:
+            self._trigrams[tg].add(term)
+        self._gram_counts[term] = len(grams)
+
+    def _drop_term(self, term):
+        i = bisect.bisect_left(self._vocab, term)
+        if i < len(self._vocab) and self._vocab[i] == term:
+            del self._vocab[i]
+        for tg in trigrams(term):
+            self._trigrams[tg].discard(term)
+        del self._gram_counts[term]
+        del self._postings[term]
+
+    def _remove(self, asin):
+        terms = self._doc_terms.pop(asin, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(asin, None)
+            if not postings:
+                self._drop_term(term)
+        for pair in self._doc_pairs.pop(asin):
+            postings = self._pair_postings[pair]
+            postings.pop(asin, None)
+            if not postings:
+                del self._pair_postings[pair]
+        self._total_len -= self._doc_len.pop(asin)
+        self._docs.pop(asin, None)
+        self._prices.pop(asin, None)
+
+    def _add(self, row):
+        asin = row['asin']
+        self._remove(asin)
+        weights = defaultdict(float)
+        for term in tokenize(row.get('title')):
+            weights[term] += 1.0
+        for term in tokenize(row.get('category')):
+            weights[term] += CATEGORY_WEIGHT
+        for term, tf in weights.items():
+            if term not in self._postings:
+                self._add_term(term)
+            self._postings[term][asin] = tf
+        pairs = defaultdict(float)
+        for pair in word_pairs(row.get('title')):
+            pairs[pair] += 1.0
+        for pair, tf in pairs.items():
+            self._pair_postings[pair][asin] = tf
+        self._doc_pairs[asin] = list(pairs)
+        length = sum(weights.values())
+        self._doc_terms[asin] = weights
+        self._doc_len[asin] = length
+        self._total_len += length
+        self._prices[asin] = row.pop('numeric_price', None)
+        self._docs[asin] = row
+
+    def load(self, conn):
+        """Rebuild the whole index from the database."""
+        with conn.cursor() as cur:
+            cur.execute(DOCS_SQL)
+            cols = [c.name for c in cur.description]
+            rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        fresh = SearchIndex()
+        for row in rows:
+            fresh._add(row)
+        with self._lock:
+            for name in ('_docs', '_prices', '_doc_terms', '_doc_len', '_total_len', '_postings',
+                         '_pair_postings', '_doc_pairs', '_vocab', '_trigrams', '_gram_counts'):
+                setattr(self, name, getattr(fresh, name))
+            self.ready = True
+            self.loaded_at = time.time()
+        logger.info(f"Search index loaded with {len(rows)} products")
+
+    def refresh(self, conn, asins):
+        """Re-read only the given ASINs; asins=None reloads everything."""
+        if asins is None or not self.ready:
+            return self.load(conn)
+        asins = list(asins)
+        with conn.cursor() as cur:
+            cur.execute(DOCS_SQL + " WHERE p.asin = ANY(%s)", (asins,))
+            cols = [c.name for c in cur.description]
+            rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        with self._lock:
+            found = set()
+            for row in rows:
+                found.add(row['asin'])
+                self._add(row)
+            for asin in set(asins) - found:
+                self._remove(asin)
+            self.loaded_at = time.time()
+        logger.info(f"Search index refreshed {len(rows)} products")
+
+    # === QUERY ===
+    def _expand(self, term):
+        """
+        Index terms a query term should match, with a weight in (0, 1].
+        An exact vocabulary hit is used as is; otherwise the term is treated
+        as a prefix ("lapt") and then as a misspelling ("samsng").
+        """
+        if term in self._postings:
+            return {term: 1.0}
+        expansions = {}
+        if len(term) >= MIN_PREFIX_LEN:
+            i = bisect.bisect_left(self._vocab, term)
+            while i < len(self._vocab) and self._vocab[i].startswith(term) and len(expansions) < MAX_EXPANSIONS:
+                expansions.setdefault(self._vocab[i], PREFIX_WEIGHT)
+                i += 1
+        if len(term) >= 4 and len(expansions) < MAX_EXPANSIONS:
+            query_grams = trigrams(term)
+            shared = defaultdict(int)
+            for tg in query_grams:
+                for candidate in self._trigrams.get(tg, ()):
+                    shared[candidate] += 1
+            scored = []
+            for candidate, n in shared.items():
+                sim = n / (len(query_grams) + self._gram_counts[candidate] - n)
+                if sim >= FUZZY_MIN_SIMILARITY and candidate not in expansions:
+                    scored.append((sim, candidate))
+            scored.sort(reverse=True)
+            for sim, candidate in scored[:MAX_EXPANSIONS - len(expansions)]:
+                expansions[candidate] = sim
+        return expansions
+
+    def _score(self, best, postings, weight, n_docs, avg_len):
+        """Keep in `best` each document's highest BM25 score for one query term."""
+        idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+        for asin, tf in postings.items():
+            norm = tf * (K1 + 1) / (tf + K1 * (1 - B + B * self._doc_len[asin] / avg_len))
+            score = weight * idf * norm
+            if score > best.get(asin, 0.0):
+                best[asin] = score
+
+    def search(self, q, limit=RESULT_LIMIT):
+        """
+        Ranked product rows for a raw query string, honoring "under $X".
+        Documents match if any query term (or an expansion of it) matches;
+        a query that is only a price filter matches every product under it.
+        """
+        terms, pairs, price_under = parse_query(q)
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs or not (terms or price_under):
+                return []
+            avg_len = self._total_len / n_docs
+            # Without terms every score ties, so the most recently scraped come first, as in SQL
+            scores = defaultdict(float) if terms else dict.fromkeys(self._docs, 0.0)
+            for term in dict.fromkeys(terms + pairs):
+                best = {}
+                if term in terms:
+                    expansions = self._expand(term)
+                    if term in self._pair_postings:
+                        expansions[term] = 1.0
+                else:
+                    # Joined query words ("tp link" -> "tplink") only match a title word exactly
+                    expansions = {term: 1.0} if term in self._postings else {}
+                for expansion, weight in expansions.items():
+                    postings = self._postings.get(expansion, {})
+                    if expansion == term and term in self._pair_postings:
+                        # Titles spelling the term as two words ("tplink" -> "TP Link") hold it too
+                        postings = {**self._pair_postings[term], **postings}
+                    self._score(best, postings, weight, n_docs, avg_len)
+                for asin, score in best.items():
+                    scores[asin] += score
+
+            if price_under:
+                scores = {
+                    asin: s for asin, s in scores.items()
+                    if (self._prices.get(asin) or 0) < price_under
+                }
+            ranked = sorted(
+                scores.items(),
+                key=lambda item: (item[1], self._docs[item[0]].get('last_scraped') is not None,
+                                  self._docs[item[0]].get('last_scraped') or 0),
+                reverse=True,
+            )
+            return [dict(self._docs[asin]) for asin, _ in ranked[:limit]]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'documents': len(self._docs),
+                'terms': len(self._postings),
+                'trigrams': len(self._trigrams),
+                'loaded_at': self.loaded_at,
+            }
+
+
+product_index = SearchIndex()